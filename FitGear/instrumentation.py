@@ -0,0 +1,232 @@
+"""
+Opt-in per-request instrumentation.
+
+`RequestMetricsMiddleware` records, for every request, the number of SQL
+queries, the time spent in the database, in DRF serializers and in template
+rendering. It reports them in a `Server-Timing` header and aggregates them
+per URL name. Enable it with `REQUEST_METRICS_ENABLED = True`; when
+disabled the middleware removes itself at startup and costs nothing.
+
+Aggregates live in the worker process and are flushed to the default cache
+every REQUEST_METRICS_FLUSH_INTERVAL seconds, so the `request_metrics`
+management command and `/api/metrics/requests/` can merge all workers
+(given a cache backend shared between processes).
+"""
+import contextvars
+import os
+import socket
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# Upper bounds (ms) of the latency histogram buckets; the last one is open.
+LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+INDEX_KEY = "request-metrics:processes"
+
+_current = contextvars.ContextVar("request_metrics", default=None)
+_lock = threading.Lock()
+_aggregates = {}
+_last_flush = 0.0
+_patched = False
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serializer = 0.0
+        self.template = 0.0
+        # Nesting depth per timed section, so nested serializers or templates
+        # are not counted twice.
+        self.depth = {"serializer": 0, "template": 0}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - start
+            self.queries += 1
+
+
+def _timed(section, func):
+    def wrapper(*args, **kwargs):
+        metrics = _current.get()
+        if metrics is None or metrics.depth[section]:
+            return func(*args, **kwargs)
+        metrics.depth[section] += 1
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.depth[section] -= 1
+            setattr(metrics, section, getattr(metrics, section) + time.perf_counter() - start)
+
+    wrapper.__wrapped__ = func
+    return wrapper
+
+
+def _patch_timers():
+    # Serializer and template time have no hooks of their own; wrap the
+    # entry points once. The wrappers are no-ops outside recorded requests.
+    global _patched
+    if _patched:
+        return
+    from django.template.backends.django import Template
+    from rest_framework import serializers
+
+    for cls in (serializers.Serializer, serializers.ListSerializer):
+        data = cls.data
+        cls.data = property(_timed("serializer", data.fget))
+    Template.render = _timed("template", Template.render)
+    _patched = True
+
+
+def _empty_aggregate():
+    return {
+        "count": 0,
+        "total_ms": 0.0,
+        "db_ms": 0.0,
+        "serializer_ms": 0.0,
+        "template_ms": 0.0,
+        "queries": 0,
+        "max_queries": 0,
+        "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+    }
+
+
+def _record(view_name, total_ms, metrics):
+    with _lock:
+        aggregate = _aggregates.setdefault(view_name, _empty_aggregate())
+        aggregate["count"] += 1
+        aggregate["total_ms"] += total_ms
+        aggregate["db_ms"] += metrics.db * 1000
+        aggregate["serializer_ms"] += metrics.serializer * 1000
+        aggregate["template_ms"] += metrics.template * 1000
+        aggregate["queries"] += metrics.queries
+        aggregate["max_queries"] = max(aggregate["max_queries"], metrics.queries)
+        bucket = next(
+            (i for i, bound in enumerate(LATENCY_BUCKETS) if total_ms <= bound),
+            len(LATENCY_BUCKETS),
+        )
+        aggregate["latency_buckets"][bucket] += 1
+
+
+def _process_key():
+    return f"request-metrics:{socket.gethostname()}:{os.getpid()}"
+
+
+def local_snapshot():
+    with _lock:
+        return {name: dict(a, latency_buckets=list(a["latency_buckets"])) for name, a in _aggregates.items()}
+
+
+def flush(force=False):
+    """Publish this process' aggregates to the cache (rate limited)."""
+    global _last_flush
+    now = time.monotonic()
+    if not force and now - _last_flush < getattr(settings, "REQUEST_METRICS_FLUSH_INTERVAL", 10):
+        return
+    _last_flush = now
+    key = _process_key()
+    cache.set(key, local_snapshot(), None)
+    processes = cache.get(INDEX_KEY) or []
+    if key not in processes:
+        cache.set(INDEX_KEY, processes + [key], None)
+
+
+def merge(*snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for name, aggregate in snapshot.items():
+            target = merged.setdefault(name, _empty_aggregate())
+            for field in ("count", "total_ms", "db_ms", "serializer_ms", "template_ms", "queries"):
+                target[field] += aggregate[field]
+            target["max_queries"] = max(target["max_queries"], aggregate["max_queries"])
+            target["latency_buckets"] = [
+                a + b for a, b in zip(target["latency_buckets"], aggregate["latency_buckets"])
+            ]
+    return merged
+
+
+def collect():
+    """Merge the aggregates of every process that has flushed to the cache."""
+    flush(force=bool(_aggregates))
+    keys = cache.get(INDEX_KEY) or []
+    return merge(*cache.get_many(keys).values())
+
+
+def summarize(aggregates):
+    """Per-view averages plus the raw histogram, sorted by total time spent."""
+    rows = []
+    for name, a in aggregates.items():
+        count = a["count"] or 1
+        rows.append(
+            {
+                "view": name,
+                "count": a["count"],
+                "avg_ms": round(a["total_ms"] / count, 3),
+                "avg_db_ms": round(a["db_ms"] / count, 3),
+                "avg_serializer_ms": round(a["serializer_ms"] / count, 3),
+                "avg_template_ms": round(a["template_ms"] / count, 3),
+                "avg_queries": round(a["queries"] / count, 2),
+                "max_queries": a["max_queries"],
+                "latency_histogram": dict(
+                    zip([f"<={b}ms" for b in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}ms"], a["latency_buckets"])
+                ),
+            }
+        )
+    return sorted(rows, key=lambda row: row["avg_ms"] * row["count"], reverse=True)
+
+
+def reset():
+    global _last_flush
+    with _lock:
+        _aggregates.clear()
+    keys = cache.get(INDEX_KEY) or []
+    cache.delete_many(keys + [INDEX_KEY])
+    _last_flush = 0.0
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_METRICS_ENABLED", False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        _patch_timers()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total_ms = (time.perf_counter() - start) * 1000
+
+        # URL names are not unique across apps (api and market both have
+        # "add-to-cart"), so the route pattern goes along with the name.
+        match = getattr(request, "resolver_match", None)
+        view_name = f"{match.view_name} ({match.route})" if match else "<unresolved>"
+        _record(view_name, total_ms, metrics)
+        flush()
+
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={metrics.db * 1000:.2f};desc="{metrics.queries} queries"',
+                f"serializer;dur={metrics.serializer * 1000:.2f}",
+                f"template;dur={metrics.template * 1000:.2f}",
+                f"total;dur={total_ms:.2f}",
+            ]
+        )
+        return response
@@ -54,6 +54,10 @@ REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
 }
 
+# Keyset pagination (api.pagination.KeysetPagination)
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
 GRAPHQL_JWT = {
     "JWT_VERIFY_EXPIRATION": True,
     "JWT_LONG_RUNNING_REFRESH_TOKEN": True,
@@ -61,6 +65,7 @@ GRAPHQL_JWT = {
 }
 
 MIDDLEWARE = [
+    "FitGear.instrumentation.RequestMetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -73,6 +78,11 @@ MIDDLEWARE = [
 
 CORS_ORIGIN_ALLOW_ALL = True
 
+# Per-request SQL/serializer/template timing (FitGear.instrumentation). Off by
+# default; when off the middleware removes itself at startup.
+REQUEST_METRICS_ENABLED = False
+REQUEST_METRICS_FLUSH_INTERVAL = 10
+
 ROOT_URLCONF = "FitGear.urls"
 AUTH_USER_MODEL = "users.User"
 LOGIN_URL = "/user/login/"
@@ -107,6 +117,57 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "fitgear",
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
+# Product detail cache (market.cache); point the alias at any configured backend.
+# A product change retires its entries through a per-product version key in
+# this cache, so with the default per-process LocMemCache other workers keep
+# serving the old entry until PRODUCT_CACHE_TIMEOUT expires it. Keep the
+# timeout short unless the alias is a shared backend (Redis, Memcached).
+PRODUCT_CACHE_ALIAS = "default"
+PRODUCT_CACHE_TIMEOUT = 60
+
+# Whole main page for anonymous visitors, per category/search/sort; any
+# catalog change retires it, the timeout only bounds the memory it holds.
+MAIN_PAGE_CACHE_TIMEOUT = 60 * 5
+
+# The catalog version lives in the database (market.models.CatalogVersion);
+# each process caches it this many seconds, which bounds how long another
+# process's catalog change can go unnoticed here.
+CATALOG_VERSION_TIMEOUT = 5
+
+
+# Bill rendering (market.billing): worker threads per process, 0 renders inline.
+BILL_WORKERS = 2
+BILL_JOB_TIMEOUT = 60 * 60 * 24
+
+
+# Reviews per page on the product page and its infinite-scroll endpoint.
+REVIEWS_PAGE_SIZE = 20
+
+
+# Sale pricing (market.pricing): (minimum age in days, price factor) pairs.
+PRODUCT_SALE_RULES = [(30, "0.8")]
+
+# Price facet bucket bounds (market.facets); the last bucket is open-ended.
+PRODUCT_PRICE_BUCKETS = [0, 25, 50, 100, 250, 500]
+
+# Product image derivatives (market.images): name -> bounding box in pixels,
+# encoded as WebP. Worker threads per process, 0 generates inline.
+IMAGE_VARIANTS = {"thumb": (320, 320), "large": (1200, 1200)}
+IMAGE_WEBP_QUALITY = 80
+IMAGE_WORKERS = 2
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -149,6 +210,11 @@ STATICFILES_DIRS = [BASE_DIR / "static"]
 MEDIA_ROOT = BASE_DIR / "static/media"
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
+# Offload file downloads to the web server: None, "x-accel-redirect" or "x-sendfile".
+# SENDFILE_URL_PREFIX is the internal nginx location that maps to MEDIA_ROOT.
+SENDFILE_BACKEND = None
+SENDFILE_URL_PREFIX = "/protected-media/"
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
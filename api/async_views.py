@@ -0,0 +1,220 @@
+"""
+Async variants of the read-heavy API endpoints, under /api/async/.
+
+They return the same responses as their sync counterparts (products list
+and detail, cart, orders list) but are coroutines reading through Django's
+async ORM. Served by the ASGI application (FitGear/asgi.py), a request
+waiting on the database does not occupy one of a fixed number of worker
+threads: Django runs each request's database calls in a thread of its own
+and the event loop keeps accepting requests meanwhile, so one process
+handles many more concurrent requests than a WSGI worker's thread pool.
+Under WSGI they still work, each request running its own event loop.
+
+`python manage.py loadtest` compares both paths (market/loadtest.py).
+"""
+import asyncio
+from calendar import timegm
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch
+from django.http import Http404
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from drf_spectacular.utils import OpenApiParameter, extend_schema
+from rest_framework import status
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from market.cache import aget_cached_product
+from market.categories import in_categories
+from market.models import Cart, CartItem, Product
+
+from . import views
+from .pagination import KeysetPagination
+from .renderers import FastJSONRenderer
+from .rows import get_row_serializer
+from .serializers import CartSerializer, OrderSerializer, ProductListSerializer, ProductSerializer
+from .utils import (
+    catalog_etag,
+    catalog_last_modified,
+    filter_orders_by_params,
+    filter_orders_by_role,
+    requested_categories,
+    requested_fields,
+)
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView with coroutine handlers. DRF 3.14 only calls sync handlers, so
+    this dispatch runs authentication, permission and throttling checks
+    (sync code that may query the database) in a thread, then awaits the
+    handler.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            # OPTIONS and 405s are answered by APIView's sync handlers.
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+def async_condition(etag_func, last_modified_func):
+    """django.views.decorators.http.condition for coroutine handlers."""
+
+    def decorator(handler):
+        @wraps(handler)
+        async def inner(self, request, *args, **kwargs):
+            # Both may read the database (the catalog version row).
+            etag = quote_etag(await sync_to_async(etag_func)(request, *args, **kwargs))
+            last_modified = await sync_to_async(last_modified_func)(request, *args, **kwargs)
+            last_modified = int(timegm(last_modified.utctimetuple()))
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await handler(self, request, *args, **kwargs)
+            if request.method in ("GET", "HEAD"):
+                if not response.has_header("Last-Modified"):
+                    response.headers["Last-Modified"] = http_date(last_modified)
+                response.headers.setdefault("ETag", etag)
+            return response
+
+        return inner
+
+    return decorator
+
+
+class AsyncProductsAPIView(AsyncAPIView):
+    permission_classes = [AllowAny]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    pagination_class = KeysetPagination
+    ordering_fields = views.ProductsAPIView.ordering_fields
+
+    @extend_schema(
+        description="Async variant of GET /api/products/, with the same parameters and responses.",
+        parameters=[
+            OpenApiParameter(name="page_size", type=int, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="cursor", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="ordering", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="fields", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="category", type=int, many=True, location=OpenApiParameter.QUERY, required=False),
+        ],
+        responses={200: ProductListSerializer(many=True)},
+        tags=["Async"],
+    )
+    @async_condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+    async def get(self, request):
+        rows = get_row_serializer(ProductListSerializer, requested_fields(request))
+        products = Product.objects.all()
+        categories = requested_categories(request)
+        if categories:
+            products = products.filter(in_categories(categories))
+        products = rows.values(products, "pk", *self.ordering_fields.values())
+        paginator = self.pagination_class()
+        page = await paginator.apaginate_queryset(products, request, view=self)
+        if page is not None:
+            return paginator.get_paginated_response(await rows.arender(page))
+
+        products = paginator.order_queryset(products, request, view=self)
+        return Response(await rows.arender([row async for row in products]))
+
+
+class AsyncProductAPIView(AsyncAPIView):
+    permission_classes = [AllowAny]
+
+    @extend_schema(
+        description="Async variant of GET /api/products/<id>/, with the same parameters and responses.",
+        parameters=[
+            OpenApiParameter(name="fields", type=str, location=OpenApiParameter.QUERY, required=False),
+        ],
+        responses={200: ProductSerializer()},
+        tags=["Async"],
+    )
+    @async_condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+    async def get(self, request, pk):
+        fields = requested_fields(request)
+        # Validates the field names; the cached payload is always complete.
+        ProductSerializer(fields=fields)
+
+        async def build():
+            try:
+                product = await Product.objects.select_related("category").aget(id=pk)
+            except Product.DoesNotExist:
+                raise Http404("No Product matches the given query.")
+            return ProductSerializer(product).data
+
+        data = await aget_cached_product(pk, "api", build)
+        if fields:
+            data = {name: value for name, value in data.items() if name in fields}
+        return Response(data)
+
+
+class AsyncCartAPIView(AsyncAPIView):
+    @extend_schema(
+        description="Async variant of GET /api/cart/, with the same parameters and responses.",
+        responses={200: CartSerializer()},
+        tags=["Async"],
+    )
+    async def get(self, request):
+        carts = Cart.objects.select_related("user").prefetch_related(
+            Prefetch("items", queryset=CartItem.objects.select_related("product__category"))
+        )
+        cart, created = await carts.aget_or_create(user=request.user)
+        if created:
+            # get_or_create() does not prefetch what it creates.
+            cart = await carts.aget(pk=cart.pk)
+        serializer = CartSerializer(cart, fields=requested_fields(request))
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class AsyncOrdersAPIView(AsyncAPIView):
+    permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    pagination_class = KeysetPagination
+
+    @extend_schema(
+        description="Async variant of GET /api/orders/, with the same parameters and responses.",
+        parameters=[
+            OpenApiParameter(name="from", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="to", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="status", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="page_size", type=int, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="cursor", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="fields", type=str, location=OpenApiParameter.QUERY, required=False),
+        ],
+        responses={200: OrderSerializer(many=True)},
+        tags=["Async"],
+    )
+    async def get(self, request):
+        orders = filter_orders_by_role(request.user)
+        orders = filter_orders_by_params(orders, request.query_params)
+
+        rows = get_row_serializer(OrderSerializer, requested_fields(request))
+        paginator = self.pagination_class()
+        orders = rows.values(orders, "pk", paginator.ordering_field)
+        page = await paginator.apaginate_queryset(orders, request, view=self)
+        if page is not None:
+            return paginator.get_paginated_response(await rows.arender(page))
+
+        orders = paginator.order_queryset(orders)
+        return Response(await rows.arender([row async for row in orders]))
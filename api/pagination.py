@@ -0,0 +1,230 @@
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from market.pagination import decode_cursor, encode_cursor
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (cursor) pagination over a nullable, indexed column plus the primary key.
+
+    Unlike offset pagination every page is fetched with an indexed range
+    condition, so the cost of a page does not grow with its position.
+    Pagination is opt-in: it is only applied when the request carries a
+    `cursor` or `page_size` query parameter, otherwise the view keeps
+    returning a plain list.
+    """
+
+    ordering_field = "created"
+    ordering_param = "ordering"
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_default_page_size(self):
+        return getattr(settings, "API_PAGE_SIZE", 50)
+
+    def get_max_page_size(self):
+        return getattr(settings, "API_MAX_PAGE_SIZE", 500)
+
+    def is_requested(self, request):
+        params = request.query_params
+        return self.cursor_query_param in params or self.page_size_query_param in params
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.get_default_page_size()
+        if page_size <= 0:
+            return self.get_default_page_size()
+        return min(page_size, self.get_max_page_size())
+
+    def get_ordering_field(self, request=None, view=None):
+        """
+        Return `(model field, descending)` for the request's `ordering`
+        parameter. Views list the accepted names in `ordering_fields`
+        (public name -> indexed model field); a leading "-" sorts descending.
+        """
+        requested = request.query_params.get(self.ordering_param) if request is not None else None
+        if not requested:
+            return self.ordering_field, False
+        ordering_fields = getattr(view, "ordering_fields", {self.ordering_field: self.ordering_field})
+        name = requested[1:] if requested.startswith("-") else requested
+        if name not in ordering_fields:
+            raise ValidationError(
+                {self.ordering_param: [f"Expected one of: {', '.join(sorted(ordering_fields))}."]}
+            )
+        return ordering_fields[name], requested.startswith("-")
+
+    def get_ordering(self, field=None, descending=False):
+        # Descending is the exact reverse of ascending (NULLs first, then pk),
+        # so the same index serves both directions.
+        field = field or self.ordering_field
+        if descending:
+            return (F(field).desc(nulls_last=True), "-pk")
+        return (F(field).asc(nulls_first=True), "pk")
+
+    def order_queryset(self, queryset, request=None, view=None):
+        return queryset.order_by(*self.get_ordering(*self.get_ordering_field(request, view)))
+
+    def encode_cursor(self, instance):
+        # Pages of `.values()` rows (api.rows) carry the field and "pk" as keys.
+        if isinstance(instance, dict):
+            return encode_cursor(instance[self.field], instance["pk"])
+        return encode_cursor(getattr(instance, self.field), instance.pk)
+
+    def decode_cursor(self, request, queryset):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            return decode_cursor(encoded, queryset.model._meta.get_field(self.field))
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+    def filter_after(self, queryset, position):
+        value, pk = position
+        field = self.field
+        if self.descending:
+            if value is None:
+                return queryset.filter(**{f"{field}__isnull": True, "pk__lt": pk})
+            return queryset.filter(
+                Q(**{f"{field}__lt": value})
+                | Q(**{field: value, "pk__lt": pk})
+                | Q(**{f"{field}__isnull": True})
+            )
+        if value is None:
+            return queryset.filter(
+                Q(**{f"{field}__isnull": True, "pk__gt": pk})
+                | Q(**{f"{field}__isnull": False})
+            )
+        return queryset.filter(
+            Q(**{f"{field}__gt": value}) | Q(**{field: value, "pk__gt": pk})
+        )
+
+    def page_queryset(self, queryset, request, view=None):
+        """The (unevaluated) queryset of the requested page plus one row, or None."""
+        if not self.is_requested(request):
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.field, self.descending = self.get_ordering_field(request, view)
+        queryset = queryset.order_by(*self.get_ordering(self.field, self.descending))
+
+        position = self.decode_cursor(request, queryset)
+        if position is not None:
+            queryset = self.filter_after(queryset, position)
+
+        # Fetch one extra row to know whether there is a next page.
+        return queryset[: self.page_size + 1]
+
+    def set_page(self, results):
+        self.has_next = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        return self.page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset for async views, through the async ORM."""
+        queryset = self.page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([row async for row in queryset])
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.page_size_query_param, self.page_size)
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.page[-1])
+        )
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict([("next", self.get_next_link()), ("results", data)])
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class CatalogPagination(KeysetPagination):
+    """KeysetPagination for endpoints that always return pages."""
+
+    def is_requested(self, request):
+        return True
+
+
+class RankedPagination(BasePagination):
+    """
+    Limit/offset pagination for results ordered by a computed rank, which
+    cannot be keyset-paginated. Unlike DRF's LimitOffsetPagination it does
+    not COUNT the matches: one extra row tells whether there is a next page.
+    """
+
+    limit_query_param = "limit"
+    offset_query_param = "offset"
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return getattr(settings, "API_PAGE_SIZE", 50)
+        if limit <= 0:
+            return getattr(settings, "API_PAGE_SIZE", 50)
+        return min(limit, getattr(settings, "API_MAX_PAGE_SIZE", 500))
+
+    def get_offset(self, request):
+        try:
+            return max(int(request.query_params[self.offset_query_param]), 0)
+        except (KeyError, ValueError):
+            return 0
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.offset = self.get_offset(request)
+        results = list(queryset[self.offset : self.offset + self.limit + 1])
+        self.has_next = len(results) > self.limit
+        return results[: self.limit]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict([("next", self.get_next_link()), ("results", data)])
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -0,0 +1,235 @@
+"""
+Read-only fast path for the hot list endpoints.
+
+`RowSerializer` compiles a ModelSerializer once into the `.values()`
+columns it reads and one converter per field, then renders plain row
+dicts: no model instance is built and no serializer field is looked up per
+object. Single nested serializers are read from joined columns
+(`customer__username`), many-valued ones (`order_items`) from one extra
+`.values()` query per page. The output equals the serializer's `.data`
+when it is used without a request in its context, as the API views do.
+
+Only model fields, primary key relations, nested ModelSerializers and
+fields declaring `source_columns`/`from_columns` compile; anything else
+(properties, method fields ...) raises UnsupportedField, and the
+serializer has to be used instead.
+"""
+import decimal
+from functools import lru_cache
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+# Fields whose to_representation() returns the value the database driver
+# already gives back.
+PASSTHROUGH_FIELDS = (
+    serializers.CharField,
+    serializers.IntegerField,
+    serializers.BooleanField,
+    PrimaryKeyRelatedField,
+)
+
+
+class UnsupportedField(TypeError):
+    pass
+
+
+def _converted(column, convert):
+    def get(row):
+        value = row[column]
+        return None if value is None else convert(value)
+
+    return get
+
+
+def _file_url(column, storage):
+    # Most rows share a handful of file names (the default image ...).
+    url = lru_cache(maxsize=1024)(storage.url)
+
+    def get(row):
+        name = row[column]
+        return url(name) if name else None
+
+    return get
+
+
+def _decimal_converter(field):
+    """DecimalField.to_representation with its quantize context built once."""
+    coerce_to_string = getattr(field, "coerce_to_string", api_settings.COERCE_DECIMAL_TO_STRING)
+    if not coerce_to_string or field.localize or field.decimal_places is None:
+        return field.to_representation
+    exponent = decimal.Decimal(1).scaleb(-field.decimal_places)
+    context = decimal.getcontext().copy()
+    if field.max_digits is not None:
+        context.prec = field.max_digits
+
+    def convert(value):
+        if not isinstance(value, decimal.Decimal):
+            value = decimal.Decimal(str(value).strip())
+        return "{:f}".format(value.quantize(exponent, rounding=field.rounding, context=context))
+
+    return convert
+
+
+def _datetime_converter(field, tz):
+    """DateTimeField.to_representation for the current time zone `tz`."""
+    output_format = getattr(field, "format", api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601 or hasattr(field, "timezone"):
+        return field.to_representation
+
+    def convert(value):
+        if tz is not None:
+            if not timezone.is_aware(value):
+                return field.to_representation(value)
+            value = value.astimezone(tz)
+        value = value.isoformat()
+        return value[:-6] + "Z" if value.endswith("+00:00") else value
+
+    return convert
+
+
+def _nested(column, child):
+    def get(row):
+        return None if row[column] is None else child.render_row(row)
+
+    return get
+
+
+class RowSerializer:
+    def __init__(self, serializer, prefix=""):
+        self.model = serializer.Meta.model
+        self.prefix = prefix
+        self.columns = {}
+        self.getters = []
+        # Datetime columns are converted per page, for the time zone that
+        # is current while rendering: {column: DateTimeField}
+        self.datetimes = {}
+        # (row key, child RowSerializer, name of the child's foreign key)
+        self.many = []
+        for name, field in serializer.fields.items():
+            self.getters.append((name, self.compile_field(name, field)))
+        if self.many:
+            self.columns["pk"] = None
+
+    def unsupported(self, name, reason):
+        return UnsupportedField(f"{type(self).__name__} cannot render {self.model.__name__}.{name}: {reason}.")
+
+    def compile_field(self, name, field):
+        if hasattr(field, "source_columns"):
+            # Computed from several columns, e.g. api.serializers.ProductImageField.
+            columns = [self.prefix + column for column in field.source_columns]
+            self.columns.update(dict.fromkeys(columns))
+            return lambda row: field.from_columns(*[row[column] for column in columns])
+        if field.source == "*" or isinstance(field, serializers.SerializerMethodField):
+            raise self.unsupported(name, "not a model field")
+        attr, *rest = field.source_attrs
+        try:
+            model_field = self.model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            raise self.unsupported(name, "not a model field")
+        column = self.prefix + "__".join(field.source_attrs)
+
+        if isinstance(field, serializers.ListSerializer):
+            if self.prefix or not model_field.one_to_many or rest:
+                raise self.unsupported(name, "only reverse foreign keys of the top-level model can be nested")
+            key = f"{name}:rows"
+            self.many.append((key, RowSerializer(field.child), model_field.field.name))
+            return itemgetter(key)
+
+        if model_field.many_to_many or model_field.one_to_many:
+            raise self.unsupported(name, "many-valued relation")
+
+        if isinstance(field, serializers.ModelSerializer):
+            if rest:
+                raise self.unsupported(name, "nested serializer with a dotted source")
+            child = RowSerializer(field, column + "__")
+            if child.many:
+                raise self.unsupported(name, "many-valued relation below a nested serializer")
+            self.columns[column] = None
+            self.columns.update(child.columns)
+            self.datetimes.update(child.datetimes)
+            return _nested(column, child)
+
+        if isinstance(field, serializers.RelatedField) and not isinstance(field, PrimaryKeyRelatedField):
+            raise self.unsupported(name, f"{type(field).__name__} is not supported")
+
+        self.columns[column] = None
+        if isinstance(field, serializers.FileField):
+            target = model_field
+            if rest:
+                target = model_field.related_model._meta.get_field(rest[-1])
+            return _file_url(column, target.storage)
+        if isinstance(field, serializers.DateTimeField):
+            self.datetimes[column] = field
+            return itemgetter(column)
+        if isinstance(field, PASSTHROUGH_FIELDS):
+            return itemgetter(column)
+        if isinstance(field, serializers.DecimalField):
+            return _converted(column, _decimal_converter(field))
+        return _converted(column, field.to_representation)
+
+    def values(self, queryset, *extra):
+        """`queryset` as row dicts of the columns this serializer reads, plus `extra`."""
+        columns = dict.fromkeys([*self.columns, *extra])
+        return queryset.prefetch_related(None).values(*columns)
+
+    def render_row(self, row):
+        return {name: get(row) for name, get in self.getters}
+
+    def convert_datetimes(self, rows):
+        if self.datetimes:
+            tz = timezone.get_current_timezone() if settings.USE_TZ else None
+            for column, field in self.datetimes.items():
+                convert = _datetime_converter(field, tz)
+                for row in rows:
+                    if row[column] is not None:
+                        row[column] = convert(row[column])
+
+    def children(self, rows, child, foreign_key):
+        """The `.values()` rows of a many-valued field for a page of `rows`."""
+        queryset = child.model._default_manager.filter(**{f"{foreign_key}__in": [row["pk"] for row in rows]})
+        if not queryset.ordered:
+            queryset = queryset.order_by("pk")
+        return child.values(queryset, foreign_key)
+
+    def attach(self, rows, key, foreign_key, child_rows, rendered):
+        children = {}
+        for child_row, data in zip(child_rows, rendered):
+            children.setdefault(child_row[foreign_key], []).append(data)
+        for row in rows:
+            row[key] = children.get(row["pk"], [])
+
+    def render(self, rows):
+        """Render rows from `values()` as the serializer's `.data` (a list) would."""
+        rows = list(rows)
+        self.convert_datetimes(rows)
+        for key, child, foreign_key in self.many:
+            child_rows = list(self.children(rows, child, foreign_key)) if rows else []
+            self.attach(rows, key, foreign_key, child_rows, child.render(child_rows))
+        return [self.render_row(row) for row in rows]
+
+    async def arender(self, rows):
+        """render() for async views: `rows` is a list, children are read through the async ORM."""
+        self.convert_datetimes(rows)
+        for key, child, foreign_key in self.many:
+            child_rows = [row async for row in self.children(rows, child, foreign_key)] if rows else []
+            self.attach(rows, key, foreign_key, child_rows, await child.arender(child_rows))
+        return [self.render_row(row) for row in rows]
+
+
+@lru_cache(maxsize=64)
+def _compile(serializer_class, fields):
+    return RowSerializer(serializer_class(fields=list(fields) if fields else None))
+
+
+def get_row_serializer(serializer_class, fields=None):
+    """
+    The RowSerializer of `serializer_class` restricted to `fields` (see
+    SparseFieldsetMixin), compiled once per field selection.
+    """
+    return _compile(serializer_class, tuple(fields) if fields else None)
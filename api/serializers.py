@@ -1,19 +1,143 @@
+from abc import ABCMeta, abstractmethod
+from functools import lru_cache
+
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from market.images import variant_url, variant_urls
 from market.models import Product, OrderItem, Order, Cart, CartItem, Category
+from market.ratings import STAR_FIELDS, STARS
 from users.models import User
 
 
+class SparseFieldsetMixin:
+    """
+    Render only the given top-level fields: `Serializer(obj, fields=[...])`,
+    usually from the `?fields=` parameter (`api.utils.requested_fields`).
+    Nested serializers always render in full.
+
+    Fields computed from several model columns declare them in
+    `source_columns`, so `api.utils.select_columns` can `.only()` exactly
+    the columns that are rendered.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            unknown = set(fields) - set(self.fields)
+            if unknown:
+                raise ValidationError({"fields": f"Unknown field(s): {', '.join(sorted(unknown))}."})
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class ProductImageField(serializers.Field, metaclass=ABCMeta):
+    """
+    Read-only field computed from the product's `image` and `image_variants`
+    columns (market.images). `source_columns` lets `api.utils.select_columns`
+    and `api.rows.RowSerializer` load exactly those columns; `from_columns`
+    renders their values.
+    """
+
+    source_columns = ("image", "image_variants")
+
+    def __init__(self, **kwargs):
+        kwargs.update(source="*", read_only=True)
+        super().__init__(**kwargs)
+        # Listings render the same few images over and over.
+        self.url = lru_cache(maxsize=1024)(Product._meta.get_field("image").storage.url)
+
+    def to_representation(self, instance):
+        return self.from_columns(instance.image.name, instance.image_variants)
+
+    @abstractmethod
+    def from_columns(self, image, variants):
+        """The representation of an `image` name and its `variants` mapping."""
+
+
+@extend_schema_field(OpenApiTypes.URI)
+class ImageVariantField(ProductImageField):
+    """URL of one derivative of the product image; the original until it is generated."""
+
+    def __init__(self, variant, **kwargs):
+        self.variant = variant
+        super().__init__(**kwargs)
+
+    def from_columns(self, image, variants):
+        return variant_url(self.url, image, variants, self.variant)
+
+
+@extend_schema_field({"type": "object", "additionalProperties": {"type": "string", "format": "uri"}})
+class ImageVariantsField(ProductImageField):
+    """`{variant: URL}` of the generated derivatives of the product image."""
+
+    def from_columns(self, image, variants):
+        return variant_urls(self.url, image, variants)
+
+
+@extend_schema_field({"type": "object", "additionalProperties": {"type": "integer"}})
+class RatingHistogramField(serializers.Field):
+    """`{star: number of reviews}` from the product's denormalized star counters."""
+
+    source_columns = STAR_FIELDS
+
+    def __init__(self, **kwargs):
+        kwargs.update(source="*", read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        return self.from_columns(*[getattr(instance, column) for column in self.source_columns])
+
+    def from_columns(self, *counts):
+        return {str(star): count for star, count in zip(STARS, counts)}
+
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ["name"]
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class CategoryTreeSerializer(serializers.ModelSerializer):
+    """A node of the category tree; `product_count` includes the subcategories."""
+
+    depth = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Category
+        fields = ["id", "name", "parent", "depth", "product_count"]
+
+
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     category = CategorySerializer(many= False)
+    rating_histogram = RatingHistogramField()
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Product
-        fields = "__all__"
+        exclude = ["rating_sum", *STAR_FIELDS]
+
+
+class ProductListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Compact product representation for listings: no description, images or histogram."""
+
+    thumbnail = ImageVariantField("thumb")
+    category = serializers.CharField(source="category.name", read_only=True, default=None)
+
+    class Meta:
+        model = Product
+        fields = [
+            "id",
+            "name",
+            "price",
+            "effective_price",
+            "old_price",
+            "thumbnail",
+            "category",
+            "rating_avg",
+            "rating_count",
+        ]
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -30,7 +154,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     user = UserSerializer(many=False)
     items = CartItemSerializer(many=True)  # No need for the source argument
 
@@ -48,7 +172,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     customer = UserSerializer(many=False)
     order_items = OrderItemSerializer(many=True)
 
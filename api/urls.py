@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
@@ -10,8 +10,20 @@ from rest_framework_simplejwt.views import (
 urlpatterns = [
     path("routes/", views.RoutesAPIView.as_view(), name="routes"),
     path("products/", views.ProductsAPIView.as_view(), name="products"),
+    path("products/search/", views.ProductSearchAPIView.as_view(), name="product-search"),
+    path("products/facets/", views.ProductFacetsAPIView.as_view(), name="product-facets"),
     path("products/<int:pk>/", views.ProductAPIView.as_view(), name="product"),
+    path("products/cache-stats/", views.ProductCacheStatsAPIView.as_view(), name="product-cache-stats"),
+    path("categories/", views.CategoriesAPIView.as_view(), name="categories"),
     
+    # Async variants of the read-heavy endpoints, for the ASGI application.
+    path("async/products/", async_views.AsyncProductsAPIView.as_view(), name="async-products"),
+    path("async/products/<int:pk>/", async_views.AsyncProductAPIView.as_view(), name="async-product"),
+    path("async/cart/", async_views.AsyncCartAPIView.as_view(), name="async-view-cart"),
+    path("async/orders/", async_views.AsyncOrdersAPIView.as_view(), name="async-orders"),
+
+    path("metrics/requests/", views.RequestMetricsAPIView.as_view(), name="request-metrics"),
+
     path("cart/", views.CartAPIView.as_view(),name="view-cart"),
     path("cart/add-to-cart/<int:pk>/<int:quantity>/", views.AddToCartAPIView.as_view(), name="add-to-cart"),
     path("cart/update-cart-item/<int:pk>/<int:quantity>/", views.UpdateCartItemAPIView.as_view(), name="update-cart-item"),
@@ -30,6 +42,7 @@ urlpatterns = [
         views.OrderGenBillAPIView.as_view(),
         name="order_gen_bill",
     ),
+    path("bill-jobs/<str:job_id>/", views.BillJobAPIView.as_view(), name="bill_job"),
     path(
         "order/<int:pk>/change-status/",
         views.ChangeOrderStatusAPIView.as_view(),
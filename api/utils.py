@@ -1,17 +1,138 @@
+import hashlib
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.utils.dateparse import parse_date
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
 from users.models import User
-from market.models import Order
+from market.models import Order, OrderItem
+from market.cache import get_catalog_version
+
+
+def with_order_details(queryset):
+    # Everything OrderSerializer touches is loaded up front: the customer is
+    # joined and the items come with their product and category in one extra
+    # query, so the number of queries does not depend on the number of orders.
+    return queryset.select_related("customer").prefetch_related(
+        Prefetch(
+            "order_items",
+            queryset=OrderItem.objects.select_related("product__category"),
+        )
+    )
+
+
+def requested_fields(request):
+    """The field names of a `?fields=a,b` parameter, or None to render everything."""
+    raw = request.query_params.get("fields")
+    if not raw:
+        return None
+    return [name.strip() for name in raw.split(",") if name.strip()] or None
+
+
+def requested_categories(request):
+    """The category ids of repeatable `?category=` parameters, or None."""
+    raw = request.query_params.getlist("category")
+    if not raw:
+        return None
+    try:
+        return sorted({int(value) for value in raw})
+    except ValueError:
+        raise ValidationError({"category": "Expected a category id."})
+
+
+def serializer_columns(serializer, prefix=""):
+    """
+    The model columns `serializer` renders, as `.only()` paths. Single
+    nested serializers are followed through their relation; many-valued
+    ones are left to prefetching.
+    """
+    model = serializer.Meta.model
+    columns = set()
+    for field in serializer.fields.values():
+        if hasattr(field, "source_columns"):
+            columns.update(prefix + column for column in field.source_columns)
+            continue
+        if field.source == "*" or isinstance(field, serializers.ListSerializer):
+            continue
+        attr, *rest = field.source_attrs
+        try:
+            model_field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            continue
+        if model_field.many_to_many or model_field.one_to_many:
+            continue
+        columns.add(prefix + attr)
+        if isinstance(field, serializers.ModelSerializer):
+            columns |= serializer_columns(field, f"{prefix}{attr}__")
+        elif rest and model_field.is_relation:
+            columns.add(f"{prefix}{attr}__{rest[0]}")
+    return columns
+
+
+def select_columns(queryset, serializer, *extra):
+    """
+    Load only the columns `serializer` renders (plus `extra`, e.g. the
+    pagination ordering column), joining the single relations it follows.
+    """
+    columns = serializer_columns(serializer) | set(extra)
+    relations = {column.rsplit("__", 1)[0] for column in columns if "__" in column}
+    if relations:
+        queryset = queryset.select_related(*relations)
+    return queryset.only(*columns)
 
 
 def filter_orders_by_role(user):
     role = user.role
 
-    print(role)
     if role == User.Role.USER:
-        return Order.objects.filter(customer=user)
+        return with_order_details(Order.objects.filter(customer=user))
 
 
     elif role == User.Role.ADMIN:
-        return Order.objects.all()
+        return with_order_details(Order.objects.all())
 
     # Return an empty queryset for unknown roles
-    return Order.objects.none()
\ No newline at end of file
+    return Order.objects.none()
+
+
+def _parse_date_param(name, value):
+    try:
+        date = parse_date(value)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ValidationError({name: "Expected a date in YYYY-MM-DD format."})
+    return date
+
+
+def filter_orders_by_params(queryset, params):
+    from_date = params.get("from")
+    to_date = params.get("to")
+    status = params.get("status")
+
+    if from_date:
+        queryset = queryset.filter(created__date__gte=_parse_date_param("from", from_date))
+
+    if to_date:
+        queryset = queryset.filter(created__date__lte=_parse_date_param("to", to_date))
+
+    if status:
+        if status not in dict(Order.STATUS_CHOICES):
+            raise ValidationError({"status": f"Unknown status {status!r}."})
+        queryset = queryset.filter(status=status)
+
+    return queryset
+
+
+def catalog_etag(request, *args, **kwargs):
+    # The payload of a catalog endpoint only depends on the catalog version
+    # and on the URL (path, pagination cursor, page size ...).
+    version, _ = get_catalog_version()
+    key = f"{version}:{request.get_full_path()}".encode()
+    return hashlib.sha1(key).hexdigest()
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    _, last_modified = get_catalog_version()
+    return last_modified
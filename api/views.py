@@ -1,21 +1,32 @@
 from rest_framework.permissions import IsAuthenticated, AllowAny  
-from django.template.loader import render_to_string
-from django.core.files.base import ContentFile
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.db.models import Prefetch
 from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiParameter
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.generics import UpdateAPIView
 from drf_spectacular.types import OpenApiTypes
 
 from rest_framework.views import APIView
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework import status, permissions
 
-from .serializers import ProductSerializer, OrderItemSerializer, OrderSerializer, CartSerializer, CartItemSerializer
-from market.models import Product, OrderItem, Cart, CartItem, Order
+from .serializers import CategoryTreeSerializer, ProductSerializer, ProductListSerializer, OrderItemSerializer, OrderSerializer, CartSerializer, CartItemSerializer
+from market.models import Product, Cart, CartItem, Order
 from market.forms import OrderCreatForm
+from market.cache import get_cached_product, product_cache_stats
+from market.categories import category_tree, in_categories
+from market.facets import InvalidFacet, ProductFacets
+from market.search import search_products
+from market.utils import add_to_cart, create_order_from_cart
+from market.billing import submit_bill_job, get_bill_job
+from FitGear.instrumentation import collect, summarize
 from users.models import User
-from .utils import filter_orders_by_role
+from .utils import filter_orders_by_role, filter_orders_by_params, with_order_details, catalog_etag, catalog_last_modified, requested_categories, requested_fields, select_columns
+from .pagination import CatalogPagination, KeysetPagination, RankedPagination
+from .renderers import FastJSONRenderer
+from .rows import get_row_serializer
 
 
 from drf_spectacular.utils import extend_schema
@@ -24,6 +35,7 @@ from users.forms import CustomUserCreationForm
 from users.models import User
 from django.contrib.auth import authenticate, login, logout
 from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework_simplejwt.tokens import RefreshToken
 
 
@@ -48,7 +60,9 @@ class RoutesAPIView(APIView):
         routes = [
             {"GET": "/api/routes/"},
             {"GET": "/api/products/"},
+            {"GET": "/api/products/search/?q=<query>"},
             {"GET": "/api/products/<int:pk>/"},
+            {"GET": "/api/categories/"},
             {"GET": "/api/orders/"},
             {"GET": "/api/orders/<int:pk>/"},
             {"POST": "/api/products/<int:pk>/order/create/"},
@@ -63,22 +77,208 @@ class RoutesAPIView(APIView):
 
 class ProductsAPIView(APIView):
     permission_classes = [AllowAny]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+
+    pagination_class = KeysetPagination
+    # ?ordering=<name> or -<name>; each maps to an indexed column.
+    ordering_fields = {"created": "created", "price": "effective_price", "rating": "rating_avg"}
 
     @extend_schema(
         description="""
                 Get all products.
-                Returns a list of all products available in the system.
+                Returns a list of all products available in the system, in the
+                compact list form (no description); GET /api/products/<id>/
+                returns the full product. Pass `fields=id,name,...` to return
+                only those fields, on this and the other product and order
+                endpoints.
+
+                Pass `page_size` and/or `cursor` to switch to keyset pagination:
+                the response becomes {"next": <url>, "results": [...]} ordered by
+                (created, id). Follow `next` until it is null.
+
+                Pass `ordering` to sort by `created`, `price` (the effective
+                sale price) or `rating` (average rating); prefix with `-` for
+                descending order, e.g. `?ordering=-rating`. Products without a
+                price or rating come first ascending and last descending.
+
+                Pass `category` (id, repeatable) to list the products of those
+                categories and all their subcategories.
+
+                Responses carry ETag and Last-Modified headers derived from the
+                catalog version; send If-None-Match / If-Modified-Since to get
+                304 Not Modified while the catalog is unchanged.
             """,
-        responses={200: ProductSerializer(many=True)},
+        parameters=[
+            OpenApiParameter(name="page_size", type=int, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="cursor", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(
+                name="ordering",
+                type=str,
+                location=OpenApiParameter.QUERY,
+                required=False,
+                enum=["created", "-created", "price", "-price", "rating", "-rating"],
+            ),
+            OpenApiParameter(name="fields", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="category", type=int, many=True, location=OpenApiParameter.QUERY, required=False),
+        ],
+        responses={200: ProductListSerializer(many=True)},
         tags=["Products"],
     )
+    @method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified))
     def get(self, request):
         """
         Get all products.
         """
+        # Rendered from .values() rows (api.rows): same output as
+        # ProductListSerializer without building Product instances.
+        rows = get_row_serializer(ProductListSerializer, requested_fields(request))
         products = Product.objects.all()
-        serializer = ProductSerializer(products, many=True)
-        return Response(serializer.data)
+        categories = requested_categories(request)
+        if categories:
+            products = products.filter(in_categories(categories))
+        products = rows.values(products, "pk", *self.ordering_fields.values())
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(products, request, view=self)
+        if page is not None:
+            return paginator.get_paginated_response(rows.render(page))
+
+        products = paginator.order_queryset(products, request, view=self)
+        return Response(rows.render(products))
+
+
+class ProductSearchAPIView(APIView):
+    permission_classes = [AllowAny]
+
+    pagination_class = RankedPagination
+
+    @extend_schema(
+        description="""
+                Full-text product search.
+
+                Matches every word of `q` as a prefix against the product name,
+                short description and description, through the database's
+                full-text index. Results are ordered by relevance, name hits
+                weighing most. Page with `limit` and `offset`; the response is
+                {"next": <url>, "results": [...]}.
+            """,
+        parameters=[
+            OpenApiParameter(name="q", type=str, location=OpenApiParameter.QUERY, required=True),
+            OpenApiParameter(name="limit", type=int, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="offset", type=int, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="fields", type=str, location=OpenApiParameter.QUERY, required=False),
+        ],
+        responses={200: ProductListSerializer(many=True)},
+        tags=["Products"],
+    )
+    @method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified))
+    def get(self, request):
+        """
+        Search products.
+        """
+        fields = requested_fields(request)
+        products = select_columns(Product.objects.all(), ProductListSerializer(fields=fields))
+        products = search_products(products, request.query_params.get("q"))
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(products, request, view=self)
+        serializer = ProductListSerializer(page, many=True, fields=fields)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class ProductFacetsAPIView(APIView):
+    permission_classes = [AllowAny]
+
+    ordering_fields = ProductsAPIView.ordering_fields
+
+    @extend_schema(
+        description="""
+                Faceted product filtering.
+
+                Filters (combine freely): `category` (id, repeatable, any of,
+                subcategories included),
+                `price` (bucket label such as `25-50` or `500-`, repeatable,
+                any of), `rating` (minimum average rating), `on_sale`
+                (true/false), `info` (`<parameter>:<value>` of the product
+                info, repeatable, all of) and `q` (full-text search).
+
+                Returns {"facets": {...}, "next": <url>, "results": [...]}.
+                `facets` counts the matching products for every category,
+                price bucket, rating threshold, the on-sale flag and the most
+                frequent info values; a facet's own selection is ignored in
+                its counts. Results are keyset-paginated (`page_size`,
+                `cursor`, `ordering` as on /api/products/), or ranked with
+                `limit`/`offset` when `q` is given.
+            """,
+        parameters=[
+            OpenApiParameter(name="category", type=int, many=True, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="price", type=str, many=True, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="rating", type=float, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="on_sale", type=bool, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="info", type=str, many=True, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="q", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="page_size", type=int, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="cursor", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="ordering", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="fields", type=str, location=OpenApiParameter.QUERY, required=False),
+        ],
+        responses={200: OpenApiTypes.OBJECT},
+        tags=["Products"],
+    )
+    @method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified))
+    def get(self, request):
+        """
+        Filter products by facets and count the facet values.
+        """
+        try:
+            facets = ProductFacets(request.query_params)
+        except InvalidFacet as error:
+            raise ValidationError({error.name: str(error)})
+
+        fields = requested_fields(request)
+        products = Product.objects.all()
+        query = request.query_params.get("q", "").strip()
+        if query:
+            products = search_products(products, query)
+            paginator = RankedPagination()
+        else:
+            paginator = CatalogPagination()
+
+        counts = facets.cached_counts(products, key_extra=query)
+        products = select_columns(
+            facets.filter(products), ProductListSerializer(fields=fields), *self.ordering_fields.values()
+        )
+        page = paginator.paginate_queryset(products, request, view=self)
+        return Response(
+            {
+                "facets": counts,
+                "next": paginator.get_next_link(),
+                "results": ProductListSerializer(page, many=True, fields=fields).data,
+            }
+        )
+
+
+class CategoriesAPIView(APIView):
+    permission_classes = [AllowAny]
+
+    @extend_schema(
+        description="""
+            Get the category tree.
+
+            Returns every category in depth-first order, subcategories right
+            after their parent and siblings by name. `parent` is the id of
+            the parent category (null for the top level), `depth` is 0 at
+            the top level and `product_count` counts the products of the
+            category and all its subcategories. Filter products by category
+            with `/api/products/?category=<id>`.
+        """,
+        responses={200: CategoryTreeSerializer(many=True)},
+        tags=["Products"],
+    )
+    @method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified))
+    def get(self, request):
+        """
+        Get the category tree.
+        """
+        return Response(CategoryTreeSerializer(category_tree(), many=True).data)
 
 
 class ProductAPIView(APIView):
@@ -100,17 +300,66 @@ class ProductAPIView(APIView):
                 ...
             }
         """,
+        parameters=[
+            OpenApiParameter(name="fields", type=str, location=OpenApiParameter.QUERY, required=False),
+        ],
         responses={200: ProductSerializer()},
         tags=["Products"],
     )
+    @method_decorator(condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified))
     def get(self, request, pk):
         """
         Get a product by ID.
         Returns the product details for the specified ID.
         """
-        product = get_object_or_404(Product, id=pk)
-        serializer = ProductSerializer(product)
-        return Response(serializer.data)
+        fields = requested_fields(request)
+        # Validates the field names; the cached payload is always complete.
+        ProductSerializer(fields=fields)
+
+        def build():
+            product = get_object_or_404(Product.objects.select_related("category"), id=pk)
+            return ProductSerializer(product).data
+
+        data = get_cached_product(pk, "api", build)
+        if fields:
+            data = {name: value for name, value in data.items() if name in fields}
+        return Response(data)
+
+
+class ProductCacheStatsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        description="""
+            Product cache statistics.
+
+            Returns the hit/miss/invalidation counters of the product detail
+            cache for the current worker process.
+        """,
+        responses={200: OpenApiTypes.OBJECT},
+        tags=["Products"],
+    )
+    def get(self, request):
+        return Response(product_cache_stats())
+
+
+class RequestMetricsAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        description="""
+            Per-view request metrics.
+
+            Returns, per URL name, the request count, average total/DB/serializer/
+            template time, query counts and a latency histogram, as collected by
+            RequestMetricsMiddleware (REQUEST_METRICS_ENABLED). Empty when the
+            middleware is disabled.
+        """,
+        responses={200: OpenApiTypes.OBJECT},
+        tags=["Metrics"],
+    )
+    def get(self, request):
+        return Response(summarize(collect()))
 
 
 class CartAPIView(APIView):
@@ -132,8 +381,10 @@ class CartAPIView(APIView):
         """
         Retrieve the user's cart details.
         """
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        serializer = CartSerializer(cart)
+        cart, created = Cart.objects.select_related("user").prefetch_related(
+            Prefetch("items", queryset=CartItem.objects.select_related("product__category"))
+        ).get_or_create(user=request.user)
+        serializer = CartSerializer(cart, fields=requested_fields(request))
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
@@ -168,11 +419,9 @@ class AddToCartAPIView(APIView):
         if not product_id:
             return Response({'error': 'Product ID is required'}, status=status.HTTP_400_BAD_REQUEST)
 
-        product = get_object_or_404(Product, id=product_id)
+        product = get_object_or_404(Product.objects.only("price", "effective_price"), id=product_id)
         cart, created = Cart.objects.get_or_create(user=request.user)
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-        cart_item.quantity += quantity
-        cart_item.save()
+        add_to_cart(cart, product, quantity)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
 
@@ -202,14 +451,11 @@ class UpdateCartItemAPIView(UpdateAPIView):
             return Response({"error": "Quantity is required."}, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            cart_item = CartItem.objects.get(id=pk, cart__user=request.user)
+            cart_item = CartItem.objects.select_related("product", "cart").get(id=pk, cart__user=request.user)
             cart_item.quantity = quantity
-            cart_item.price_sum = cart_item.quantity * cart_item.product.price
-            cart_item.save()
-            total_price = sum([item.price_sum for item in cart_item.cart.items.all()])
-            print("Success: Quantity updated successfully.")
-            print(f"Total price: {total_price}")
-            return Response({"success": True, "total_price": total_price}, status=status.HTTP_200_OK)
+            cart_item.save(update_fields=["quantity", "price_sum"])
+            totals = cart_item.cart.get_totals()
+            return Response({"success": True, **totals}, status=status.HTTP_200_OK)
         except CartItem.DoesNotExist:
             print("Error: Cart item not found or does not belong to the current user")
             return Response({"error": "Cart item not found or does not belong to the current user"}, status=status.HTTP_404_NOT_FOUND)
@@ -249,6 +495,8 @@ class RemoveFromCartAPIView(APIView):
 
 class OrdersAPIView(APIView):
     permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer, BrowsableAPIRenderer]
+    pagination_class = KeysetPagination
 
     @extend_schema(
         description="""
@@ -260,6 +508,10 @@ class OrdersAPIView(APIView):
                 - Admin: All orders
                 - User: Orders that have been ordered by the current user
 
+            Optional filters: `from` / `to` (YYYY-MM-DD, inclusive) on the
+            creation date and `status`. Pass `page_size` and/or `cursor` to get
+            keyset-paginated {"next": <url>, "results": [...]} pages.
+
             Example response:
             [
                 {
@@ -271,6 +523,14 @@ class OrdersAPIView(APIView):
                 ...
             ]
         """,
+        parameters=[
+            OpenApiParameter(name="from", type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="to", type=OpenApiTypes.DATE, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="status", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="page_size", type=int, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="cursor", type=str, location=OpenApiParameter.QUERY, required=False),
+            OpenApiParameter(name="fields", type=str, location=OpenApiParameter.QUERY, required=False),
+        ],
         responses={200: OrderSerializer(many=True)},
         tags=["Orders"],
     )
@@ -281,8 +541,19 @@ class OrdersAPIView(APIView):
         """
         user = request.user
         orders = filter_orders_by_role(user)
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        orders = filter_orders_by_params(orders, request.query_params)
+
+        # Same output as OrderSerializer, rendered from .values() rows: one
+        # query for the orders and their customers, one for the items.
+        rows = get_row_serializer(OrderSerializer, requested_fields(request))
+        paginator = self.pagination_class()
+        orders = rows.values(orders, "pk", paginator.ordering_field)
+        page = paginator.paginate_queryset(orders, request, view=self)
+        if page is not None:
+            return paginator.get_paginated_response(rows.render(page))
+
+        orders = paginator.order_queryset(orders)
+        return Response(rows.render(orders))
 
 
 class OrderAPIView(APIView):
@@ -304,6 +575,9 @@ class OrderAPIView(APIView):
                 "status": "Pending",
             }
         """,
+        parameters=[
+            OpenApiParameter(name="fields", type=str, location=OpenApiParameter.QUERY, required=False),
+        ],
         responses={200: OrderSerializer()},  # Use OrderSerializer instead of OrderItemSerializer
         tags=["Orders"],
     )
@@ -312,13 +586,13 @@ class OrderAPIView(APIView):
         Get an order by ID.
         Returns the details of the specified order.
         """
-        order = get_object_or_404(Order, id=pk)  # Retrieve the order from the Order model
+        order = get_object_or_404(with_order_details(Order.objects.all()), id=pk)  # Retrieve the order from the Order model
         # Check if the user is an admin
         if not request.user.role == User.Role.ADMIN: # Assuming `is_staff` is used to determine admin status
             # If the user is not an admin, ensure they can only access their own orders
             if order.customer != request.user:
                 return Response({"detail": "You do not have permission to access this order."}, status=status.HTTP_403_FORBIDDEN)
-        serializer = OrderSerializer(order)
+        serializer = OrderSerializer(order, fields=requested_fields(request))
         return Response(serializer.data)
 
 
@@ -363,37 +637,14 @@ class CreateOrderAPIView(APIView):
         form = OrderCreatForm(request.data)
     
         if form.is_valid():
-        # Create a new order
             order = form.save(commit=False)
             order.customer = request.user
-            order.save()
-
-        # Get the current user's cart
-            cart = Cart.objects.get(user=request.user)
 
-        # Get cart items for the user's cart
-            cart_items = CartItem.objects.filter(cart=cart)
-            if not cart_items:
+            # Move the user's cart into the order in one transaction
+            cart = Cart.objects.filter(user=request.user).first()
+            if not create_order_from_cart(cart, order):
                 return Response({"error": "Cannot create an order from an empty cart"}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Add cart items to the order and calculate total price
-            total_price = 0
-            for cart_item in cart_items:
-                order_item = OrderItem.objects.create(
-                    order_of_item=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.price * cart_item.quantity
-                )
-                total_price += order_item.price
-
-        # Update total price of the order
-            order.total_price = total_price
-            order.save()
-
-        # Clear the user's cart
-            cart_items.delete()
-
             return Response({"success": "New order created successfully!"}, status=status.HTTP_201_CREATED)
     
         return Response(form.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -445,32 +696,57 @@ class OrderGenBillAPIView(APIView):
         description="""
             Generate a bill for an order.
 
-            Generates a bill for the specified order.
+            Queues bill generation for the specified order and returns a job
+            handle. Poll `status_url` until the job is "done" (or "failed").
+            Re-generating the bill of an unchanged order is a no-op.
 
             Parameters:
                 - `pk` (int): The ID of the order.
 
             Example response:
-                "Payment is created..."
+            {
+                "job_id": "3f2c...",
+                "status": "pending",
+                "status_url": "/api/bill-jobs/3f2c.../"
+            }
         """,
-        responses={200: "Payment is created..."},
+        responses={202: OpenApiTypes.OBJECT},
         tags=["Orders"],
     )
-       
-
     def post(self, request, pk):
-        try:
-            order_item = Order.objects.get(id=pk)
-        except Order.DoesNotExist:
+        if not Order.objects.filter(id=pk).exists():
             return Response({"error": "Order not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        context = {"order_item": order_item}
-        html_content = render_to_string("market/payment_template.html", context)
+        job_id = submit_bill_job(pk)
+        job = get_bill_job(job_id) or {}
+        return Response(
+            {
+                "job_id": job_id,
+                "status": job.get("status", "pending"),
+                "status_url": reverse("bill_job", args=[job_id]),
+            },
+            status=status.HTTP_202_ACCEPTED,
+        )
 
-        order_item.file.save("payment.html", ContentFile(html_content), save=True)
 
-        serializer = OrderSerializer(order_item)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+class BillJobAPIView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    @extend_schema(
+        description="""
+            Get the state of a bill generation job.
+
+            `status` is one of "pending", "running", "done" or "failed". Done
+            jobs carry the bill `file` and whether it `changed`.
+        """,
+        responses={200: OpenApiTypes.OBJECT},
+        tags=["Orders"],
+    )
+    def get(self, request, job_id):
+        job = get_bill_job(job_id)
+        if job is None:
+            return Response({"error": "Job not found"}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"job_id": job_id, **job})
 
 
 class ChangeOrderStatusAPIView(APIView):
@@ -0,0 +1,440 @@
+"""
+Query-count and latency benchmark for every route of the `api` and `market` apps.
+
+`seed()` fills the current database with a synthetic catalog, users, carts
+and orders; `run_benchmark()` drives each route through the Django test
+client and records the number of queries, p50/p95 latency and response
+size. The `benchmark` management command wraps both in a throwaway test
+database and diffs the result against a JSON baseline.
+"""
+import json
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from api import urls as api_urls
+from market import urls as market_urls
+from users.models import User
+
+from .billing import generate_bill, submit_bill_job
+from .categories import build_path, recount_categories
+from .models import Cart, CartItem, Category, Order, OrderItem, Product, ProductInfo, ProductReview
+from .pricing import reprice_products
+from .ratings import recompute_ratings
+from .search import rebuild_index
+
+PASSWORD = "benchmark-password"
+INFO_VALUES = {
+    "Flavour": ["Chocolate", "Vanilla", "Strawberry", "Unflavoured"],
+    "Weight": ["250 g", "500 g", "1 kg", "2 kg"],
+}
+BATCH_SIZE = 1000
+
+
+class BenchmarkData:
+    """Handles to the seeded rows the routes are driven with."""
+
+    def __init__(self, user, admin, product_ids, order_id, admin_order_id, category_id=None):
+        self.user = user
+        self.admin = admin
+        self.product_ids = product_ids
+        self.category_id = category_id
+        self.order_id = order_id
+        self.admin_order_id = admin_order_id
+        self.counter = 0
+
+    @property
+    def product_id(self):
+        return self.product_ids[0]
+
+    def cart(self):
+        return Cart.objects.get_or_create(user=self.user)[0]
+
+    def cart_item(self, product_id=None):
+        item, created = CartItem.objects.get_or_create(
+            cart=self.cart(),
+            product_id=product_id or self.product_id,
+            defaults={"quantity": 1},
+        )
+        return item
+
+    def fill_cart(self, lines=10):
+        cart = self.cart()
+        CartItem.objects.filter(cart=cart).delete()
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product_id=pk, quantity=2, price_sum=0)
+            for pk in self.product_ids[:lines]
+        )
+
+    def unique(self, prefix):
+        self.counter += 1
+        return f"{prefix}{self.counter}"
+
+
+def seed(scale=1000, seed=0):
+    """
+    Create a synthetic dataset with about `scale` products, `scale` reviews
+    and `scale // 2` orders, and return the handles used by the routes.
+    """
+    rng = random.Random(seed)
+    now = timezone.now()
+    password = make_password(PASSWORD)
+
+    categories = [Category(name=f"Category {i}") for i in range(max(scale // 100, 5))]
+    for category in categories:
+        category.path = build_path(None, category.cid)
+    categories = Category.objects.bulk_create(categories)
+    products = Product.objects.bulk_create(
+        (
+            Product(
+                category=rng.choice(categories),
+                name=f"Product {i}",
+                price=Decimal(rng.randint(100, 50000)) / 100,
+                short_description=f"Short description of product {i}",
+                description="<p>" + "Lorem ipsum dolor sit amet. " * 20 + "</p>",
+                created=now - timedelta(days=rng.randint(0, 90), seconds=i),
+            )
+            for i in range(scale)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    # A separate generator keeps the rest of the dataset identical to the
+    # one the baseline was recorded with.
+    info_rng = random.Random(seed + 1)
+    ProductInfo.objects.bulk_create(
+        (
+            ProductInfo(product=product, parametrs=parameter, parameter_description=info_rng.choice(values))
+            for product in products
+            for parameter, values in INFO_VALUES.items()
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    users = User.objects.bulk_create(
+        (
+            User(username=f"customer{i}", password=password, role=User.Role.USER)
+            for i in range(max(scale // 10, 10))
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    user = users[0]
+    admin = User.objects.create(
+        username="bench-admin", password=password, is_staff=True, is_superuser=True
+    )
+    admin.role = User.Role.ADMIN
+    admin.save(update_fields=["role"])
+
+    ProductReview.objects.bulk_create(
+        (
+            ProductReview(
+                user=rng.choice(users),
+                product=rng.choice(products),
+                review="Does what it says.",
+                rating=rng.randint(1, 5),
+            )
+            for _ in range(scale)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+    orders = Order.objects.bulk_create(
+        (
+            Order(
+                customer=user if i % 10 == 0 else rng.choice(users),
+                address=f"Street {i}",
+                status=rng.choice(["Undecided", "Paid", "Completed"]),
+                created=now - timedelta(days=rng.randint(0, 365)),
+            )
+            for i in range(max(scale // 2, 2))
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    order_items = []
+    for order in orders:
+        for product in rng.sample(products, k=min(rng.randint(1, 3), len(products))):
+            order_items.append(
+                OrderItem(order_of_item=order, product=product, quantity=1, price=product.price)
+            )
+    OrderItem.objects.bulk_create(order_items, batch_size=BATCH_SIZE)
+    # bulk_create skips Product.save and the review and category signals.
+    for _ in reprice_products():
+        pass
+    recompute_ratings()
+    recount_categories()
+    rebuild_index()
+
+    data = BenchmarkData(
+        user=user,
+        admin=admin,
+        product_ids=[product.id for product in products],
+        order_id=orders[0].id,
+        admin_order_id=orders[1].id,
+        category_id=categories[0].id,
+    )
+    data.fill_cart()
+    generate_bill(data.order_id)
+    return data
+
+
+def _update_cart_item(data):
+    item = data.cart_item()
+    return {"item_id": item.id, "quantity": 3}
+
+
+def _create_order(data):
+    data.fill_cart()
+    return {"address": "Street", "postal_code": "1", "department_number": "2", "phone": "3"}
+
+
+def _register(data):
+    password = "Bench-Pass-123!"
+    return {
+        "username": data.unique("newuser"),
+        "email": "new@example.com",
+        "password1": password,
+        "password2": password,
+        "role": "USER",
+    }
+
+
+# (module, url name, method, client, build). `build(data)` prepares whatever
+# state the request needs and returns `(path, payload)`; it is not timed.
+# client is "anonymous", "user" or "admin". api_logout ends the user's
+# session, so it stays last.
+ROUTES = [
+    ("market", "main", "GET", "anonymous", lambda d: ("/", None)),
+    ("market", "main", "GET", "anonymous", lambda d: ("/?q=product+1", None)),
+    ("market", "main", "GET", "anonymous", lambda d: (f"/?category={d.category_id}", None)),
+    ("market", "product-view", "GET", "anonymous", lambda d: (f"/product/{d.product_id}", None)),
+    ("market", "product-reviews", "GET", "anonymous", lambda d: (f"/product/{d.product_id}/reviews/", None)),
+    ("market", "user-order", "GET", "user", lambda d: (f"/order/{d.product_id}", None)),
+    ("market", "showorders", "GET", "user", lambda d: ("/orders/", None)),
+    ("market", "showorders", "GET", "admin", lambda d: ("/orders/", None)),
+    ("market", "checkout", "GET", "user", lambda d: (f"/checkout/{d.order_id}", None)),
+    ("market", "cart", "GET", "user", lambda d: ("/cart/", None)),
+    ("market", "cart", "POST", "user", lambda d: ("/cart/", _create_order(d))),
+    ("market", "add-to-cart", "GET", "user", lambda d: (f"/add-item/{d.product_id}?quantity=1", None)),
+    ("market", "update-cart-item", "POST", "user", lambda d: ("/update-cart-item/", _update_cart_item(d))),
+    ("market", "remove-item", "GET", "user", lambda d: (f"/remove-item/{d.cart_item().id}", None)),
+    ("market", "genpayment", "GET", "admin", lambda d: (f"/payment/{d.admin_order_id}", None)),
+    ("market", "view_html", "GET", "user", lambda d: (f"/download_file/{d.order_id}", None)),
+    ("market", "change_status", "GET", "admin", lambda d: (f"/orders/{d.order_id}/change_status/", None)),
+    ("api", "routes", "GET", "anonymous", lambda d: ("/api/routes/", None)),
+    ("api", "products", "GET", "anonymous", lambda d: ("/api/products/", None)),
+    ("api", "products", "GET", "anonymous", lambda d: ("/api/products/?page_size=50", None)),
+    ("api", "products", "GET", "anonymous", lambda d: ("/api/products/?page_size=50&ordering=-rating", None)),
+    ("api", "products", "GET", "anonymous", lambda d: (f"/api/products/?page_size=50&category={d.category_id}", None)),
+    ("api", "categories", "GET", "anonymous", lambda d: ("/api/categories/", None)),
+    ("api", "product-search", "GET", "anonymous", lambda d: ("/api/products/search/?q=product+1", None)),
+    ("api", "product-facets", "GET", "anonymous", lambda d: ("/api/products/facets/", None)),
+    (
+        "api",
+        "product-facets",
+        "GET",
+        "anonymous",
+        lambda d: ("/api/products/facets/?price=25-50&price=50-100&rating=3&info=Flavour:Chocolate", None),
+    ),
+    ("api", "product", "GET", "anonymous", lambda d: (f"/api/products/{d.product_id}/", None)),
+    ("api", "product-cache-stats", "GET", "admin", lambda d: ("/api/products/cache-stats/", None)),
+    ("api", "request-metrics", "GET", "admin", lambda d: ("/api/metrics/requests/", None)),
+    ("api", "view-cart", "GET", "user", lambda d: ("/api/cart/", None)),
+    ("api", "add-to-cart", "POST", "user", lambda d: (f"/api/cart/add-to-cart/{d.product_id}/1/", None)),
+    ("api", "update-cart-item", "PUT", "user", lambda d: (f"/api/cart/update-cart-item/{d.cart_item().id}/3/", None)),
+    ("api", "remove-from-cart", "DELETE", "user", lambda d: (f"/api/cart/remove-from-cart/{d.cart_item().id}/", None)),
+    ("api", "orders", "GET", "user", lambda d: ("/api/orders/", None)),
+    ("api", "orders", "GET", "admin", lambda d: ("/api/orders/?page_size=50", None)),
+    ("api", "async-products", "GET", "anonymous", lambda d: ("/api/async/products/?page_size=50", None)),
+    ("api", "async-product", "GET", "anonymous", lambda d: (f"/api/async/products/{d.product_id}/", None)),
+    ("api", "async-view-cart", "GET", "user", lambda d: ("/api/async/cart/", None)),
+    ("api", "async-orders", "GET", "user", lambda d: ("/api/async/orders/", None)),
+    ("api", "order", "GET", "user", lambda d: (f"/api/order/{d.order_id}/", None)),
+    ("api", "create-order", "POST", "user", lambda d: ("/api/order/create-order/", _create_order(d))),
+    ("api", "order_payment", "POST", "user", lambda d: (f"/api/order/{d.order_id}/payment/", None)),
+    ("api", "order_gen_bill", "POST", "admin", lambda d: (f"/api/order/{d.admin_order_id}/gen-bill/", None)),
+    ("api", "bill_job", "GET", "admin", lambda d: (f"/api/bill-jobs/{submit_bill_job(d.order_id)}/", None)),
+    ("api", "change_order_status", "POST", "admin", lambda d: (f"/api/order/{d.order_id}/change-status/", {"status": "Paid"})),
+    ("api", "token_obtain_pair", "POST", "anonymous", lambda d: ("/api/users/token/", {"username": d.user.username, "password": PASSWORD})),
+    ("api", "token_refresh", "POST", "anonymous", lambda d: ("/api/users/token/refresh/", {"refresh": str(RefreshToken.for_user(d.user))})),
+    ("api", "api_login", "POST", "anonymous", lambda d: ("/api/api/login/", {"username": d.user.username, "password": PASSWORD})),
+    ("api", "api_register", "POST", "anonymous", lambda d: ("/api/api/register/", _register(d))),
+    ("api", "api_logout", "POST", "user", lambda d: ("/api/api/logout/", None)),
+]
+
+
+# Routes whose view reads a JSON body; every other market route gets form data.
+JSON_BODY_ROUTES = {("market", "update-cart-item")}
+
+
+def route_key(module, name, method, client, path=""):
+    # The query string tells apart variants of one route (paginated or not ...).
+    query = path.partition("?")[2]
+    return f"{method} {module}:{name}{'?' + query if query else ''} ({client})"
+
+
+def uncovered_routes():
+    """Names from api/urls.py and market/urls.py that ROUTES does not exercise."""
+    covered = {(module, name) for module, name, *_ in ROUTES}
+    declared = {("api", p.name) for p in api_urls.urlpatterns} | {
+        ("market", p.name) for p in market_urls.urlpatterns
+    }
+    return sorted(declared - covered)
+
+
+def _clients(data):
+    anonymous = APIClient()
+    user = APIClient()
+    user.force_login(data.user)
+    user.force_authenticate(user=data.user)
+    admin = APIClient()
+    admin.force_login(data.admin)
+    admin.force_authenticate(user=data.admin)
+    return {"anonymous": anonymous, "user": user, "admin": admin}
+
+
+def _percentile(values, percent):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+def run_benchmark(data, iterations=20, routes=None):
+    """
+    Request every route `iterations` times and return per-route metrics.
+
+    `queries` is the maximum over all iterations (so a cold cache miss on
+    the first request is still accounted for), latencies are in milliseconds.
+    """
+    caches["default"].clear()
+    clients = _clients(data)
+    results = {}
+    for module, name, method, client_name, build in routes or ROUTES:
+        client = clients[client_name]
+        body_format = "json" if module == "api" or (module, name) in JSON_BODY_ROUTES else "multipart"
+        timings, queries, sizes, statuses = [], [], [], set()
+        key = None
+        for _ in range(iterations):
+            path, payload = build(data)
+            key = key or route_key(module, name, method, client_name, path)
+            request = getattr(client, method.lower())
+            # CaptureQueriesContext counts through a bounded log; start empty.
+            connection.queries_log.clear()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                response = request(path, payload, format=body_format) if payload else request(path)
+                body = (
+                    b"".join(response.streaming_content)
+                    if response.streaming
+                    else response.content
+                )
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+            sizes.append(len(body))
+            statuses.add(response.status_code)
+        results[key] = {
+            "status": sorted(statuses),
+            "queries": max(queries),
+            "p50_ms": round(_percentile(timings, 50), 3),
+            "p95_ms": round(_percentile(timings, 95), 3),
+            "bytes": max(sizes),
+        }
+    return results
+
+
+def _best_of(iterations, func):
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings), result
+
+
+def run_serializer_benchmark(iterations=5):
+    """
+    Time the list endpoints' serialization paths on the whole seeded dataset:
+    ProductListSerializer / OrderSerializer over model instances against
+    the `.values()` row fast path (api.rows), and DRF's JSONRenderer
+    against FastJSONRenderer. Returns `{name: {"serializer_ms", "fast_ms",
+    "speedup", "rows"}}` with the best time of `iterations` runs.
+    """
+    from api.renderers import FastJSONRenderer
+    from api.rows import get_row_serializer
+    from api.serializers import OrderSerializer, ProductListSerializer
+    from api.utils import select_columns, with_order_details
+    from rest_framework.renderers import JSONRenderer
+
+    products = Product.objects.order_by("created", "pk")
+    orders = with_order_details(Order.objects.order_by("created", "pk"))
+    product_rows = get_row_serializer(ProductListSerializer)
+    order_rows = get_row_serializer(OrderSerializer)
+    cases = {
+        "products": (
+            lambda: ProductListSerializer(
+                select_columns(products, ProductListSerializer()), many=True
+            ).data,
+            lambda: product_rows.render(product_rows.values(products, "pk")),
+        ),
+        "orders": (
+            lambda: OrderSerializer(orders, many=True).data,
+            lambda: order_rows.render(order_rows.values(orders, "pk")),
+        ),
+    }
+    results = {}
+    for name, (slow, fast) in cases.items():
+        slow_ms, data = _best_of(iterations, slow)
+        fast_ms, fast_data = _best_of(iterations, fast)
+        if json.loads(JSONRenderer().render(data)) != json.loads(JSONRenderer().render(fast_data)):
+            raise AssertionError(f"{name}: the fast path renders differently from the serializer")
+        results[name] = {"serializer_ms": slow_ms, "fast_ms": fast_ms, "rows": len(data)}
+        slow_ms, _ = _best_of(iterations, lambda: JSONRenderer().render(data))
+        fast_ms, _ = _best_of(iterations, lambda: FastJSONRenderer().render(fast_data))
+        results[f"{name} (json)"] = {"serializer_ms": slow_ms, "fast_ms": fast_ms, "rows": len(data)}
+    for metrics in results.values():
+        metrics["speedup"] = metrics["serializer_ms"] / metrics["fast_ms"] if metrics["fast_ms"] else None
+    return results
+
+
+def compare(current, baseline, latency_tolerance=0.5):
+    """
+    Diff two benchmark reports.
+
+    Returns `(query_regressions, latency_regressions)`: lists of messages for
+    routes that run more queries than the baseline, and routes whose p95
+    latency grew by more than `latency_tolerance` (0.5 = +50%).
+    """
+    query_regressions, latency_regressions = [], []
+    for key, metrics in current["routes"].items():
+        before = baseline["routes"].get(key)
+        if before is None:
+            continue
+        if metrics["queries"] > before["queries"]:
+            query_regressions.append(
+                f"{key}: {before['queries']} -> {metrics['queries']} queries"
+            )
+        if metrics["p95_ms"] > before["p95_ms"] * (1 + latency_tolerance):
+            latency_regressions.append(
+                f"{key}: p95 {before['p95_ms']}ms -> {metrics['p95_ms']}ms"
+            )
+    return query_regressions, latency_regressions
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_report(report, path):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.db.models import Prefetch
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import BillJob, Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.BILL_WORKERS, thread_name_prefix="bill"
+            )
+        return _executor
+
+
+def render_bill(order_id):
+    order = (
+        Order.objects.select_related("customer")
+        .prefetch_related(
+            Prefetch("order_items", queryset=OrderItem.objects.select_related("product"))
+        )
+        .get(id=order_id)
+    )
+    html_content = render_to_string("market/payment_template.html", {"order_item": order})
+    return order, html_content
+
+
+def generate_bill(order_id):
+    """
+    Render the bill of an order and attach it to the order.
+
+    The file name contains a hash of the rendered HTML, so re-generating the
+    bill of an unchanged order neither writes a new file nor touches the
+    order row. Returns `(file_name, changed)`.
+    """
+    order, html_content = render_bill(order_id)
+    digest = hashlib.sha256(html_content.encode()).hexdigest()[:16]
+    file_name = f"payment_{order.id}_{digest}.html"
+
+    if order.file.name == file_name and default_storage.exists(file_name):
+        return file_name, False
+
+    if not default_storage.exists(file_name):
+        file_name = default_storage.save(file_name, ContentFile(html_content))
+    Order.objects.filter(id=order.id).update(file=file_name)
+    return file_name, True
+
+
+def _job_key(job_id):
+    return f"bill-job:{job_id}"
+
+
+def _job_state(job):
+    state = {"status": job.status, "order": job.order_id}
+    if job.status == "done":
+        state.update(file=job.file, changed=job.changed)
+    elif job.status == "failed":
+        state["error"] = job.error
+    return state
+
+
+def _set_job(job_id, order_id, **fields):
+    BillJob.objects.filter(id=job_id).update(updated=timezone.now(), **fields)
+    if fields["status"] in ("done", "failed"):
+        # Finished jobs no longer change; pollers in this process skip the database.
+        job = BillJob(id=job_id, order_id=order_id, **fields)
+        cache.set(_job_key(job_id), _job_state(job), settings.BILL_JOB_TIMEOUT)
+
+
+def _run_job(job_id, order_id, in_worker=True):
+    _set_job(job_id, order_id, status="running")
+    try:
+        file_name, changed = generate_bill(order_id)
+    except Exception as e:
+        logger.exception("Bill generation for order %s failed", order_id)
+        _set_job(job_id, order_id, status="failed", error=str(e))
+    else:
+        _set_job(job_id, order_id, status="done", file=file_name, changed=changed)
+        # Off the request path: forget jobs older than BILL_JOB_TIMEOUT.
+        BillJob.objects.filter(updated__lt=timezone.now() - timedelta(seconds=settings.BILL_JOB_TIMEOUT)).delete()
+    finally:
+        # Worker threads hold their own connections; don't leak them.
+        if in_worker:
+            connections.close_all()
+
+
+def submit_bill_job(order_id):
+    """
+    Queue bill generation for an order and return the job id.
+
+    Jobs run in a thread pool of BILL_WORKERS threads; with BILL_WORKERS = 0
+    they run inline, which is what tests and one-off scripts want. Their
+    state is kept in the database for BILL_JOB_TIMEOUT seconds.
+    """
+    job_id = uuid.uuid4().hex
+    BillJob.objects.create(id=job_id, order_id=order_id)
+    if settings.BILL_WORKERS:
+        get_executor().submit(_run_job, job_id, order_id)
+    else:
+        _run_job(job_id, order_id, in_worker=False)
+    return job_id
+
+
+def get_bill_job(job_id):
+    """The state of a job as a dict, None for an unknown job."""
+    state = cache.get(_job_key(job_id))
+    if state is None:
+        job = BillJob.objects.filter(id=job_id).first()
+        if job is None:
+            return None
+        state = _job_state(job)
+        if job.status in ("done", "failed"):
+            cache.set(_job_key(job_id), state, settings.BILL_JOB_TIMEOUT)
+    return state
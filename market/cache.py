@@ -0,0 +1,232 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+
+
+# Process-local hit/miss counters for the product cache.
+_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+_stats_lock = threading.Lock()
+
+# Bumped when something shared by every product (e.g. a category name) changes.
+# Stored in the database (CatalogVersion.generation) like the catalog version.
+GENERATION_KEY = "product-cache:generation"
+
+# (version, last modified) of the whole catalog, bumped on any Product/Category
+# change. Stored in the database (CatalogVersion); this key caches it for
+# CATALOG_VERSION_TIMEOUT seconds.
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def get_product_cache():
+    return caches[getattr(settings, "PRODUCT_CACHE_ALIAS", "default")]
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+# Per-product versions are not stored in the database: every product save
+# would write to it. They live in the product cache, so with a per-process
+# cache a change is seen by the other processes only once their entries
+# expire (PRODUCT_CACHE_TIMEOUT).
+def _version_key(pk):
+    return f"product-cache:version:{pk}"
+
+
+def _fresh_version():
+    # Versions start from the current time so that a version key evicted from
+    # the cache can never be re-created with a value an old entry was stored under.
+    return time.time_ns()
+
+
+def _bump(cache, key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _fresh_version(), None)
+
+
+def _load_catalog_row(cache):
+    # Caches both values of the row, each read costs the same query.
+    row = _catalog_row()
+    cache.set_many(
+        {CATALOG_VERSION_KEY: (row.version, row.modified), GENERATION_KEY: row.generation},
+        _catalog_version_timeout(),
+    )
+    return row
+
+
+def _product_versions(cache, pks, generation=None):
+    """`{pk: "generation:version"}`, creating the missing version keys."""
+    version_keys = {pk: _version_key(pk) for pk in pks}
+    if generation is None:
+        versions = cache.get_many([GENERATION_KEY, *version_keys.values()])
+        generation = versions.get(GENERATION_KEY)
+        if generation is None:
+            generation = _load_catalog_row(cache).generation
+    else:
+        versions = cache.get_many(version_keys.values())
+    current = {}
+    for pk, version_key in version_keys.items():
+        version = versions.get(version_key)
+        if version is None:
+            version = _fresh_version()
+            cache.add(version_key, version, None)
+        current[pk] = f"{generation}:{version}"
+    return current
+
+
+def _product_keys(cache, pks, kind, generation=None):
+    return {
+        pk: f"product-cache:{kind}:{pk}:{version}"
+        for pk, version in _product_versions(cache, pks, generation).items()
+    }
+
+
+def get_cached_product(pk, kind, builder):
+    """
+    Read-through lookup of a cached per-product value.
+
+    `kind` separates the different representations of a product (API payload,
+    HTML page context, ...). On a miss `builder()` is called and its result is
+    stored under the product's current version.
+    """
+    return get_cached_products([pk], kind, lambda missing: {pk: builder()})[pk]
+
+
+def get_cached_products(pks, kind, builder):
+    """
+    Batched get_cached_product: two cache round trips for any number of
+    products. `builder(missing pks)` returns `{pk: value}` for the misses;
+    products it leaves out are left out of the result too.
+    """
+    cache = get_product_cache()
+    keys = _product_keys(cache, pks, kind)
+    found = cache.get_many(keys.values())
+    values = {pk: found[key] for pk, key in keys.items() if found.get(key) is not None}
+    missing = [pk for pk in keys if pk not in values]
+    with _stats_lock:
+        _stats["hits"] += len(values)
+        _stats["misses"] += len(missing)
+    if missing:
+        built = builder(missing)
+        cache.set_many(
+            {keys[pk]: value for pk, value in built.items()},
+            getattr(settings, "PRODUCT_CACHE_TIMEOUT", 60),
+        )
+        values.update(built)
+    return values
+
+
+async def aget_cached_product(pk, kind, builder):
+    """
+    get_cached_product for async views; `builder` is a coroutine function.
+    The cache is read synchronously: Django's async cache methods only run
+    the same calls in a thread.
+    """
+    cache = get_product_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        generation = (await sync_to_async(_load_catalog_row)(cache)).generation
+    key = _product_keys(cache, [pk], kind, generation)[pk]
+    value = cache.get(key)
+    if value is not None:
+        _count("hits")
+        return value
+
+    _count("misses")
+    value = await builder()
+    cache.set(key, value, getattr(settings, "PRODUCT_CACHE_TIMEOUT", 60))
+    return value
+
+
+def invalidate_product(pk):
+    if pk is None:
+        return
+    _bump(get_product_cache(), _version_key(pk))
+    _count("invalidations")
+
+
+def invalidate_all_products():
+    generation = _fresh_version()
+    _update_catalog_row(generation=generation)
+    get_product_cache().set(GENERATION_KEY, generation, _catalog_version_timeout())
+    _count("invalidations")
+
+
+def _catalog_version_timeout():
+    return getattr(settings, "CATALOG_VERSION_TIMEOUT", 5)
+
+
+def _catalog_row():
+    """
+    The CatalogVersion row, created when missing (migration 0016 creates
+    it, a flushed test database does not have it). A new row means the
+    catalog was modified right now, so clients revalidate once instead of
+    getting a stale 304.
+    """
+    from .models import CatalogVersion
+
+    row = CatalogVersion.objects.filter(pk=1).first()
+    if row is None:
+        try:
+            with transaction.atomic():
+                row = CatalogVersion.objects.create(
+                    pk=1, version=_fresh_version(), modified=datetime.now(timezone.utc)
+                )
+        except IntegrityError:
+            # Created meanwhile by another request.
+            row = CatalogVersion.objects.get(pk=1)
+    return row
+
+
+def _update_catalog_row(**fields):
+    from .models import CatalogVersion
+
+    if not CatalogVersion.objects.filter(pk=1).update(**fields):
+        _catalog_row()
+        CatalogVersion.objects.filter(pk=1).update(**fields)
+
+
+def get_catalog_version():
+    """
+    Return `(version, last_modified)` for the product catalog.
+
+    The database row is the shared truth; each process caches it for
+    CATALOG_VERSION_TIMEOUT seconds, so with a process-local cache a bump
+    made elsewhere is seen within that time.
+    """
+    cache = get_product_cache()
+    state = cache.get(CATALOG_VERSION_KEY)
+    if state is None:
+        row = _load_catalog_row(cache)
+        state = (row.version, row.modified)
+    return state
+
+
+def bump_catalog_version():
+    state = (_fresh_version(), datetime.now(timezone.utc))
+    _update_catalog_row(version=state[0], modified=state[1])
+    # Should the transaction roll back, this version is only ever served for
+    # CATALOG_VERSION_TIMEOUT seconds and costs clients one revalidation.
+    get_product_cache().set(CATALOG_VERSION_KEY, state, _catalog_version_timeout())
+
+
+def product_cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
+
+
+def reset_product_cache_stats():
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
@@ -0,0 +1,369 @@
+"""
+Streaming product import and export.
+
+Catalog files are read record by record, never whole, in three formats:
+
+* `json`: an array of fixture records (`{"model": "market.product", "pk":
+  1, "fields": {...}}`, as in products.json) or of flat objects.
+* `jsonl`: one such record per line.
+* `csv`: a header row with the field names, one product per row.
+
+`import_products` validates the records and writes them in batches, one
+transaction each. Records with a primary key are upserted with
+`INSERT ... ON CONFLICT (id) DO UPDATE`, one statement per set of fields
+the records carry; the others are inserted. An existing product only
+takes the fields its record carries (a CSV of `id,price` reprices without
+touching names, categories or creation dates) and keeps its ratings. Sale
+prices are derived as Product.save would, from the stored price or
+creation date where a record lacks one. Categories are resolved by name
+(or id) with one query per batch, and the search index and category
+counts are updated.
+
+`export_products` writes the same formats with categories by name, so a
+file moves between databases whatever their category ids.
+"""
+import csv
+import json
+import re
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.core.management.color import no_style
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .categories import build_path, recount_categories
+from .models import Category, Product
+from .pricing import get_sale_rules, sale_price
+from .search import TEXT_FIELDS, index_products
+
+FORMATS = ("json", "jsonl", "csv")
+
+MODEL_LABEL = "market.product"
+
+# Fields read from and written to catalog files, besides the primary key.
+FIELDS = ("name", "category", "price", "short_description", "description", "image", "created")
+
+# Product columns that imports never set: derived or maintained elsewhere.
+IGNORED_FIELDS = {
+    field.name for field in Product._meta.concrete_fields if not field.editable
+} | {"old_price"}
+
+_WHITESPACE = re.compile(r"\s*")
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def guess_format(path):
+    extension = path.rsplit(".", 1)[-1].lower() if "." in path else ""
+    if extension == "ndjson":
+        return "jsonl"
+    if extension not in FORMATS:
+        raise CatalogError(f"Cannot tell the format of {path!r}; expected one of: {', '.join(FORMATS)}.")
+    return extension
+
+
+def iter_json_array(stream, read_size=1 << 16):
+    """Yield the items of the JSON array in text `stream`, reading it in blocks."""
+    decoder = json.JSONDecoder(parse_float=Decimal)
+    buffer, pos, eof = "", 0, False
+    state = "start"
+    while True:
+        pos = _WHITESPACE.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                raise CatalogError("Unexpected end of the JSON array.")
+            chunk = stream.read(read_size)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+        char = buffer[pos]
+        if state == "start":
+            if char != "[":
+                raise CatalogError("Expected a JSON array.")
+            pos += 1
+            state = "first"
+        elif char == "]" and state in ("first", "next"):
+            return
+        elif state == "next":
+            if char != ",":
+                raise CatalogError(f"Expected ',' or ']' in the JSON array, got {char!r}.")
+            pos += 1
+            state = "item"
+        else:
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as exc:
+                if eof:
+                    raise CatalogError(f"Invalid JSON: {exc.msg}.")
+                item, end = None, len(buffer)
+            # An item reaching the end of the buffer may be cut short (a
+            # number, or a syntax error that is really a partial record).
+            if end == len(buffer) and not eof:
+                chunk = stream.read(read_size)
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+            yield item
+            pos = end
+            state = "next"
+
+
+def read_records(stream, fmt):
+    """
+    Yield the records (dicts) of a catalog file opened in text mode. JSON
+    numbers with a fraction are read as Decimal, so 19.99 stays exact.
+    """
+    if fmt == "json":
+        yield from iter_json_array(stream)
+    elif fmt == "jsonl":
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    yield json.loads(line, parse_float=Decimal)
+                except json.JSONDecodeError as exc:
+                    raise CatalogError(f"Line {number}: invalid JSON: {exc.msg}.")
+    elif fmt == "csv":
+        for row in csv.DictReader(stream):
+            # Empty cells are missing values.
+            yield {key: value for key, value in row.items() if value != ""}
+    else:
+        raise CatalogError(f"Unknown format {fmt!r}; expected one of: {', '.join(FORMATS)}.")
+
+
+def parse_record(record):
+    """
+    Validate one record. Returns `(pk, fields)`: the primary key or None, and
+    the clean field values with `category` still a name or an id.
+    """
+    if not isinstance(record, dict):
+        raise CatalogError("Expected an object.")
+    if "fields" in record:
+        if record.get("model", MODEL_LABEL).lower() != MODEL_LABEL:
+            raise CatalogError(f"Not a product record: {record.get('model')!r}.")
+        pk, data = record.get("pk"), record["fields"]
+    else:
+        data = dict(record)
+        pk = data.pop("id", None)
+        pk = data.pop("pk", pk)
+    unknown = set(data) - set(FIELDS) - IGNORED_FIELDS
+    if unknown:
+        raise CatalogError(f"Unknown field(s): {', '.join(sorted(unknown))}.")
+
+    fields = {}
+    name = "pk"
+    try:
+        if pk is not None:
+            pk = Product._meta.pk.to_python(pk)
+        for name in FIELDS:
+            if name not in data:
+                continue
+            value = data[name]
+            if name == "category":
+                if value is not None and (isinstance(value, bool) or not isinstance(value, (int, str))):
+                    raise CatalogError("category: expected a name or an id.")
+                fields[name] = value
+                continue
+            # What the database accepts: blank values are a form concern.
+            model_field = Product._meta.get_field(name)
+            value = model_field.to_python(value)
+            if value is None and not model_field.null:
+                raise ValidationError("This field cannot be null.")
+            if value is not None:
+                model_field.run_validators(value)
+            if name == "created" and value is not None and timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            fields[name] = value
+    except ValidationError as exc:
+        raise CatalogError(f"{name}: {' '.join(exc.messages)}")
+    return pk, fields
+
+
+class CategoryResolver:
+    """Category ids by name (the oldest category of that name) or id, cached across batches."""
+
+    def __init__(self, create=True):
+        self.create = create
+        self.by_name = {}
+        self.ids = set()
+
+    def resolve(self, values):
+        """Look up the categories of one batch; returns the values that are unknown."""
+        names = {v for v in values if isinstance(v, str)} - set(self.by_name)
+        ids = {v for v in values if isinstance(v, int)} - self.ids
+        if names:
+            for pk, name in Category.objects.filter(name__in=names).order_by("-pk").values_list("pk", "name"):
+                self.by_name[name] = pk
+            missing = names - set(self.by_name)
+            if missing and self.create:
+                new = [Category(name=name) for name in sorted(missing)]
+                for category in new:
+                    # bulk_create skips the signal that sets it.
+                    category.path = build_path(None, category.cid)
+                for category in Category.objects.bulk_create(new):
+                    self.by_name[category.name] = category.pk
+                # Not every backend returns the new primary keys.
+                if any(self.by_name.get(name) is None for name in missing):
+                    self.by_name.update(
+                        Category.objects.filter(name__in=missing).order_by("-pk").values_list("name", "pk")
+                    )
+        if ids:
+            self.ids |= set(Category.objects.filter(pk__in=ids).values_list("pk", flat=True))
+        return {v for v in values if v is not None and self.get(v) is None}
+
+    def get(self, value):
+        if isinstance(value, str):
+            return self.by_name.get(value)
+        return value if value in self.ids else None
+
+
+def _write_batch(batch, categories, rules, now):
+    """Write one batch of `(number, pk, fields)`; returns `(created, updated, errors)`."""
+    errors = []
+    unknown = categories.resolve({fields.get("category") for _, _, fields in batch})
+    without_pk, by_pk = [], {}
+    for number, pk, fields in batch:
+        carried = frozenset(fields)
+        fields = dict(fields)
+        category = fields.pop("category", None)
+        if category in unknown:
+            errors.append((number, f"category: unknown category {category!r}."))
+            continue
+        product = Product(pk=pk, category_id=categories.get(category) if category is not None else None, **fields)
+        if pk is None:
+            product.effective_price, product.old_price = sale_price(product.price, product.created, now, rules)
+            without_pk.append(product)
+        else:
+            # The last record of a primary key wins; one statement cannot
+            # upsert the same row twice.
+            by_pk[pk] = (product, carried)
+
+    with transaction.atomic():
+        existing = {
+            pk: (price, created)
+            for pk, price, created in Product.objects.filter(pk__in=list(by_pk)).values_list("pk", "price", "created")
+        }
+        # ON CONFLICT only updates the columns the records carry, so the
+        # fields a record leaves out (defaults on the INSERT side, such as
+        # `created`) never overwrite an existing row.
+        groups = {}
+        for pk, (product, carried) in by_pk.items():
+            if pk in existing:
+                price, created = existing[pk]
+                if "price" not in carried:
+                    product.price = price
+                if "created" not in carried:
+                    product.created = created
+            product.effective_price, product.old_price = sale_price(product.price, product.created, now, rules)
+            groups.setdefault(carried, []).append(product)
+        for carried, products in groups.items():
+            update_fields = [
+                field.attname
+                for field in Product._meta.concrete_fields
+                if field.name in carried or field.name in ("effective_price", "old_price")
+            ]
+            Product.objects.bulk_create(
+                products, update_conflicts=True, unique_fields=["id"], update_fields=update_fields
+            )
+        if without_pk:
+            Product.objects.bulk_create(without_pk)
+
+        # Updated products missing some text are indexed from their rows.
+        partial = [pk for pk, (_, carried) in by_pk.items() if pk in existing and not TEXT_FIELDS <= carried]
+        index_products(
+            [product for product in without_pk if product.pk is not None]
+            + [product for pk, (product, _) in by_pk.items() if pk not in partial]
+        )
+        if partial:
+            index_products(Product.objects.filter(pk__in=partial).only(*TEXT_FIELDS))
+    return len(without_pk) + len(by_pk) - len(existing), len(existing), errors
+
+
+def import_products(records, batch_size=1000, create_categories=True, now=None):
+    """
+    Validate and write `records` in batches. Yields a dict per batch with
+    the number of records `read`, products `created` and `updated`, and
+    the `errors` as `(record number, message)`; invalid records are skipped.
+    """
+    rules = get_sale_rules()
+    now = now or timezone.now()
+    categories = CategoryResolver(create=create_categories)
+    batch, errors, read = [], [], 0
+    for number, record in enumerate(records, 1):
+        read += 1
+        try:
+            pk, fields = parse_record(record)
+        except CatalogError as exc:
+            errors.append((number, str(exc)))
+        else:
+            batch.append((number, pk, fields))
+        if len(batch) >= batch_size:
+            created, updated, batch_errors = _write_batch(batch, categories, rules, now)
+            yield {"read": read, "created": created, "updated": updated, "errors": errors + batch_errors}
+            batch, errors, read = [], [], 0
+    if batch or errors or read:
+        created, updated, batch_errors = _write_batch(batch, categories, rules, now) if batch else (0, 0, [])
+        yield {"read": read, "created": created, "updated": updated, "errors": errors + batch_errors}
+
+    # Bulk writes skip the signals that maintain the category counts.
+    recount_categories()
+
+    # Explicit primary keys do not advance the id sequence on PostgreSQL & co.
+    statements = connection.ops.sequence_reset_sql(no_style(), [Product])
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def _export_rows(queryset, chunk_size):
+    # Keyset over the primary key: every chunk is an index range scan.
+    columns = ("pk", "name", "category__name", "price", "short_description", "description", "image", "created")
+    last_pk = None
+    while True:
+        chunk = queryset.order_by("pk")
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        rows = list(chunk.values_list(*columns)[:chunk_size])
+        if not rows:
+            return
+        yield rows
+        last_pk = rows[-1][0]
+
+
+def export_products(stream, fmt, queryset=None, chunk_size=2000):
+    """
+    Write the products of `queryset` (all by default) to text `stream`.
+    Yields the number of products written per chunk.
+    """
+    if fmt not in FORMATS:
+        raise CatalogError(f"Unknown format {fmt!r}; expected one of: {', '.join(FORMATS)}.")
+    queryset = Product.objects.all() if queryset is None else queryset
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(("id",) + FIELDS)
+    elif fmt == "json":
+        stream.write("[")
+    first = True
+    for rows in _export_rows(queryset, chunk_size):
+        if writer is not None:
+            writer.writerows(
+                (pk, name, category, price, short, description, image, created.isoformat() if created else None)
+                for pk, name, category, price, short, description, image, created in rows
+            )
+        else:
+            lines = []
+            for pk, *values in rows:
+                record = {"model": MODEL_LABEL, "pk": pk, "fields": dict(zip(FIELDS, values))}
+                lines.append(encoder.encode(record))
+            if fmt == "json":
+                stream.write(("\n" if first else ",\n") + ",\n".join(lines))
+            else:
+                stream.write("\n".join(lines) + "\n")
+        first = False
+        yield len(rows)
+    if fmt == "json":
+        stream.write("\n]\n")
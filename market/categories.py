@@ -0,0 +1,129 @@
+"""
+Category tree.
+
+Categories nest through `parent`. Each one stores its materialized `path`:
+the `cid`s of its ancestors and its own, each followed by a slash
+("catA/catB/"). A subtree is then every category whose path starts with
+the root's, and the ancestors of a category are the prefixes of its path,
+so both are a single query (or a subquery of the query that needs them)
+whatever the depth.
+
+`product_count` is the number of products in a category and all of its
+descendants. Product signals keep it current with relative `F()` updates
+(`apply_product_count`); `recount_categories` rebuilds it from the products
+in one UPDATE, and runs after moves, deletions and bulk writes.
+"""
+from django.db import transaction
+from django.db.models import Exists, F, Func, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce, Concat, Substr
+from django.db.models.lookups import StartsWith
+
+SEPARATOR = "/"
+
+PATH_MAX_LENGTH = 255
+
+
+class CategoryTreeError(ValueError):
+    pass
+
+
+def build_path(parent_path, cid):
+    path = (parent_path or "") + cid + SEPARATOR
+    if len(path) > PATH_MAX_LENGTH:
+        raise CategoryTreeError("The category tree is too deep.")
+    return path
+
+
+def ancestor_paths(path):
+    """The paths of the category at `path` and of its ancestors, root first."""
+    parts = path.split(SEPARATOR)[:-1]
+    return [SEPARATOR.join(parts[:depth]) + SEPARATOR for depth in range(1, len(parts) + 1)]
+
+
+def descendants_of(category_ids):
+    """The categories `category_ids` and all their descendants, as one queryset."""
+    from .models import Category
+
+    roots = Category.objects.filter(StartsWith(OuterRef("path"), F("path")), pk__in=category_ids)
+    return Category.objects.filter(Exists(roots))
+
+
+def ancestors_of(category_id):
+    """Category `category_id` and its ancestors, as one queryset."""
+    from .models import Category
+
+    node = Category.objects.filter(StartsWith(F("path"), OuterRef("path")), pk=category_id)
+    return Category.objects.filter(Exists(node))
+
+
+def in_categories(category_ids, field="category"):
+    """Q for the rows whose `field` is in the subtree of any of `category_ids`."""
+    return Q(**{f"{field}__in": descendants_of(category_ids).values("pk")})
+
+
+def apply_product_count(category_id, delta):
+    """Add `delta` products to a category and its ancestors in a single UPDATE."""
+    if category_id is None:
+        return
+    ancestors_of(category_id).update(product_count=F("product_count") + delta)
+
+
+def recount_categories(queryset=None, product_model=None):
+    """
+    Rebuild the product counts of `queryset` (all categories by default)
+    from the products. Returns the number of categories updated.
+    """
+    from .models import Category, Product
+
+    queryset = Category.objects.all() if queryset is None else queryset
+    product_model = product_model or Product
+    # The subtree's category ids first, so the count probes the product
+    # table's category index instead of joining every product's category.
+    subtree = queryset.model.objects.filter(StartsWith(F("path"), OuterRef(OuterRef("path")))).values("pk")
+    products = (
+        product_model.objects.filter(category__in=subtree)
+        .order_by()
+        .annotate(count=Func(F("pk"), function="COUNT", output_field=IntegerField()))
+        .values("count")
+    )
+    return queryset.update(product_count=Coalesce(Subquery(products), 0))
+
+
+def move_subtree(old_path, new_path):
+    """
+    Rewrite the paths below a category moved from `old_path` to `new_path`
+    and recount the categories it left and joined.
+    """
+    from .models import Category
+
+    with transaction.atomic():
+        Category.objects.filter(path__startswith=old_path).update(
+            path=Concat(Value(new_path), Substr("path", len(old_path) + 1))
+        )
+        recount_categories(Category.objects.filter(path__in=ancestor_paths(old_path) + ancestor_paths(new_path)))
+
+
+def category_tree(queryset=None):
+    """
+    The categories in depth-first order, siblings by name. One query.
+    """
+    from .models import Category
+
+    queryset = Category.objects.all() if queryset is None else queryset
+    children = {}
+    categories = list(queryset.order_by("name", "pk"))
+    paths = {category.path for category in categories}
+    for category in categories:
+        parent_path = category.path[: -len(category.cid) - 1]
+        # Categories whose parent is not in `queryset` are listed as roots.
+        children.setdefault(parent_path if parent_path in paths else "", []).append(category)
+
+    tree = []
+
+    def visit(path):
+        for category in children.get(path, []):
+            tree.append(category)
+            visit(category.path)
+
+    visit("")
+    return tree
@@ -0,0 +1,232 @@
+"""
+Faceted product filtering.
+
+`ProductFacets` turns query parameters into one filter per facet and
+counts, for every facet value, how many products would match if it were
+selected. As usual for facets, a facet's own selection is left out of its
+counts (picking one category still shows the other categories' counts),
+while every other facet's selection applies.
+
+The counts take three queries whatever the number of facet values: one
+aggregate with a conditional COUNT per price bucket, rating threshold and
+on-sale flag, one GROUP BY category (rolled up into subtree counts) and
+one GROUP BY ProductInfo parameter and value. Results are cached per
+catalog version, so repeated filter combinations cost a cache lookup until
+a product changes.
+"""
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Count, Q
+
+from .cache import get_catalog_version, get_product_cache
+from .categories import ancestor_paths, in_categories
+from .models import Category, ProductInfo
+
+DEFAULT_PRICE_BUCKETS = (0, 25, 50, 100, 250, 500)
+
+RATING_THRESHOLDS = (4, 3, 2, 1)
+
+# Most frequent values listed per ProductInfo parameter.
+MAX_INFO_VALUES = 10
+
+
+class InvalidFacet(ValueError):
+    def __init__(self, name, message):
+        super().__init__(message)
+        self.name = name
+
+
+def get_price_buckets():
+    """`[(label, low, high), ...]` from PRODUCT_PRICE_BUCKETS; the last is open-ended."""
+    bounds = [Decimal(str(b)) for b in getattr(settings, "PRODUCT_PRICE_BUCKETS", DEFAULT_PRICE_BUCKETS)]
+    buckets = [(f"{low}-{high}", low, high) for low, high in zip(bounds, bounds[1:])]
+    return buckets + [(f"{bounds[-1]}-", bounds[-1], None)]
+
+
+def price_bucket_filter(low, high):
+    condition = Q(effective_price__gte=low)
+    if high is not None:
+        condition &= Q(effective_price__lt=high)
+    return condition
+
+
+def subtree_counts(categories):
+    """
+    `[{"id", "name", "count"}, ...]` from rows of categories with their own
+    product counts: each count becomes that of the category's subtree.
+    Empty subtrees are left out, the largest come first.
+    """
+    categories = list(categories)
+    totals = dict.fromkeys((row["path"] for row in categories), 0)
+    for row in categories:
+        for path in ancestor_paths(row["path"]):
+            if path in totals:
+                totals[path] += row["count"]
+    counts = [
+        {"id": row["pk"], "name": row["name"], "count": totals[row["path"]]}
+        for row in categories
+        if totals[row["path"]]
+    ]
+    return sorted(counts, key=lambda entry: (-entry["count"], entry["id"]))
+
+
+class ProductFacets:
+    """
+    Parse facet selections from `params` (a QueryDict):
+
+    * `category` - category id, repeatable (any of them, with their subcategories)
+    * `price` - price bucket label such as `25-50` or `500-`, repeatable
+    * `rating` - minimum average rating, 1-5
+    * `on_sale` - `true` for discounted products only
+    * `info` - `<parameter>:<value>` of a ProductInfo row, repeatable (all of them)
+
+    Raises InvalidFacet for malformed values.
+    """
+
+    def __init__(self, params):
+        self.selected = {}
+        self.filters = {}
+
+        categories = params.getlist("category")
+        if categories:
+            try:
+                self.selected["category"] = sorted({int(c) for c in categories})
+            except ValueError:
+                raise InvalidFacet("category", "Expected a category id.")
+            self.filters["category"] = in_categories(self.selected["category"])
+
+        prices = params.getlist("price")
+        if prices:
+            buckets = {label: (low, high) for label, low, high in get_price_buckets()}
+            unknown = set(prices) - set(buckets)
+            if unknown:
+                raise InvalidFacet("price", f"Expected one of: {', '.join(buckets)}.")
+            self.selected["price"] = sorted(set(prices), key=list(buckets).index)
+            condition = Q()
+            for label in self.selected["price"]:
+                condition |= price_bucket_filter(*buckets[label])
+            self.filters["price"] = condition
+
+        rating = params.get("rating")
+        if rating:
+            try:
+                rating = Decimal(rating)
+            except InvalidOperation:
+                raise InvalidFacet("rating", "Expected a number between 1 and 5.")
+            if not 1 <= rating <= 5:
+                raise InvalidFacet("rating", "Expected a number between 1 and 5.")
+            self.selected["rating"] = rating
+            self.filters["rating"] = Q(rating_avg__gte=rating)
+
+        on_sale = params.get("on_sale")
+        if on_sale:
+            if on_sale.lower() not in ("true", "1", "false", "0"):
+                raise InvalidFacet("on_sale", "Expected true or false.")
+            self.selected["on_sale"] = on_sale.lower() in ("true", "1")
+            self.filters["on_sale"] = Q(old_price__isnull=not self.selected["on_sale"])
+
+        infos = params.getlist("info")
+        if infos:
+            pairs = []
+            for info in infos:
+                parameter, sep, value = info.partition(":")
+                if not sep or not parameter:
+                    raise InvalidFacet("info", "Expected <parameter>:<value>.")
+                pairs.append((parameter, value))
+            self.selected["info"] = sorted(set(pairs))
+            condition = Q()
+            for parameter, value in self.selected["info"]:
+                condition &= Q(
+                    pk__in=ProductInfo.objects.filter(
+                        parametrs=parameter, parameter_description=value
+                    ).values("product_id")
+                )
+            self.filters["info"] = condition
+
+    def condition(self, *exclude, only=None):
+        """The selected filters, minus `exclude` and limited to `only` if given."""
+        condition = Q()
+        for name, facet_filter in self.filters.items():
+            if name not in exclude and (only is None or name in only):
+                condition &= facet_filter
+        return condition
+
+    def filter(self, queryset):
+        return queryset.filter(self.condition())
+
+    def counts(self, queryset):
+        """Facet counts over `queryset` (the products before facet filtering)."""
+        # Facets counted in the single aggregate. The other selections apply
+        # to all of its counts, so they go in the WHERE clause instead of
+        # being repeated in every conditional COUNT.
+        bucketed = ("price", "rating", "on_sale")
+        aggregates = {}
+        for label, low, high in get_price_buckets():
+            aggregates[f"price:{label}"] = Count(
+                "pk", filter=self.condition("price", only=bucketed) & price_bucket_filter(low, high)
+            )
+        for threshold in RATING_THRESHOLDS:
+            aggregates[f"rating:{threshold}"] = Count(
+                "pk", filter=self.condition("rating", only=bucketed) & Q(rating_avg__gte=threshold)
+            )
+        aggregates["on_sale"] = Count(
+            "pk", filter=self.condition("on_sale", only=bucketed) & Q(old_price__isnull=False)
+        )
+        totals = queryset.filter(self.condition(*bucketed)).order_by().aggregate(**aggregates)
+
+        # Every category with its own matching products; the category filter
+        # selects whole subtrees, so they are added up through the ancestors.
+        matching = queryset.filter(self.condition("category")).order_by().values("pk")
+        categories = Category.objects.order_by().values("pk", "name", "path").annotate(
+            count=Count("product", filter=Q(product__in=matching))
+        )
+
+        info = {}
+        info_condition = self.condition("info")
+        if info_condition or queryset.query.has_filters():
+            info_rows = ProductInfo.objects.filter(
+                product__in=queryset.filter(info_condition).order_by().values("pk")
+            )
+        else:
+            # Whole catalog: a scan of the covering (parameter, value,
+            # product) index beats probing every product.
+            info_rows = ProductInfo.objects.filter(product__isnull=False)
+        info_rows = (
+            info_rows.filter(parametrs__isnull=False)
+            .values("parametrs", "parameter_description")
+            .annotate(count=Count("product"))
+            .order_by("parametrs", "-count", "parameter_description")
+        )
+        for row in info_rows:
+            values = info.setdefault(row["parametrs"], [])
+            if len(values) < MAX_INFO_VALUES:
+                values.append({"value": row["parameter_description"], "count": row["count"]})
+
+        return {
+            "category": subtree_counts(categories),
+            "price": [
+                {"value": label, "count": totals[f"price:{label}"]} for label, _, _ in get_price_buckets()
+            ],
+            "rating": [
+                {"value": threshold, "count": totals[f"rating:{threshold}"]} for threshold in RATING_THRESHOLDS
+            ],
+            "on_sale": totals["on_sale"],
+            "info": info,
+        }
+
+    def cached_counts(self, queryset, key_extra=""):
+        """
+        `counts()` cached until the catalog changes. `key_extra` must identify
+        any filtering already applied to `queryset` (e.g. the search query).
+        """
+        version, _ = get_catalog_version()
+        raw = f"{version}|{key_extra}|{sorted((k, str(v)) for k, v in self.selected.items())}"
+        key = "product-facets:" + hashlib.sha1(raw.encode()).hexdigest()
+        cache = get_product_cache()
+        counts = cache.get(key)
+        if counts is None:
+            counts = self.counts(queryset)
+            cache.set(key, counts, getattr(settings, "PRODUCT_CACHE_TIMEOUT", 60))
+        return counts
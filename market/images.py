@@ -0,0 +1,223 @@
+"""
+Product image derivatives.
+
+Every product image (`Product.image`, `ProductImages.images`) gets one WebP
+derivative per IMAGE_VARIANTS entry, scaled down to fit its bounding box.
+Derivatives are stored under `derivatives/` with names derived from the
+source file's content and the variant size, so identical uploads (the
+default image ...) share files and regenerating is a no-op. The stored
+names go in the model's `image_variants` together with the source they
+were made from; until they match the current image, URLs fall back to the
+original.
+
+Saving a model with a new image queues `process_image` in a pool of
+IMAGE_WORKERS threads; `backfill_variants` (the generate_image_variants
+command) covers existing rows and bulk imports. Rows still on the field's
+default image are skipped: the default is a placeholder path, not an upload.
+"""
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.db import connections
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = "derivatives"
+
+DEFAULT_VARIANTS = {"thumb": (320, 320), "large": (1200, 1200)}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_variant_specs():
+    """`{name: (max width, max height)}` from IMAGE_VARIANTS."""
+    variants = getattr(settings, "IMAGE_VARIANTS", DEFAULT_VARIANTS)
+    return {name: (int(width), int(height)) for name, (width, height) in variants.items()}
+
+
+def get_quality():
+    return int(getattr(settings, "IMAGE_WEBP_QUALITY", 80))
+
+
+def image_models():
+    """`[(model, image field name)]` of the models with derivatives."""
+    from .models import Product, ProductImages
+
+    return [(Product, "image"), (ProductImages, "images")]
+
+
+def is_default(model, image_field, image_name):
+    """Whether `image_name` is the field's default rather than an upload."""
+    return image_name == model._meta.get_field(image_field).get_default()
+
+
+def is_fresh(image_name, variants, specs=None):
+    """Whether `variants` were made from `image_name` and cover every variant."""
+    specs = get_variant_specs() if specs is None else specs
+    return bool(variants) and variants.get("source") == image_name and all(name in variants for name in specs)
+
+
+def variant_url(url, image_name, variants, variant):
+    """
+    URL of one derivative, or of the original while it is not generated.
+    `url` maps a stored name to its URL (the storage's `url` method).
+    """
+    if variants and variants.get("source") == image_name and variant in variants:
+        return url(variants[variant])
+    return url(image_name) if image_name else None
+
+
+def variant_urls(url, image_name, variants):
+    """`{variant: URL}` of the generated derivatives of the current image."""
+    if not variants or variants.get("source") != image_name:
+        return {}
+    return {name: url(stored) for name, stored in variants.items() if name != "source"}
+
+
+def _open(data):
+    image = Image.open(BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        transparent = "A" in image.mode or "transparency" in image.info
+        image = image.convert("RGBA" if transparent else "RGB")
+    return image
+
+
+def render_variants(storage, image_name, specs=None, quality=None):
+    """
+    Create the missing derivatives of a stored image and return the
+    `image_variants` value: `{"source": image_name, variant: stored name}`.
+    """
+    specs = get_variant_specs() if specs is None else specs
+    quality = get_quality() if quality is None else quality
+    with storage.open(image_name, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data).hexdigest()[:20]
+    variants = {"source": image_name}
+    image = None
+    for name, (width, height) in specs.items():
+        target = f"{DERIVATIVES_DIR}/{digest}-{width}x{height}-q{quality}.webp"
+        if not storage.exists(target):
+            if image is None:
+                image = _open(data)
+            derivative = image.copy()
+            # Only ever scales down, keeping the aspect ratio.
+            derivative.thumbnail((width, height), Image.LANCZOS)
+            buffer = BytesIO()
+            derivative.save(buffer, "WEBP", quality=quality, method=4)
+            target = storage.save(target, ContentFile(buffer.getvalue()))
+        variants[name] = target
+    return variants
+
+
+def _safe_render(storage, image_name, specs):
+    try:
+        return render_variants(storage, image_name, specs)
+    except (OSError, SuspiciousFileOperation, Image.DecompressionBombError) as e:
+        # Missing or unreadable files keep serving the original.
+        logger.warning("Cannot create derivatives of %s: %s", image_name, e)
+        return None
+
+
+def _changed(model, pks):
+    from .cache import bump_catalog_version, invalidate_product
+    from .models import Product
+
+    product_ids = pks
+    if model is not Product:
+        product_ids = model.objects.filter(pk__in=pks).values_list("product_id", flat=True)
+    for product_id in set(product_ids):
+        invalidate_product(product_id)
+    bump_catalog_version()
+
+
+def process_image(model, pk, image_field, force=False):
+    """Bring the derivatives of one row up to date. Returns its variants, or None."""
+    row = model.objects.filter(pk=pk).values_list(image_field, "image_variants").first()
+    if row is None or not row[0] or is_default(model, image_field, row[0]):
+        return None
+    image_name, variants = row
+    specs = get_variant_specs()
+    if not force and is_fresh(image_name, variants, specs):
+        return variants
+    storage = model._meta.get_field(image_field).storage
+    variants = _safe_render(storage, image_name, specs)
+    # Only if the image did not change meanwhile.
+    if variants is not None and model.objects.filter(pk=pk, **{image_field: image_name}).update(
+        image_variants=variants
+    ):
+        _changed(model, [pk])
+    return variants
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS, thread_name_prefix="images"
+            )
+        return _executor
+
+
+def _run_job(model, pk, image_field, in_worker=True):
+    try:
+        process_image(model, pk, image_field)
+    except Exception:
+        logger.exception("Image derivatives for %s %s failed", model.__name__, pk)
+    finally:
+        # Worker threads hold their own connections; don't leak them.
+        if in_worker:
+            connections.close_all()
+
+
+def submit_image_job(model, pk, image_field):
+    """
+    Generate the derivatives of one row in the IMAGE_WORKERS thread pool,
+    or inline with IMAGE_WORKERS = 0.
+    """
+    if getattr(settings, "IMAGE_WORKERS", 0):
+        get_executor().submit(_run_job, model, pk, image_field)
+    else:
+        _run_job(model, pk, image_field, in_worker=False)
+
+
+def backfill_variants(model, image_field, chunk_size=1000, force=False, workers=4):
+    """
+    Generate the missing derivatives of every row of `model`. Rows sharing
+    a source file are rendered once and updated together. Yields a dict
+    per chunk with the rows `scanned`, `updated` and `failed`.
+    """
+    from .utils import iter_pk_chunks
+
+    specs = get_variant_specs()
+    storage = model._meta.get_field(image_field).storage
+    rendered = {}
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="images") as pool:
+        default = model._meta.get_field(image_field).get_default()
+        for chunk in iter_pk_chunks(model.objects.exclude(**{image_field: default}), chunk_size):
+            rows = list(chunk.values_list("pk", image_field, "image_variants"))
+            stale = {}
+            for pk, image_name, variants in rows:
+                if image_name and (force or not is_fresh(image_name, variants, specs)):
+                    stale.setdefault(image_name, []).append(pk)
+            todo = [name for name in stale if name not in rendered]
+            for name, variants in zip(todo, pool.map(lambda name: _safe_render(storage, name, specs), todo)):
+                rendered[name] = variants
+            updated = failed = 0
+            for image_name, pks in stale.items():
+                if rendered[image_name] is None:
+                    failed += len(pks)
+                    continue
+                updated += model.objects.filter(pk__in=pks, **{image_field: image_name}).update(
+                    image_variants=rendered[image_name]
+                )
+            yield {"scanned": len(rows), "updated": updated, "failed": failed}
@@ -0,0 +1,184 @@
+"""
+Concurrent load test of the WSGI and ASGI entry points, in one process.
+
+`run_loadtest` sends the same mix of read requests (products list and
+detail, cart, orders) through both applications with `concurrency`
+requests in flight and reports the throughput and latencies of each:
+
+* WSGI: the sync endpoints, called from a pool of `wsgi_threads` threads
+  as a threaded WSGI server (gunicorn --threads, mod_wsgi) would. The
+  process never has more requests in progress than it has threads.
+* ASGI: their async variants (api/async_views.py), as `concurrency` tasks
+  on one event loop, as uvicorn or daphne would run them.
+
+No server or socket is involved: both applications are called directly, so
+only request handling is compared. `db_latency` (ms) delays every query,
+standing in for the round trip to a database server that SQLite does not
+have. While requests compute more than they wait, both paths are bound by
+the same CPU and the ASGI one is slower: Django runs the sync middleware
+and the ORM calls of an async view in a thread, one hand-off per call.
+"""
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import AsyncRequestFactory, RequestFactory
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# (sync path, async path, authenticated); `{product}` is a seeded product id.
+REQUESTS = [
+    ("/api/products/?page_size=50", "/api/async/products/?page_size=50", False),
+    ("/api/products/{product}/", "/api/async/products/{product}/", False),
+    ("/api/cart/", "/api/async/cart/", True),
+    ("/api/orders/", "/api/async/orders/", True),
+]
+
+
+class QueryDelay:
+    """Execute wrapper sleeping `latency` seconds before every query."""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def __call__(self, execute, sql, params, many, context):
+        time.sleep(self.latency)
+        return execute(sql, params, many, context)
+
+
+def _install_delay(delay):
+    def add(connection, **kwargs):
+        if delay not in connection.execute_wrappers:
+            connection.execute_wrappers.append(delay)
+
+    # Connections opened later by worker threads, and this thread's.
+    connection_created.connect(add, weak=False, dispatch_uid="loadtest-delay")
+    for connection in connections.all():
+        add(connection)
+
+    def remove():
+        connection_created.disconnect(dispatch_uid="loadtest-delay")
+        for connection in connections.all():
+            if delay in connection.execute_wrappers:
+                connection.execute_wrappers.remove(delay)
+
+    return remove
+
+
+def _plan(data, requests):
+    """`requests` `(sync path, async path, headers)`, cycling through REQUESTS."""
+    token = str(RefreshToken.for_user(data.user).access_token)
+    plan = []
+    for i in range(requests):
+        sync_path, async_path, authenticated = REQUESTS[i % len(REQUESTS)]
+        product = data.product_ids[i % len(data.product_ids)]
+        headers = {"Authorization": f"Bearer {token}"} if authenticated else {}
+        plan.append((sync_path.format(product=product), async_path.format(product=product), headers))
+    return plan
+
+
+def _summary(latencies, elapsed, failures):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "failures": failures,
+        "seconds": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+    }
+
+
+def run_wsgi(plan, threads):
+    application = get_wsgi_application()
+    factory = RequestFactory()
+    failures = []
+    lock = threading.Lock()
+
+    def call(path, headers):
+        environ = factory.get(path, headers=headers).environ
+        statuses = []
+        start = time.perf_counter()
+        body = application(environ, lambda status, response_headers, exc_info=None: statuses.append(status))
+        try:
+            b"".join(body)
+        finally:
+            body.close()
+        if not statuses[0].startswith("200"):
+            with lock:
+                failures.append(statuses[0])
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        latencies = list(pool.map(lambda item: call(item[0], item[2]), plan))
+    return _summary(latencies, time.perf_counter() - start, len(failures))
+
+
+async def _run_asgi(plan, concurrency):
+    application = get_asgi_application()
+    factory = AsyncRequestFactory()
+    queue = list(reversed(plan))
+    latencies, failures = [], []
+
+    async def call(path, headers):
+        scope = factory.get(path, headers=headers).scope
+        request_sent = False
+        statuses = []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            # No disconnect: the client waits for the whole response.
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                statuses.append(message["status"])
+
+        start = time.perf_counter()
+        await application(scope, receive, send)
+        latencies.append(time.perf_counter() - start)
+        if statuses[0] != 200:
+            failures.append(statuses[0])
+
+    async def worker():
+        while queue:
+            _, path, headers = queue.pop()
+            await call(path, headers)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return _summary(latencies, time.perf_counter() - start, len(failures))
+
+
+def run_asgi(plan, concurrency):
+    return asyncio.run(_run_asgi(plan, concurrency))
+
+
+def run_loadtest(data, requests=2000, concurrency=64, wsgi_threads=8, db_latency=0.0):
+    """
+    Load both entry points with the same `requests` and return
+    `{"wsgi": {...}, "asgi": {...}}` with their throughput and latencies.
+    `db_latency` is in milliseconds.
+    """
+    plan = _plan(data, requests)
+    remove_delay = _install_delay(QueryDelay(db_latency / 1000)) if db_latency else None
+    try:
+        # One pass of each first, so caches and imports are warm for both.
+        run_wsgi(plan[: len(REQUESTS)], 1)
+        run_asgi(plan[: len(REQUESTS)], 1)
+        return {
+            "wsgi": run_wsgi(plan, min(wsgi_threads, concurrency)),
+            "asgi": run_asgi(plan, concurrency),
+        }
+    finally:
+        if remove_delay is not None:
+            remove_delay()
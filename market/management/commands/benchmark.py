@@ -0,0 +1,109 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from market.benchmark import (
+    compare,
+    load_report,
+    run_benchmark,
+    run_serializer_benchmark,
+    seed,
+    uncovered_routes,
+    write_report,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database with a synthetic dataset, request every "
+        "api/market route and report query counts, p50/p95 latency and response "
+        "size. With --compare, fail when a route runs more queries than in the "
+        "baseline (an N+1 regression)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=int, default=1000, help="Number of products (1000, 10000, 100000 ...).")
+        parser.add_argument("--iterations", type=int, default=20, help="Requests per route.")
+        parser.add_argument("--output", help="Write the report to this JSON file.")
+        parser.add_argument("--compare", metavar="BASELINE", help="Diff against a baseline JSON report.")
+        parser.add_argument(
+            "--latency-tolerance",
+            type=float,
+            default=0.5,
+            help="Allowed relative p95 growth before a latency regression is reported (0.5 = +50%%).",
+        )
+        parser.add_argument(
+            "--serializers",
+            action="store_true",
+            help="Also time the list serializers against the .values() fast path on the whole dataset.",
+        )
+        parser.add_argument(
+            "--fail-on-latency",
+            action="store_true",
+            help="Treat latency regressions as failures, not just warnings.",
+        )
+
+    def handle(self, *args, **options):
+        missing = uncovered_routes()
+        if missing:
+            raise CommandError(
+                "Routes without a benchmark entry: "
+                + ", ".join(f"{module}:{name}" for module, name in missing)
+            )
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+                start = time.perf_counter()
+                data = seed(options["scale"])
+                self.stdout.write(
+                    f"Seeded scale={options['scale']} in {time.perf_counter() - start:.1f}s"
+                )
+                routes = run_benchmark(data, iterations=options["iterations"])
+                serializers = run_serializer_benchmark() if options["serializers"] else None
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "scale": options["scale"],
+            "iterations": options["iterations"],
+            "database": connection.vendor,
+            "routes": routes,
+        }
+        width = max(len(key) for key in routes)
+        self.stdout.write(f"{'route':<{width}}  queries    p50 ms    p95 ms     bytes")
+        for key, metrics in routes.items():
+            self.stdout.write(
+                f"{key:<{width}}  {metrics['queries']:>7}  {metrics['p50_ms']:>8.2f}  "
+                f"{metrics['p95_ms']:>8.2f}  {metrics['bytes']:>8}"
+            )
+
+        if serializers:
+            self.stdout.write("")
+            self.stdout.write(f"{'serialization':<16}  {'rows':>6}  serializer ms  fast ms  speedup")
+            for name, metrics in serializers.items():
+                self.stdout.write(
+                    f"{name:<16}  {metrics['rows']:>6}  {metrics['serializer_ms']:>13.1f}  "
+                    f"{metrics['fast_ms']:>7.1f}  {metrics['speedup']:>6.1f}x"
+                )
+
+        if options["output"]:
+            write_report(report, options["output"])
+            self.stdout.write(f"Report written to {options['output']}")
+
+        if options["compare"]:
+            query_regressions, latency_regressions = compare(
+                report, load_report(options["compare"]), options["latency_tolerance"]
+            )
+            for message in latency_regressions:
+                self.stdout.write(self.style.WARNING(f"slower: {message}"))
+            for message in query_regressions:
+                self.stdout.write(self.style.ERROR(f"more queries: {message}"))
+            if query_regressions or (options["fail_on_latency"] and latency_regressions):
+                raise CommandError("Benchmark regressed against the baseline.")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
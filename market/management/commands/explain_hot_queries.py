@@ -0,0 +1,83 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from market.models import Cart, CartItem, Order, Product, ProductReview
+
+
+def hot_queries():
+    """
+    The lookups the storefront runs on every request, keyed by a short name.
+
+    Parameter values are placeholders: only the shape of the query matters
+    for the plan.
+    """
+    now = timezone.now()
+    return {
+        "orders by customer and status": Order.objects.filter(
+            customer_id=1, status="Paid"
+        ).order_by("created"),
+        "orders by status and date": Order.objects.filter(
+            status__in=["Undecided", "Paid"], created__range=[now, now]
+        ).order_by("created", "status"),
+        "cart by user": Cart.objects.filter(user_id=1),
+        "cart item by cart and product": CartItem.objects.filter(cart_id=1, product_id=1),
+        "reviews by product": ProductReview.objects.filter(product_id=1).order_by("-date", "-id"),
+        "products by category": Product.objects.filter(category_id=1).order_by("created"),
+        "products after cursor": Product.objects.filter(created__gt=now).order_by("created", "id"),
+        "products by price": Product.objects.filter(effective_price__lte=100).order_by(
+            "effective_price", "id"
+        ),
+    }
+
+
+def find_full_scans(plan, table):
+    """
+    Return the lines of a query plan that read the whole of `table`.
+
+    Understands SQLite and PostgreSQL ("Seq Scan on <table>") plans. In
+    SQLite plans only a SEARCH is an index lookup: "SCAN <table>" reads
+    every row, with or without "USING [COVERING] INDEX" (which only means
+    the rows come in index order).
+    """
+    scans = []
+    for line in plan.splitlines():
+        if re.search(rf"\bSeq Scan on {table}\b", line):
+            scans.append(line.strip())
+        elif re.search(rf"\bSCAN (TABLE )?{table}\b", line):
+            scans.append(line.strip())
+    return scans
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the hot lookup queries and fail if any of them falls back to "
+        "a full table scan. PostgreSQL prefers sequential scans on tiny tables, "
+        "so run it against a realistically sized database there."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verbose-plans", action="store_true", help="Print the full plan of every query."
+        )
+
+    def handle(self, *args, **options):
+        failures = []
+        for name, queryset in hot_queries().items():
+            plan = queryset.explain()
+            scans = find_full_scans(plan, queryset.model._meta.db_table)
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f"FULL SCAN  {name}: {'; '.join(scans)}"))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"ok         {name}"))
+            if options["verbose_plans"]:
+                self.stdout.write(f"  {queryset.query}\n  " + plan.replace("\n", "\n  "))
+
+        if failures:
+            raise CommandError(
+                f"{len(failures)} hot quer{'y' if len(failures) == 1 else 'ies'} "
+                f"regressed to a full scan on {connection.vendor}: {', '.join(failures)}"
+            )
@@ -0,0 +1,43 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.catalog import FORMATS, CatalogError, export_products, guess_format
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream every product to a catalog file (JSON fixture array, JSON lines "
+        "or CSV) that import_products reads back. Categories are written by name."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Output file, or - for standard output.")
+        parser.add_argument("--format", choices=FORMATS, help="File format (default: from the extension).")
+        parser.add_argument("--chunk-size", type=int, default=2000, help="Products per query.")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        path = options["path"]
+        try:
+            fmt = options["format"] or guess_format(path)
+        except CatalogError as exc:
+            raise CommandError(f"{exc} Pass --format.")
+
+        exported = 0
+        start = time.perf_counter()
+        stream = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+        try:
+            for count in export_products(stream, fmt, chunk_size=options["chunk_size"]):
+                exported += count
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+        elapsed = time.perf_counter() - start
+
+        rate = exported / elapsed if elapsed else 0
+        # Keep standard output clean when the catalog is written to it.
+        out = self.stderr if path == "-" else self.stdout
+        out.write(f"Exported {exported} products in {elapsed:.2f}s ({rate:.0f} products/s)")
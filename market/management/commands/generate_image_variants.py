@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from market.cache import bump_catalog_version, invalidate_all_products
+from market.images import backfill_variants, get_variant_specs, image_models
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the WebP derivatives (IMAGE_VARIANTS) of every product and "
+        "gallery image that lacks them, e.g. after deploying new variant sizes "
+        "or a bulk import. Uploads are processed automatically."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000, help="Rows per batch.")
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=max(getattr(settings, "IMAGE_WORKERS", 0), 4),
+            help="Threads encoding images.",
+        )
+        parser.add_argument("--force", action="store_true", help="Regenerate up-to-date rows too.")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        self.stdout.write(
+            "Variants: " + ", ".join(f"{name} {w}x{h}" for name, (w, h) in get_variant_specs().items())
+        )
+        changed = False
+        for model, image_field in image_models():
+            totals = {"scanned": 0, "updated": 0, "failed": 0}
+            start = time.perf_counter()
+            for result in backfill_variants(
+                model,
+                image_field,
+                chunk_size=options["chunk_size"],
+                force=options["force"],
+                workers=options["workers"],
+            ):
+                for name, value in result.items():
+                    totals[name] += value
+            elapsed = time.perf_counter() - start
+            changed = changed or bool(totals["updated"])
+            self.stdout.write(
+                f"{model._meta.verbose_name_plural}: scanned {totals['scanned']}, updated {totals['updated']}, "
+                f"{totals['failed']} without a readable image, in {elapsed:.2f}s"
+            )
+        if changed:
+            # QuerySet.update() sends no post_save signals.
+            invalidate_all_products()
+            bump_catalog_version()
@@ -0,0 +1,71 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.cache import bump_catalog_version, invalidate_all_products
+from market.catalog import FORMATS, CatalogError, guess_format, import_products, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream a product catalog (JSON array or fixture, JSON lines or CSV) into "
+        "the database in batches: records with an id are upserted, the others "
+        "inserted. Categories are matched by name and created when missing. "
+        "Invalid records are reported and skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="Catalog file, or - for standard input.")
+        parser.add_argument("--format", choices=FORMATS, help="File format (default: from the extension).")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Records per transaction.")
+        parser.add_argument(
+            "--no-create-categories",
+            action="store_true",
+            help="Reject records whose category does not exist instead of creating it.",
+        )
+        parser.add_argument("--max-errors", type=int, default=20, help="Invalid records to list (all are counted).")
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive.")
+        path = options["path"]
+        try:
+            fmt = options["format"] or guess_format(path)
+        except CatalogError as exc:
+            raise CommandError(f"{exc} Pass --format.")
+
+        totals = {"read": 0, "created": 0, "updated": 0, "errors": 0}
+        start = time.perf_counter()
+        stream = sys.stdin if path == "-" else open(path, encoding="utf-8", newline="")
+        try:
+            for result in import_products(
+                read_records(stream, fmt),
+                batch_size=options["batch_size"],
+                create_categories=not options["no_create_categories"],
+            ):
+                for number, message in result["errors"]:
+                    if totals["errors"] < options["max_errors"]:
+                        self.stderr.write(f"record {number}: {message}")
+                    totals["errors"] += 1
+                for name in ("read", "created", "updated"):
+                    totals[name] += result[name]
+                if options["verbosity"] > 1:
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f"  {totals['read']} records, {totals['read'] / elapsed:.0f} records/s")
+        except CatalogError as exc:
+            raise CommandError(f"{path}: {exc}")
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+            if totals["created"] or totals["updated"]:
+                # bulk_create sends no post_save signals.
+                invalidate_all_products()
+                bump_catalog_version()
+        elapsed = time.perf_counter() - start
+
+        rate = totals["read"] / elapsed if elapsed else 0
+        self.stdout.write(
+            f"Read {totals['read']} records in {elapsed:.2f}s ({rate:.0f} records/s): "
+            f"{totals['created']} created, {totals['updated']} updated, {totals['errors']} skipped"
+        )
@@ -0,0 +1,73 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from market.benchmark import seed
+from market.loadtest import run_loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database, then send the same concurrent read "
+        "requests (products, product, cart, orders) through the WSGI application "
+        "with a thread pool and through the ASGI application to their async "
+        "variants, and report requests per second and latencies of each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--scale", type=int, default=1000, help="Number of products.")
+        parser.add_argument("--requests", type=int, default=2000, help="Requests per entry point.")
+        parser.add_argument("--concurrency", type=int, default=64, help="Requests in flight.")
+        parser.add_argument(
+            "--wsgi-threads", type=int, default=8, help="Threads of the WSGI process (gunicorn --threads)."
+        )
+        parser.add_argument(
+            "--db-latency",
+            type=float,
+            default=20.0,
+            help=(
+                "Milliseconds added to every query, standing in for a remote database or other I/O waits. "
+                "The ASGI path only pulls ahead once requests wait longer than they compute; 0 disables it."
+            ),
+        )
+
+    def handle(self, *args, **options):
+        for name in ("requests", "concurrency", "wsgi_threads"):
+            if options[name] < 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be positive.")
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(MEDIA_ROOT=tempfile.mkdtemp()):
+                start = time.perf_counter()
+                data = seed(options["scale"])
+                self.stdout.write(f"Seeded scale={options['scale']} in {time.perf_counter() - start:.1f}s")
+                results = run_loadtest(
+                    data,
+                    requests=options["requests"],
+                    concurrency=options["concurrency"],
+                    wsgi_threads=options["wsgi_threads"],
+                    db_latency=options["db_latency"],
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(
+            f"{options['requests']} requests, {options['concurrency']} in flight, "
+            f"{options['wsgi_threads']} WSGI threads, {options['db_latency']:g} ms per query"
+        )
+        self.stdout.write(f"{'entry point':<12}  {'req/s':>8}  {'p50 ms':>8}  {'p95 ms':>8}  failures")
+        for name, metrics in results.items():
+            self.stdout.write(
+                f"{name:<12}  {metrics['requests_per_s']:>8.1f}  {metrics['p50_ms']:>8.2f}  "
+                f"{metrics['p95_ms']:>8.2f}  {metrics['failures']:>8}"
+            )
+        if any(metrics["failures"] for metrics in results.values()):
+            raise CommandError("Some requests did not return 200 OK.")
+        speedup = results["asgi"]["requests_per_s"] / results["wsgi"]["requests_per_s"]
+        self.stdout.write(f"ASGI/WSGI throughput: {speedup:.2f}x")
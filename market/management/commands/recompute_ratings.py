@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.cache import bump_catalog_version, invalidate_all_products
+from market.ratings import recompute_ratings
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild every product's rating count, average and histogram from its "
+        "reviews. The signals keep them current; run this after bulk review "
+        "imports or edits that bypass them (QuerySet.update, bulk_create, raw SQL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Products per UPDATE.")
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        start = time.perf_counter()
+        updated = recompute_ratings(chunk_size=options["chunk_size"])
+        elapsed = time.perf_counter() - start
+        invalidate_all_products()
+        bump_catalog_version()
+        self.stdout.write(f"Recomputed ratings of {updated} products in {elapsed:.2f}s")
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from market.cache import bump_catalog_version, invalidate_all_products
+from market.pricing import get_sale_rules, reprice_products
+
+
+class Command(BaseCommand):
+    help = (
+        "Apply the sale rules (PRODUCT_SALE_RULES) to the whole catalog with "
+        "chunked, set-based UPDATEs. Products cross sale thresholds as they "
+        "age, so schedule it daily (e.g. from cron shortly after midnight)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Products per UPDATE.")
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Report what would change without writing."
+        )
+
+    def handle(self, *args, **options):
+        if options["chunk_size"] < 1:
+            raise CommandError("--chunk-size must be positive.")
+        rules = get_sale_rules()
+        self.stdout.write(
+            "Rules: "
+            + (", ".join(f">= {age} days: x{factor}" for age, factor in sorted(rules)) or "none")
+        )
+
+        totals = {"scanned": 0, "changed": 0, "on_sale": 0, "off_sale": 0}
+        chunks = 0
+        start = time.perf_counter()
+        for result in reprice_products(
+            chunk_size=options["chunk_size"], dry_run=options["dry_run"], rules=rules
+        ):
+            chunks += 1
+            for name, value in result.items():
+                totals[name] += value
+            if options["verbosity"] > 1:
+                self.stdout.write(f"  chunk {chunks}: {result}")
+        elapsed = time.perf_counter() - start
+
+        if totals["changed"] and not options["dry_run"]:
+            # QuerySet.update() sends no post_save signals.
+            invalidate_all_products()
+            bump_catalog_version()
+
+        rate = totals["scanned"] / elapsed if elapsed else 0
+        verb = "would change" if options["dry_run"] else "changed"
+        self.stdout.write(
+            f"Scanned {totals['scanned']} products in {chunks} chunks, {verb} {totals['changed']} "
+            f"in {elapsed:.2f}s ({rate:.0f} products/s)"
+        )
+        if options["dry_run"]:
+            self.stdout.write(
+                f"  going on sale: {totals['on_sale']}, coming off sale: {totals['off_sale']}, "
+                f"other price corrections: {totals['changed'] - totals['on_sale'] - totals['off_sale']}"
+            )
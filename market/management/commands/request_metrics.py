@@ -0,0 +1,36 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from FitGear.instrumentation import collect, reset, summarize
+
+
+class Command(BaseCommand):
+    help = (
+        "Print the per-view request metrics (query count, DB/serializer/template "
+        "time and latency histogram) collected by RequestMetricsMiddleware."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--json", action="store_true", help="Print the raw summary as JSON.")
+        parser.add_argument("--reset", action="store_true", help="Clear the collected metrics afterwards.")
+
+    def handle(self, *args, **options):
+        rows = summarize(collect())
+        if options["json"]:
+            self.stdout.write(json.dumps(rows, indent=2))
+        elif not rows:
+            self.stdout.write("No request metrics collected yet.")
+        else:
+            width = max(len(row["view"]) for row in rows)
+            self.stdout.write(
+                f"{'view':<{width}}  count    avg ms     db ms    ser ms   tmpl ms  queries  max q"
+            )
+            for row in rows:
+                self.stdout.write(
+                    f"{row['view']:<{width}}  {row['count']:>5}  {row['avg_ms']:>8.2f}  "
+                    f"{row['avg_db_ms']:>8.2f}  {row['avg_serializer_ms']:>8.2f}  "
+                    f"{row['avg_template_ms']:>8.2f}  {row['avg_queries']:>7.1f}  {row['max_queries']:>5}"
+                )
+        if options["reset"]:
+            reset()
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:12
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    CartItem = apps.get_model("market", "CartItem")
+    duplicates = (
+        CartItem.objects.values("cart_id", "product_id")
+        .annotate(rows=Count("id"))
+        .filter(rows__gt=1)
+    )
+    for duplicate in duplicates:
+        items = list(
+            CartItem.objects.filter(
+                cart_id=duplicate["cart_id"], product_id=duplicate["product_id"]
+            ).order_by("id")
+        )
+        keep = items[0]
+        keep.quantity = sum(item.quantity for item in items)
+        keep.price_sum = sum(item.price_sum for item in items)
+        keep.save(update_fields=["quantity", "price_sum"])
+        CartItem.objects.filter(id__in=[item.id for item in items[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("market", "0006_remove_order_price"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="cartitem",
+            name="price_sum",
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cartitem",
+            constraint=models.UniqueConstraint(
+                fields=("cart", "product"), name="unique_cart_product"
+            ),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:15
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    Cart = apps.get_model("market", "Cart")
+    CartItem = apps.get_model("market", "CartItem")
+    duplicates = (
+        Cart.objects.filter(user__isnull=False)
+        .values("user_id")
+        .annotate(carts=Count("id"))
+        .filter(carts__gt=1)
+    )
+    for duplicate in duplicates:
+        carts = list(Cart.objects.filter(user_id=duplicate["user_id"]).order_by("id"))
+        keep = carts[0]
+        for cart in carts[1:]:
+            for item in CartItem.objects.filter(cart=cart):
+                existing = CartItem.objects.filter(cart=keep, product_id=item.product_id).first()
+                if existing:
+                    existing.quantity += item.quantity
+                    existing.price_sum += item.price_sum
+                    existing.save(update_fields=["quantity", "price_sum"])
+                    item.delete()
+                else:
+                    item.cart = keep
+                    item.save(update_fields=["cart"])
+            cart.delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("market", "0007_cartitem_unique_cart_product"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["customer", "status", "created"],
+                name="order_customer_status_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["status", "created"], name="order_status_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["created", "id"], name="product_created_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["category", "created"], name="product_category_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="productreview",
+            index=models.Index(
+                fields=["product", "date"], name="review_product_date_idx"
+            ),
+        ),
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="cart",
+            constraint=models.UniqueConstraint(
+                fields=("user",), name="unique_cart_user"
+            ),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.2 on 2026-10-18 15:40
+
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Case, DecimalField, F, Value, When
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+# The sale rules as of this migration: (minimum age in days, price factor),
+# largest age first.
+SALE_RULES = ((30, Decimal("0.8")),)
+
+
+def populate_sale_prices(apps, schema_editor):
+    # Existing prices are taken as base prices; from now on they are never
+    # rewritten by the sale. Rows the old save() had already marked down
+    # (old_price set) are not discounted again: their price stays what
+    # customers pay and old_price becomes the base. One UPDATE, so every
+    # F() below reads the values from before the migration.
+    Product = apps.get_model("market", "Product")
+    today = timezone.localtime().replace(hour=0, minute=0, second=0, microsecond=0)
+    output_field = DecimalField(max_digits=10, decimal_places=2)
+    effective_price = Case(
+        When(old_price__isnull=False, then=F("price")),
+        *[
+            When(
+                created__lt=today - timedelta(days=age),
+                then=Round(F("price") * Value(factor, output_field=output_field), 2),
+            )
+            for age, factor in SALE_RULES
+        ],
+        default=F("price"),
+        output_field=output_field,
+    )
+    old_price = Case(
+        When(old_price__isnull=False, then=F("old_price")),
+        When(created__lt=today - timedelta(days=min(age for age, _ in SALE_RULES)), then=F("price")),
+        default=Value(None),
+        output_field=output_field,
+    )
+    Product.objects.update(
+        price=Coalesce(F("old_price"), F("price")), effective_price=effective_price, old_price=old_price
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market", "0008_hot_lookup_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="effective_price",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, editable=False, max_digits=10, null=True
+            ),
+        ),
+        migrations.RunPython(populate_sale_prices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["effective_price", "id"], name="product_effective_price_idx"),
+        ),
+    ]
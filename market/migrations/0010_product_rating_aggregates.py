@@ -0,0 +1,92 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:25
+
+from django.db import migrations, models
+from django.db.models import Case, Count, DecimalField, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+
+STARS = (1, 2, 3, 4, 5)
+
+
+def populate_ratings(apps, schema_editor):
+    # What market.ratings.recompute_ratings did at the time, inlined.
+    Product = apps.get_model("market", "Product")
+    ProductReview = apps.get_model("market", "ProductReview")
+    ratings = ProductReview.objects.filter(product=OuterRef("pk"), rating__in=STARS).order_by().values("product")
+
+    def aggregate(expression):
+        return Coalesce(Subquery(ratings.annotate(value=expression).values("value")), 0)
+
+    Product.objects.update(
+        rating_count=aggregate(Count("pk")),
+        rating_sum=aggregate(Sum("rating")),
+        **{f"rating_{star}": aggregate(Count("pk", filter=Q(rating=star))) for star in STARS},
+    )
+    output_field = DecimalField(max_digits=3, decimal_places=2)
+    Product.objects.update(
+        rating_avg=Case(
+            When(
+                rating_count__gt=0,
+                then=Cast(Round(Cast(F("rating_sum"), FloatField()) / F("rating_count"), 2), output_field),
+            ),
+            default=Value(None),
+            output_field=output_field,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("market", "0009_product_effective_price"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="rating_1",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_2",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_3",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_4",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_5",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_avg",
+            field=models.DecimalField(
+                blank=True, decimal_places=2, editable=False, max_digits=3, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="rating_sum",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_ratings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(
+                fields=["rating_avg", "id"], name="product_rating_avg_idx"
+            ),
+        ),
+    ]
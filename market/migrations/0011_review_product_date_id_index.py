@@ -0,0 +1,22 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("market", "0010_product_rating_aggregates"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="productreview",
+            name="review_product_date_idx",
+        ),
+        migrations.AddIndex(
+            model_name="productreview",
+            index=models.Index(
+                fields=["product", "date", "id"], name="review_product_date_id_idx"
+            ),
+        ),
+    ]
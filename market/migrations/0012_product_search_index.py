@@ -0,0 +1,70 @@
+# Generated by Django 4.2.2 on 2026-10-18 16:05
+
+from django.db import migrations
+from django.utils.html import strip_tags
+
+SEARCH_TABLE = "market_product_search"
+
+# The index as this migration creates it, inlined from market.search.
+CREATE_SQL = {
+    "sqlite": [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "name, short_description, description, "
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+    ],
+    "postgresql": [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        "product_id bigint PRIMARY KEY REFERENCES market_product (id) ON DELETE CASCADE "
+        "DEFERRABLE INITIALLY DEFERRED, "
+        "document tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx ON {SEARCH_TABLE} USING GIN (document)",
+    ],
+}
+
+INSERT_SQL = {
+    "sqlite": f"INSERT INTO {SEARCH_TABLE} (rowid, name, short_description, description) VALUES (%s, %s, %s, %s)",
+    "postgresql": (
+        f"INSERT INTO {SEARCH_TABLE} (product_id, document) VALUES (%s, "
+        "setweight(to_tsvector('english', %s), 'A') || "
+        "setweight(to_tsvector('english', %s), 'B') || "
+        "setweight(to_tsvector('english', %s), 'C'))"
+    ),
+}
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor not in CREATE_SQL:
+        return
+    for sql in CREATE_SQL[vendor]:
+        schema_editor.execute(sql)
+
+    Product = apps.get_model("market", "Product")
+    products = Product.objects.order_by("pk").values_list("pk", "name", "short_description", "description")
+    last_pk = 0
+    with schema_editor.connection.cursor() as cursor:
+        while True:
+            rows = [
+                (pk, name or "", short or "", strip_tags(description or ""))
+                for pk, name, short, description in products.filter(pk__gt=last_pk)[:2000]
+            ]
+            if not rows:
+                return
+            cursor.executemany(INSERT_SQL[vendor], rows)
+            last_pk = rows[-1][0]
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("market", "0011_review_product_date_id_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
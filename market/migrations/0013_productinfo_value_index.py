@@ -0,0 +1,19 @@
+# Generated by Django 4.2.2 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("market", "0012_product_search_index"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="productinfo",
+            index=models.Index(
+                fields=["parametrs", "parameter_description", "product"],
+                name="productinfo_value_idx",
+            ),
+        ),
+    ]
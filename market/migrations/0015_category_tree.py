@@ -0,0 +1,50 @@
+# Generated by Django 4.2.2 on 2026-10-18 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Concat
+
+
+def populate_paths(apps, schema_editor):
+    # Every existing category becomes a root, so its subtree count is just
+    # its own products.
+    Category = apps.get_model("market", "Category")
+    Product = apps.get_model("market", "Product")
+    Category.objects.update(path=Concat(F("cid"), Value("/")))
+    products = (
+        Product.objects.filter(category=OuterRef("pk")).order_by().values("category").annotate(count=Count("pk"))
+    )
+    Category.objects.update(product_count=Coalesce(Subquery(products.values("count")), 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("market", "0014_image_variants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="category",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="children",
+                to="market.category",
+            ),
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="path",
+            field=models.CharField(db_index=True, default="", editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="category",
+            name="product_count",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
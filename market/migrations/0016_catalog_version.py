@@ -0,0 +1,39 @@
+# Generated by Django 4.2.2 on 2026-10-18 13:31
+
+import time
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_version_row(apps, schema_editor):
+    # The row market.cache reads; a fresh version retires whatever the
+    # processes cached before the upgrade.
+    CatalogVersion = apps.get_model("market", "CatalogVersion")
+    CatalogVersion.objects.create(pk=1, version=time.time_ns(), modified=timezone.now())
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("market", "0015_category_tree"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CatalogVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.BigIntegerField()),
+                ("modified", models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(create_version_row, migrations.RunPython.noop),
+    ]
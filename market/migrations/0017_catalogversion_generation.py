@@ -0,0 +1,17 @@
+# Generated by Django 4.2.2 on 2026-10-18 13:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("market", "0016_catalog_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="catalogversion",
+            name="generation",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.2 on 2026-10-18 13:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("market", "0017_catalogversion_generation"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BillJob",
+            fields=[
+                (
+                    "id",
+                    models.CharField(max_length=32, primary_key=True, serialize=False),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "PENDING"),
+                            ("running", "RUNNING"),
+                            ("done", "DONE"),
+                            ("failed", "FAILED"),
+                        ],
+                        default="pending",
+                        max_length=10,
+                    ),
+                ),
+                ("file", models.CharField(blank=True, default="", max_length=255)),
+                ("changed", models.BooleanField(blank=True, null=True)),
+                ("error", models.TextField(blank=True, default="")),
+                ("updated", models.DateTimeField(auto_now=True)),
+                (
+                    "order",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="bill_jobs",
+                        to="market.order",
+                    ),
+                ),
+            ],
+        ),
+    ]
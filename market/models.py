@@ -1,11 +1,15 @@
 from ckeditor.fields import RichTextField
-from datetime import timedelta, datetime
+from datetime import datetime
 from shortuuid.django_fields import ShortUUIDField
 from django.utils.html import mark_safe
 from django.utils import timezone
 from users.models import User
 from django.db import models
-from decimal import Decimal
+from django.db.models.functions import Coalesce
+from .images import variant_url
+from .pricing import sale_price
+from .categories import PATH_MAX_LENGTH, SEPARATOR
+from .ratings import RATING_FIELDS, STARS
 
 RATING = (
     ( 1,  "★☆☆☆☆"),
@@ -19,6 +23,11 @@ RATING = (
 class Category(models.Model):
     cid = ShortUUIDField(unique=True, length=10, max_length=30, prefix='cat')
     name = models.CharField(max_length=100, blank=True, null=True)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    # Materialized path and subtree product count (market.categories), kept
+    # in sync by the signals.
+    path = models.CharField(max_length=PATH_MAX_LENGTH, db_index=True, editable=False)
+    product_count = models.PositiveIntegerField(default=0, editable=False)
 
     class Meta:
         verbose_name_plural = "Categories"
@@ -27,6 +36,15 @@ class Category(models.Model):
     def __str__(self):
         return str(self.name)
 
+    @property
+    def depth(self):
+        return self.path.count(SEPARATOR) - 1
+
+    @property
+    def tree_name(self):
+        # Indented by depth, for flat lists such as a <select>
+        return '\u2014 ' * self.depth + str(self.name)
+
 
 class Product(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True)
@@ -38,9 +56,35 @@ class Product(models.Model):
     old_price = models.DecimalField(
         default=None, max_digits=10, decimal_places=2, blank=True, null=True
     )
+    # Price after sale rules (market.pricing), kept in sync on save and by the
+    # repricing job so listings can filter and sort on it in SQL.
+    effective_price = models.DecimalField(
+        max_digits=10, decimal_places=2, blank=True, null=True, editable=False
+    )
     created = models.DateTimeField(
         auto_now_add=False, blank=True, null=True, default=timezone.now
     )
+    # Rating aggregates (market.ratings), maintained by the review signals.
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_avg = models.DecimalField(
+        max_digits=3, decimal_places=2, blank=True, null=True, editable=False
+    )
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
+    # Stored names of the image's derivatives (market.images).
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created", "id"], name="product_created_id_idx"),
+            models.Index(fields=["category", "created"], name="product_category_created_idx"),
+            models.Index(fields=["effective_price", "id"], name="product_effective_price_idx"),
+            models.Index(fields=["rating_avg", "id"], name="product_rating_avg_idx"),
+        ]
 
 
     def __str__(self):
@@ -48,25 +92,50 @@ class Product(models.Model):
 
 
     def save(self, *args, **kwargs):
-        self.make_sale
-        print(self.old_price)
+        self.apply_sale()
+        if not self._state.adding and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            # The rating columns are only written by relative UPDATEs and the
+            # image variants by the image workers; saving a stale instance
+            # (e.g. from the admin) must not overwrite them.
+            kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in RATING_FIELDS and field.name != "image_variants"
+            ]
         super().save(*args, **kwargs)
 
 
+    def apply_sale(self):
+        # `price` is the base price and is never rewritten; the sale price is
+        # derived from it, so saving a product twice cannot compound discounts.
+        self.effective_price, self.old_price = sale_price(self.price, self.created)
+
+
     @property
-    def make_sale(self):
-        if self.created and self.created.date() < timezone.now().date() - timedelta(
-            days=30):
-            self.old_price = self.price * Decimal(0.8)
-            self.price =  self.price * Decimal(0.8)
-        else:
-            self.old_price = None
+    def current_price(self):
+        return self.effective_price if self.effective_price is not None else self.price
+
+
+    @property
+    def rating_histogram(self):
+        return {star: getattr(self, f"rating_{star}") for star in STARS}
+
+
+    @property
+    def thumbnail_url(self):
+        return variant_url(self.image.storage.url, self.image.name, self.image_variants, "thumb")
+
+
+    @property
+    def large_image_url(self):
+        return variant_url(self.image.storage.url, self.image.name, self.image_variants, "large")
 
 
 class ProductImages(models.Model):
     images = models.ImageField(upload_to="product-images", default="product.jpg")
     product = models.ForeignKey(Product, related_name="p_images", on_delete=models.SET_NULL, null=True)
     date = models.DateTimeField(auto_now_add=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
 
     class Meta:
@@ -78,6 +147,13 @@ class ProductInfo(models.Model):
     parametrs = models.CharField(max_length=100, null=True, blank=True)
     parameter_description = models.CharField(max_length=200, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["parametrs", "parameter_description", "product"], name="productinfo_value_idx"
+            ),
+        ]
+
 
 class ProductReview(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
@@ -88,6 +164,9 @@ class ProductReview(models.Model):
 
     class Meta:
         verbose_name_plural = "Product Reviews"
+        indexes = [
+            models.Index(fields=["product", "date", "id"], name="review_product_date_id_idx"),
+        ]
 
     def __str__(self):
         return self.product.name
@@ -101,18 +180,41 @@ class Cart(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user"], name="unique_cart_user"),
+        ]
+
     def __str__(self) -> str:
         return str(f"{self.user}'s cart")
 
+    def get_totals(self):
+        # One aggregate query priced at the products' current prices, instead
+        # of re-saving and re-summing every line in Python.
+        totals = self.items.aggregate(
+            total_price=models.Sum(
+                models.F("quantity")
+                * Coalesce(models.F("product__effective_price"), models.F("product__price"))
+            ),
+            item_count=models.Count("id"),
+        )
+        totals["total_price"] = totals["total_price"] or 0
+        return totals
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=0)
-    price_sum = models.PositiveIntegerField(default=0)
+    price_sum = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["cart", "product"], name="unique_cart_product"),
+        ]
 
     def save(self, *args, **kwargs):
-        self.price_sum = self.product.price * self.quantity
+        self.price_sum = (self.product.current_price or 0) * self.quantity
         super().save(*args, **kwargs)
 
     def __str__(self) -> str:
@@ -149,6 +251,12 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["customer", "status", "created"], name="order_customer_status_idx"),
+            models.Index(fields=["status", "created"], name="order_status_created_idx"),
+        ]
+
     def __str__(self):
         return f"Order #{self.id} by {self.customer.username}"
     
@@ -158,4 +266,41 @@ class Order(models.Model):
             self.save()
         else:
             self.is_paid = True
-            self.save()
\ No newline at end of file
+            self.save()
+
+
+class BillJob(models.Model):
+    """
+    A bill rendering job (market.billing). Kept in the database so any
+    process can answer for a job another process's worker runs.
+    """
+
+    STATUS_CHOICES = (
+        ("pending", "PENDING"),
+        ("running", "RUNNING"),
+        ("done", "DONE"),
+        ("failed", "FAILED"),
+    )
+    id = models.CharField(max_length=32, primary_key=True)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='bill_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    file = models.CharField(max_length=255, default="", blank=True)
+    changed = models.BooleanField(null=True, blank=True)
+    error = models.TextField(default="", blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Bill job {self.id} for order #{self.order_id}: {self.status}"
+
+
+class CatalogVersion(models.Model):
+    """
+    The catalog's version (market.cache): a single row every process reads,
+    so a change made by one worker or management command retires the
+    cached responses and ETags of all of them. `generation` does the same
+    for every cached product at once.
+    """
+
+    version = models.BigIntegerField()
+    modified = models.DateTimeField()
+    generation = models.BigIntegerField(default=0)
@@ -0,0 +1,31 @@
+"""
+Opaque keyset cursors, shared by the API pagination (api.pagination) and
+the review pages of the product page.
+"""
+import base64
+import binascii
+
+from django.core.exceptions import ValidationError
+
+
+def encode_cursor(value, pk):
+    """Opaque cursor for the row with ordering `value` (may be None) and `pk`."""
+    if value is None:
+        value = ""
+    elif hasattr(value, "isoformat"):
+        value = value.isoformat()
+    raw = f"{value}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(encoded, field):
+    """
+    Return `(value, pk)` of an `encode_cursor()` cursor, the value converted
+    by model `field`. Raises ValueError if the cursor is malformed.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(encoded.encode()).decode()
+        value, pk = raw.rsplit("|", 1)
+        return field.to_python(value or None), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError, ValidationError):
+        raise ValueError("Invalid cursor")
@@ -0,0 +1,135 @@
+"""
+Sale pricing.
+
+A product's sale price is a pure function of its base `price`, its
+`created` date and the sale rules, so it can be computed in Python for a
+single product (`sale_price`) or in SQL for a whole queryset
+(`effective_price_expression`) without ever rewriting the base price.
+"""
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Value, When
+from django.db.models.functions import Round
+from django.db.models.lookups import GreaterThan, IsNull, LessThan
+from django.utils import timezone
+
+CENT = Decimal("0.01")
+
+# (minimum age in days, price factor). The rule with the largest age the
+# product has reached applies.
+DEFAULT_SALE_RULES = ((30, "0.8"),)
+
+
+def get_sale_rules():
+    rules = getattr(settings, "PRODUCT_SALE_RULES", DEFAULT_SALE_RULES)
+    return sorted(((int(age), Decimal(factor)) for age, factor in rules), reverse=True)
+
+
+def sale_cutoff(min_age, now=None):
+    """Products created before this moment are at least `min_age` days old."""
+    today = timezone.localtime(now or timezone.now()).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    return today - timedelta(days=min_age)
+
+
+def sale_price(price, created, now=None, rules=None):
+    """Return `(effective_price, old_price)` for a base price and creation date."""
+    if price is None:
+        return None, None
+    for min_age, factor in rules if rules is not None else get_sale_rules():
+        if created is not None and created < sale_cutoff(min_age, now):
+            return (Decimal(price) * factor).quantize(CENT, ROUND_HALF_UP), price
+    return price, None
+
+
+def effective_price_expression(now=None, rules=None):
+    """SQL equivalent of `sale_price(...)[0]` for use in annotate()/update()."""
+    output_field = DecimalField(max_digits=10, decimal_places=2)
+    whens = [
+        When(
+            created__lt=sale_cutoff(min_age, now),
+            then=Round(F("price") * Value(factor, output_field=output_field), 2),
+        )
+        for min_age, factor in (rules if rules is not None else get_sale_rules())
+    ]
+    return Case(*whens, default=F("price"), output_field=output_field)
+
+
+def old_price_expression(now=None, rules=None):
+    """SQL equivalent of `sale_price(...)[1]`: the base price while on sale."""
+    rules = rules if rules is not None else get_sale_rules()
+    output_field = DecimalField(max_digits=10, decimal_places=2)
+    if not rules:
+        return Value(None, output_field=output_field)
+    # Any rule applies once the youngest rule's age is reached.
+    youngest = min(age for age, _ in rules)
+    return Case(
+        When(created__lt=sale_cutoff(youngest, now), then=F("price")),
+        default=Value(None),
+        output_field=output_field,
+    )
+
+
+def annotate_sale_prices(queryset, now=None):
+    """Compute sale prices at query time instead of reading the stored columns."""
+    return queryset.annotate(
+        sale_price=effective_price_expression(now),
+        sale_old_price=old_price_expression(now),
+    )
+
+
+def _differs(field, expression):
+    # NULL-safe "field IS DISTINCT FROM expression" built from lookups that
+    # every backend supports.
+    return (
+        (Q(**{f"{field}__isnull": True}) & IsNull(expression, False))
+        | (Q(**{f"{field}__isnull": False}) & IsNull(expression, True))
+        | LessThan(F(field), expression)
+        | GreaterThan(F(field), expression)
+    )
+
+
+def stale_prices_filter(now=None, rules=None):
+    """Rows whose stored effective_price/old_price disagree with the rules."""
+    return _differs("effective_price", effective_price_expression(now, rules)) | _differs(
+        "old_price", old_price_expression(now, rules)
+    )
+
+
+def reprice_products(queryset=None, chunk_size=5000, dry_run=False, now=None, rules=None):
+    """
+    Bring stored sale prices in line with the rules, one primary key range at a time.
+
+    Every chunk is a single set-based UPDATE (or COUNT with `dry_run`) in its
+    own transaction, so locks are short and no row is loaded into Python.
+    Yields a dict per chunk with the number of rows scanned and changed and,
+    for dry runs, how many would go on or come off sale.
+    """
+    from .models import Product
+    from .utils import iter_pk_chunks
+
+    queryset = Product.objects.all() if queryset is None else queryset
+    now = now or timezone.now()
+    rules = rules if rules is not None else get_sale_rules()
+    stale = stale_prices_filter(now, rules)
+    new_old_price = old_price_expression(now, rules)
+    for chunk in iter_pk_chunks(queryset, chunk_size):
+        changed = chunk.filter(stale)
+        if dry_run:
+            yield {
+                "scanned": chunk.count(),
+                "changed": changed.count(),
+                "on_sale": changed.filter(IsNull(new_old_price, False), old_price__isnull=True).count(),
+                "off_sale": changed.filter(IsNull(new_old_price, True), old_price__isnull=False).count(),
+            }
+            continue
+        with transaction.atomic():
+            updated = changed.update(
+                effective_price=effective_price_expression(now, rules),
+                old_price=new_old_price,
+            )
+        yield {"scanned": chunk.count(), "changed": updated}
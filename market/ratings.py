@@ -0,0 +1,82 @@
+"""
+Denormalized product ratings.
+
+Every product stores the number of rated reviews, their sum, the average
+and a counter per star, so listings and product pages show ratings without
+reading the review table. Review signals keep the columns current with
+relative `F()` updates (`apply_rating`); `recompute_ratings` rebuilds them
+from the reviews in set-based UPDATEs.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+from django.db.models.lookups import GreaterThan
+
+STARS = (1, 2, 3, 4, 5)
+
+STAR_FIELDS = tuple(f"rating_{star}" for star in STARS)
+
+RATING_FIELDS = ("rating_count", "rating_sum", "rating_avg") + STAR_FIELDS
+
+
+def average_expression(rating_sum, rating_count):
+    """`rating_sum / rating_count` to two decimals, NULL while there are no ratings."""
+    output_field = DecimalField(max_digits=3, decimal_places=2)
+    return Case(
+        When(
+            GreaterThan(rating_count, 0),
+            then=Cast(Round(Cast(rating_sum, FloatField()) / rating_count, 2), output_field),
+        ),
+        default=Value(None),
+        output_field=output_field,
+    )
+
+
+def apply_rating(product_id, rating, delta):
+    """Add (`delta=1`) or remove (`delta=-1`) one rating in a single UPDATE."""
+    from .models import Product
+
+    if product_id is None or rating not in STARS:
+        return
+    star = f"rating_{rating}"
+    Product.objects.filter(pk=product_id).update(
+        rating_count=F("rating_count") + delta,
+        rating_sum=F("rating_sum") + delta * rating,
+        rating_avg=average_expression(F("rating_sum") + delta * rating, F("rating_count") + delta),
+        **{star: F(star) + delta},
+    )
+
+
+def recompute_ratings(queryset=None, chunk_size=5000, review_model=None):
+    """
+    Rebuild the rating columns of `queryset` (all products by default) from
+    the reviews, one primary key range per transaction. Returns the number
+    of products updated.
+    """
+    from .models import Product, ProductReview
+    from .utils import iter_pk_chunks
+
+    queryset = Product.objects.all() if queryset is None else queryset
+    review_model = review_model or ProductReview
+    ratings = (
+        review_model.objects.filter(product=OuterRef("pk"), rating__in=STARS)
+        .order_by()
+        .values("product")
+    )
+
+    def aggregate(expression):
+        return Coalesce(Subquery(ratings.annotate(value=expression).values("value")), 0)
+
+    updated = 0
+    for chunk in iter_pk_chunks(queryset, chunk_size):
+        with transaction.atomic():
+            updated += chunk.update(
+                rating_count=aggregate(Count("pk")),
+                rating_sum=aggregate(Sum("rating")),
+                **{
+                    f"rating_{star}": aggregate(Count("pk", filter=Q(rating=star)))
+                    for star in STARS
+                },
+            )
+            chunk.update(rating_avg=average_expression(F("rating_sum"), F("rating_count")))
+    return updated
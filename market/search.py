@@ -0,0 +1,231 @@
+"""
+Full-text product search.
+
+Product name, short description and description (HTML stripped) are
+indexed in a side table kept in sync by the Product signals:
+
+* SQLite: an FTS5 virtual table, ranked with bm25.
+* PostgreSQL: a weighted tsvector column with a GIN index, ranked with
+  ts_rank.
+
+Other databases fall back to unranked `icontains` filtering. Every search
+term is matched as a prefix, so "dumb" finds "dumbbell".
+"""
+import re
+
+from django.db import connection, connections, transaction
+from django.db.models import F, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+
+SEARCH_TABLE = "market_product_search"
+
+# Product fields whose change requires reindexing.
+TEXT_FIELDS = {"name", "short_description", "description"}
+
+# Relative weight of a hit in name / short description / description.
+WEIGHTS = (10.0, 5.0, 1.0)
+
+MAX_TERMS = 10
+
+_TERM = re.compile(r"\w+", re.UNICODE)
+
+
+def search_terms(query):
+    """Split user input into plain word terms; anything else is ignored."""
+    return _TERM.findall(query or "")[:MAX_TERMS]
+
+
+def document(product):
+    """The (name, short description, description) text indexed for a product."""
+    return (
+        product.name or "",
+        product.short_description or "",
+        strip_tags(product.description or ""),
+    )
+
+
+class SQLiteBackend:
+    create_sql = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+        "name, short_description, description, "
+        # Prefix indexes make 2 and 3 character prefix queries index lookups.
+        "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    ]
+    drop_sql = [f"DROP TABLE IF EXISTS {SEARCH_TABLE}"]
+
+    def match(self, terms):
+        return " ".join(f'"{term}"*' for term in terms)
+
+    def filter(self, queryset, terms):
+        table = queryset.model._meta.db_table
+        match = self.match(terms)
+        weights = ", ".join(str(weight) for weight in WEIGHTS)
+        # bm25() is lower for better matches; negate it so higher is better
+        # on every backend. The ranked matches are computed once per query
+        # and each row looks its rank up in them: a MATCH correlated with the
+        # row would rerun the full-text query for every candidate (seconds
+        # instead of milliseconds on 20k products), and so does a plain CTE,
+        # which SQLite flattens into the lookup.
+        ranked = (
+            f"SELECT rowid AS product_id, -bm25({SEARCH_TABLE}, {weights}) AS rank "
+            f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s"
+        )
+        lookup = f'WHERE product_id = "{table}"."id"'
+        if connections[queryset.db].Database.sqlite_version_info >= (3, 35):
+            rank = f"WITH ranked AS MATERIALIZED ({ranked}) SELECT rank FROM ranked {lookup}"
+        else:
+            # No MATERIALIZED before SQLite 3.35. A subquery with a LIMIT is
+            # never flattened into an outer query with a WHERE clause, so
+            # LIMIT -1 (no limit) keeps it computed once as well.
+            rank = f"SELECT rank FROM ({ranked} LIMIT -1) {lookup}"
+        rank = RawSQL(rank, [match])
+        matches = RawSQL(f"SELECT rowid FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s", [match])
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+    def index(self, cursor, rows):
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [(pk,) for pk, *_ in rows])
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, name, short_description, description) "
+            "VALUES (%s, %s, %s, %s)",
+            rows,
+        )
+
+    def remove(self, cursor, pk):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [pk])
+
+    def clear(self, cursor):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+
+class PostgreSQLBackend:
+    config = "english"
+    create_sql = [
+        f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+        "product_id bigint PRIMARY KEY REFERENCES market_product (id) ON DELETE CASCADE "
+        "DEFERRABLE INITIALLY DEFERRED, "
+        "document tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx ON {SEARCH_TABLE} USING GIN (document)",
+    ]
+    drop_sql = [f"DROP TABLE IF EXISTS {SEARCH_TABLE}"]
+
+    def match(self, terms):
+        return " & ".join(f"{term}:*" for term in terms)
+
+    def filter(self, queryset, terms):
+        table = queryset.model._meta.db_table
+        query = f"to_tsquery('{self.config}', %s)"
+        # ts_rank weights are ordered {D, C, B, A}.
+        weights = "{0.1, %s, %s, %s}" % tuple(weight / WEIGHTS[0] for weight in reversed(WEIGHTS))
+        # The GIN index matches once, in the pk__in subquery; the rank is a
+        # primary key probe per matched row with no tsquery match of its own
+        # (a CTE would be scanned, not probed, by a correlated subquery here).
+        rank = RawSQL(
+            f"SELECT ts_rank('{weights}', document, {query}) FROM {SEARCH_TABLE} "
+            f'WHERE product_id = "{table}"."id"',
+            [self.match(terms)],
+        )
+        matches = RawSQL(
+            f"SELECT product_id FROM {SEARCH_TABLE} WHERE document @@ {query}", [self.match(terms)]
+        )
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank)
+
+    def index(self, cursor, rows):
+        vector = " || ".join(
+            f"setweight(to_tsvector('{self.config}', %s), '{weight}')" for weight in "ABC"
+        )
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (product_id, document) VALUES (%s, {vector}) "
+            "ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document",
+            rows,
+        )
+
+    def remove(self, cursor, pk):
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE product_id = %s", [pk])
+
+    def clear(self, cursor):
+        cursor.execute(f"TRUNCATE {SEARCH_TABLE}")
+
+
+BACKENDS = {"sqlite": SQLiteBackend, "postgresql": PostgreSQLBackend}
+
+
+def get_backend(vendor=None):
+    backend = BACKENDS.get(vendor or connection.vendor)
+    return backend() if backend else None
+
+
+def search_products(queryset, query):
+    """
+    Filter `queryset` to the products matching `query`, annotated with a
+    `search_rank` (higher is better) and ordered by it.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return queryset.none()
+    backend = get_backend()
+    if backend is None:
+        condition = Q()
+        for term in terms:
+            condition &= (
+                Q(name__icontains=term)
+                | Q(short_description__icontains=term)
+                | Q(description__icontains=term)
+            )
+        return queryset.filter(condition).annotate(search_rank=Value(0.0)).order_by("-created", "-id")
+    return backend.filter(queryset, terms).order_by(F("search_rank").desc(nulls_last=True), "-id")
+
+
+def index_products(products):
+    """(Re)index the given Product instances."""
+    backend = get_backend()
+    if backend is None:
+        return
+    rows = [(product.pk, *document(product)) for product in products]
+    if rows:
+        with connection.cursor() as cursor:
+            backend.index(cursor, rows)
+
+
+def remove_product(pk):
+    backend = get_backend()
+    if backend is None or pk is None:
+        return
+    with connection.cursor() as cursor:
+        backend.remove(cursor, pk)
+
+
+def rebuild_index(queryset=None, chunk_size=2000):
+    """Reindex every product of `queryset` (all by default). Returns the count."""
+    from .models import Product
+    from .utils import iter_pk_chunks
+
+    backend = get_backend()
+    if backend is None:
+        return 0
+    queryset = Product.objects.all() if queryset is None else queryset
+    indexed = 0
+    fields = ("pk", "name", "short_description", "description")
+    # One transaction, so searches never see a half-built index.
+    with transaction.atomic(), connection.cursor() as cursor:
+        backend.clear(cursor)
+        for chunk in iter_pk_chunks(queryset, chunk_size):
+            rows = [
+                (pk, name or "", short or "", strip_tags(description or ""))
+                for pk, name, short, description in chunk.values_list(*fields)
+            ]
+            backend.index(cursor, rows)
+            indexed += len(rows)
+    return indexed
+
+
+def create_index(schema_editor):
+    backend = get_backend(schema_editor.connection.vendor)
+    for sql in backend.create_sql if backend else []:
+        schema_editor.execute(sql)
+
+
+def drop_index(schema_editor):
+    backend = get_backend(schema_editor.connection.vendor)
+    for sql in backend.drop_sql if backend else []:
+        schema_editor.execute(sql)
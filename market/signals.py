@@ -0,0 +1,169 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from .cache import bump_catalog_version, invalidate_all_products, invalidate_product
+from .categories import (
+    CategoryTreeError,
+    ancestor_paths,
+    apply_product_count,
+    build_path,
+    move_subtree,
+    recount_categories,
+)
+from .images import is_default, is_fresh, submit_image_job
+from .models import Category, Product, ProductImages, ProductInfo, ProductReview
+from .ratings import apply_rating
+from .search import TEXT_FIELDS, index_products, remove_product
+
+
+# The rating receivers are connected before the cache invalidation below, so
+# a product is never re-cached between invalidation and the rating update.
+@receiver(post_init, sender=ProductReview)
+def remember_review_rating(sender, instance, **kwargs):
+    # What the rating aggregates currently count for this review, so edits
+    # and deletes can take exactly that back out.
+    instance._counted_rating = (instance.product_id, instance.rating) if instance.pk else (None, None)
+
+
+@receiver(post_save, sender=ProductReview)
+def update_product_rating(sender, instance, created, **kwargs):
+    current = (instance.product_id, instance.rating)
+    counted = (None, None) if created else instance._counted_rating
+    if current != counted:
+        apply_rating(*counted, delta=-1)
+        apply_rating(*current, delta=1)
+        instance._counted_rating = current
+        bump_catalog_version()
+
+
+@receiver(post_delete, sender=ProductReview)
+def remove_product_rating(sender, instance, **kwargs):
+    if instance._counted_rating[1] is not None:
+        apply_rating(*instance._counted_rating, delta=-1)
+        bump_catalog_version()
+    instance._counted_rating = (None, None)
+
+
+@receiver(pre_save, sender=Category)
+def set_category_path(sender, instance, **kwargs):
+    parent_path = None
+    if instance.parent_id is not None:
+        parent_path = sender.objects.filter(pk=instance.parent_id).values_list("path", flat=True).first()
+    path = build_path(parent_path, instance.cid)
+    if instance.path and instance.path != path and path.startswith(instance.path):
+        raise CategoryTreeError("A category cannot be moved below itself.")
+    # The path this row had, for moving its descendants after the save.
+    instance._moved_from = instance.path if instance.path and instance.path != path else None
+    instance.path = path
+
+
+@receiver(post_save, sender=Category)
+def move_category_subtree(sender, instance, **kwargs):
+    if instance._moved_from:
+        move_subtree(instance._moved_from, instance.path)
+        instance._moved_from = None
+
+
+@receiver(post_delete, sender=Category)
+def recount_category_ancestors(sender, instance, **kwargs):
+    # Deleted subtrees take their product counts with them; products were
+    # detached (SET_NULL) before the delete.
+    recount_categories(sender.objects.filter(path__in=ancestor_paths(instance.path)))
+
+
+# Stands for the category of a product loaded without its category_id column.
+_UNKNOWN = object()
+
+
+@receiver(post_init, sender=Product)
+def remember_product_category(sender, instance, **kwargs):
+    # The category whose counts include this product. Read from __dict__:
+    # a deferred column must not cost a query per instance.
+    if not instance.pk:
+        instance._counted_category = None
+    else:
+        instance._counted_category = instance.__dict__.get("category_id", _UNKNOWN)
+
+
+@receiver(post_save, sender=Product)
+def update_category_counts(sender, instance, created, **kwargs):
+    counted = None if created else instance._counted_category
+    if counted is _UNKNOWN:
+        if "category_id" in instance.__dict__:
+            # Assigned after a deferred load: the previous category is unknown.
+            recount_categories()
+            instance._counted_category = instance.category_id
+        return
+    if instance.category_id != counted:
+        apply_product_count(counted, -1)
+        apply_product_count(instance.category_id, 1)
+        instance._counted_category = instance.category_id
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_category_counts(sender, instance, **kwargs):
+    if instance._counted_category is _UNKNOWN:
+        recount_categories()
+    else:
+        apply_product_count(instance._counted_category, -1)
+    instance._counted_category = None
+
+
+@receiver(post_save, sender=Product)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or TEXT_FIELDS & set(update_fields):
+        index_products([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_from_search_index(sender, instance, **kwargs):
+    remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImages)
+def queue_image_variants(sender, instance, **kwargs):
+    image_field = "image" if sender is Product else "images"
+    image_name = getattr(instance, image_field).name
+    if (
+        image_name
+        and not is_default(sender, image_field, image_name)
+        and not is_fresh(image_name, instance.image_variants)
+    ):
+        # After commit, so the worker reads the saved row.
+        transaction.on_commit(lambda: submit_image_job(sender, instance.pk, image_field))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    invalidate_product(instance.pk)
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=ProductImages)
+@receiver(post_delete, sender=ProductImages)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_related_product_cache(sender, instance, **kwargs):
+    invalidate_product(instance.product_id)
+
+
+@receiver(post_save, sender=ProductInfo)
+@receiver(post_delete, sender=ProductInfo)
+def invalidate_product_info_cache(sender, instance, **kwargs):
+    # The info facet counts, the info= filter and their ETags are keyed on
+    # the catalog version.
+    invalidate_product(instance.product_id)
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_products_cache(sender, instance, **kwargs):
+    # Product payloads embed the category name; categories change rarely
+    # enough that dropping every cached product is cheaper than tracking them.
+    invalidate_all_products()
+    bump_catalog_version()
+
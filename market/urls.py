@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path("", views.MainPageView.as_view(), name="main"),
     path("product/<str:pk>", views.ProductView.as_view(), name="product-view"),
+    path("product/<int:pk>/reviews/", views.ProductReviewsView.as_view(), name="product-reviews"),
     path("order/<str:pk>", views.CreateUserOrderView.as_view(), name="user-order"),
     path("orders/", views.GetOrdersView.as_view(), name="showorders"),
     path("checkout/<int:pk>", views.MarkOrderItemAsPaidView.as_view(), name="checkout"),
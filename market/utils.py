@@ -1,4 +1,35 @@
-from django.db.models import Q
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.db.models import F, Q
+from .models import CartItem, OrderItem, ProductReview
+from .pagination import decode_cursor, encode_cursor
+
+
+def iter_pk_chunks(queryset, chunk_size):
+    """
+    Split `queryset` into consecutive primary key ranges of at most
+    `chunk_size` rows, for set-based UPDATEs over large tables.
+
+    Each range's upper bound is read from the primary key index, so gaps in
+    the ids cannot produce empty or oversized chunks.
+    """
+    last_pk = None
+    while True:
+        remaining = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        bounds = list(
+            remaining.order_by("pk").values_list("pk", flat=True)[chunk_size - 1 : chunk_size]
+        )
+        if not bounds:
+            if remaining.exists():
+                yield remaining
+            return
+        yield remaining.filter(pk__lte=bounds[0])
+        last_pk = bounds[0]
 
 
 def get_choices(request, order):
@@ -42,3 +73,189 @@ def filter_orders(request, queryset):
     # Order the queryset
     orders = orders.order_by("created", "status")
     return orders
+
+
+def get_review_page(product_id, cursor=None, page_size=None):
+    """
+    Return `(reviews, next_cursor)`: one page of a product's reviews, newest
+    first, with their authors.
+
+    Pages are keyset-paginated on (date, id) through the review index, so
+    the cost of a page does not depend on how many reviews the product has
+    or how far the reader has scrolled.
+    """
+    page_size = page_size or getattr(settings, "REVIEWS_PAGE_SIZE", 20)
+    reviews = (
+        ProductReview.objects.filter(product_id=product_id)
+        .select_related("user")
+        .order_by("-date", "-id")
+    )
+    if cursor:
+        # The API's keyset cursor format, on the review date.
+        date, pk = decode_cursor(cursor, ProductReview._meta.get_field("date"))
+        if date is None:
+            raise ValueError("Invalid cursor")
+        reviews = reviews.filter(Q(date__lt=date) | Q(date=date, id__lt=pk))
+    # Fetch one extra row to know whether there is a next page.
+    reviews = list(reviews[: page_size + 1])
+    if len(reviews) > page_size:
+        reviews = reviews[:page_size]
+        return reviews, encode_cursor(reviews[-1].date, reviews[-1].pk)
+    return reviews, None
+
+
+def add_to_cart(cart, product, quantity):
+    """
+    Atomically add `quantity` units of `product` to `cart`.
+
+    The common case is a single UPDATE that increments the quantity in SQL,
+    so concurrent requests never lose increments. If the product is not in
+    the cart yet the row is inserted; the unique (cart, product) constraint
+    turns a concurrent insert into an IntegrityError, after which the
+    increment is applied to the row the other request created.
+    """
+    price = product.current_price or 0
+    items = CartItem.objects.filter(cart=cart, product=product)
+    increment = {
+        "quantity": F("quantity") + quantity,
+        "price_sum": (F("quantity") + quantity) * price,
+    }
+    if items.update(**increment):
+        return
+
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+    except IntegrityError:
+        items.update(**increment)
+
+
+@transaction.atomic
+def create_order_from_cart(cart, order):
+    """
+    Turn the contents of `cart` into `order` and empty the cart.
+
+    `order` is an unsaved Order with the customer and delivery details
+    filled in. Returns the saved order, or None if the cart is empty. The
+    number of queries does not depend on the number of cart lines: one
+    select for the lines with their products, one insert for the order,
+    bulk inserts for the order items and one delete for the cart lines.
+
+    The lines are locked as they are read (SELECT ... FOR UPDATE where the
+    database supports it) and only those lines are deleted, so a concurrent
+    add_to_cart either waits for the order and starts a new line or adds a
+    line that stays in the cart; it is never deleted without being ordered.
+    """
+    if cart is None:
+        return None
+    lines = cart.items.select_related("product").select_for_update(
+        of=("self",) if connection.features.has_select_for_update_of else ()
+    )
+    cart_items = list(lines)
+    if not cart_items:
+        return None
+
+    order_items = []
+    total_price = 0
+    for cart_item in cart_items:
+        price = (cart_item.product.current_price or 0) * cart_item.quantity
+        total_price += price
+        order_items.append(
+            OrderItem(product=cart_item.product, quantity=cart_item.quantity, price=price)
+        )
+
+    order.total_price = total_price
+    order.save()
+    for order_item in order_items:
+        order_item.order_of_item = order
+    OrderItem.objects.bulk_create(order_items)
+
+    CartItem.objects.filter(pk__in=[cart_item.pk for cart_item in cart_items]).delete()
+    return order
+
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def parse_range_header(header, size):
+    """
+    Parse a single-range `Range` header against a file of `size` bytes.
+
+    Returns `(start, end)` (inclusive), None when the header is absent or
+    not something we handle (the full file is sent), or False when the range
+    cannot be satisfied.
+    """
+    match = RANGE_RE.match(header or "")
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes.
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(file, start, length, chunk_size=FileResponse.block_size):
+    with file:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def file_download_response(request, field_file):
+    """
+    Stream `field_file` as an attachment without loading it into memory.
+
+    With SENDFILE_BACKEND set to "x-accel-redirect" (nginx) or "x-sendfile"
+    (Apache/lighttpd) the body is left to the web server. Otherwise the file
+    is streamed from storage, honouring single byte-range requests.
+    """
+    name = os.path.basename(field_file.name)
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    disposition = f'attachment; filename="{name}"'
+
+    backend = getattr(settings, "SENDFILE_BACKEND", None)
+    if backend == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = settings.SENDFILE_URL_PREFIX + field_file.name
+        response["Content-Disposition"] = disposition
+        return response
+    if backend == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = field_file.path
+        response["Content-Disposition"] = disposition
+        return response
+
+    size = field_file.size
+    byte_range = parse_range_header(request.META.get("HTTP_RANGE"), size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response["Content-Range"] = f"bytes */{size}"
+        return response
+
+    file = field_file.open("rb")
+    if byte_range is None:
+        response = FileResponse(file, as_attachment=True, filename=name, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_range(file, start, end - start + 1), status=206, content_type=content_type
+        )
+        response["Content-Length"] = str(end - start + 1)
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Disposition"] = disposition
+    response["Accept-Ranges"] = "bytes"
+    return response
@@ -1,77 +1,154 @@
+import hashlib
+
+from django.conf import settings
 from django.shortcuts import render, get_object_or_404, redirect
-from django.contrib.auth.mixins import LoginRequiredMixin
 from django.template.loader import render_to_string
+from django.urls import reverse
+from urllib.parse import urlencode
+from django.contrib.auth.mixins import LoginRequiredMixin
 from django.http import JsonResponse
 import json
-from django.core.files.base import ContentFile
 from django.views import View
-from django.http import HttpResponse
-from .models import Product, OrderItem, Cart, CartItem, ProductReview, Order, Category
+from django.http import HttpResponse, Http404
+from django.utils.functional import SimpleLazyObject
+from django.utils.safestring import mark_safe
+from .models import Product, Cart, CartItem, Order
 from .forms import OrderCreatForm, ReviewCreatForm
-from .utils import get_choices, filter_orders
-import mimetypes
-from django.db import transaction
+from .utils import get_choices, filter_orders, add_to_cart, create_order_from_cart, file_download_response, get_review_page
+from .cache import get_cached_product, get_cached_products, get_catalog_version, get_product_cache
+from .categories import category_tree, in_categories
+from .search import search_products
+from .billing import submit_bill_job
+from django.db.models import F, Prefetch
+
+
+# Main page sort options, each backed by an index on the product table
+PRODUCT_SORTS = {
+    'price': ('effective_price', 'id'),
+    '-price': ('-effective_price', '-id'),
+    '-rating': (F('rating_avg').desc(nulls_last=True), '-id'),
+}
+
+
+def render_product_cards(pks, show_buy):
+    """
+    The product cards of the main page, in the order of `pks`. Each card is
+    cached under its product's version, so only changed products are loaded
+    and rendered again.
+    """
+    def build(missing):
+        products = Product.objects.in_bulk(missing)
+        return {
+            pk: render_to_string('market/product_card.html', {'product': product, 'show_buy': show_buy})
+            for pk, product in products.items()
+        }
+
+    cards = get_cached_products(pks, 'card-buy' if show_buy else 'card', build)
+    return mark_safe(''.join(cards[pk] for pk in pks if pk in cards))
+
+
+def main_page_cache_key(version, category_id, query, sort):
+    # Every product or category change bumps the catalog version, which
+    # retires all the cached pages at once.
+    params = urlencode({'category': category_id or '', 'q': query, 'sort': sort or ''})
+    return f"main-page:{version}:{hashlib.md5(params.encode()).hexdigest()}"
 
 
 # Class based view to display the main page
 class MainPageView(View):
     def get(self, request):
-        # Fetch all categories from the database
-        categories = Category.objects.all()
+        category_id = request.GET.get('category')
+        if category_id and not category_id.isdigit():
+            category_id = None
+        query = request.GET.get('q', '').strip()
+        sort = request.GET.get('sort')
+        if sort not in PRODUCT_SORTS:
+            sort = None
+
+        # Anonymous visitors all see the same page: serve it whole from the cache
+        cache = get_product_cache()
+        catalog_version, _ = get_catalog_version()
+        page_key = None
+        if not request.user.is_authenticated:
+            page_key = main_page_cache_key(catalog_version, category_id, query, sort)
+            content = cache.get(page_key)
+            if content is not None:
+                return HttpResponse(content)
+
+        # The category tree, read only when the cached category bar is out of date
+        categories = SimpleLazyObject(category_tree)
 
         # Initialize the products queryset
         products = Product.objects.all()
 
         # Check if a category filter is applied
-        category_id = request.GET.get('category')
         if category_id:
-            # Filter products based on the selected category
-            products = products.filter(category_id=category_id)
+            # Filter products in the selected category and its subcategories
+            products = products.filter(in_categories([category_id]))
+
+        # Full-text search, best matches first
+        if query:
+            products = search_products(products, query)
+
+        # Sort by the precomputed price/rating columns
+        if sort:
+            products = products.order_by(*PRODUCT_SORTS[sort])
+
+        # Only the ids are read here; the cards come from the cache
+        pks = list(products.values_list('pk', flat=True))
+        cards = render_product_cards(pks, getattr(request.user, 'role', None) == 'USER')
 
         # Define context variables that are passed to the template
-        context = {"products": products, "categories": categories}
+        context = {
+            "cards": cards,
+            "categories": categories,
+            "catalog_version": catalog_version,
+            "cache_alias": settings.PRODUCT_CACHE_ALIAS,
+            "cache_timeout": settings.PRODUCT_CACHE_TIMEOUT,
+            "sort": sort,
+            "query": query,
+        }
 
         # Render the 'main.html' template, passing in the context
-        return render(request, "market/main.html", context)
+        response = render(request, "market/main.html", context)
+        if page_key is not None:
+            cache.set(page_key, response.content, settings.MAIN_PAGE_CACHE_TIMEOUT)
+        return response
+
+
+def get_cart_with_items(user):
+    # The cart page lists every line with its product; load them in two queries.
+    return Cart.objects.prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.select_related('product__category'))
+    ).get_or_create(user=user)
 
 
 class CartView(View):
     def get(self, request):
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        total_price = sum([item.quantity * item.product.price for item in cart.items.all()])
+        cart, created = get_cart_with_items(request.user)
+        total_price = cart.get_totals()['total_price']
         form = OrderCreatForm()
         return render(request, 'market/cart.html', {'cart': cart, 'total_price': total_price, 'form': form})
 
-    @transaction.atomic
     def post(self, request):
         cart, created = Cart.objects.get_or_create(user=request.user)
-        total_price = sum([item.quantity * item.product.price for item in cart.items.all()])
         form = OrderCreatForm(request.POST)
         if form.is_valid():
-            with transaction.atomic():
-                order = form.save(commit=False)
-                order.customer = request.user
-                order.total_price = total_price
-                order.save()
-                for cart_item in cart.items.all():
-                    order_item = OrderItem.objects.create(
-                        order_of_item=order,
-                        product=cart_item.product,
-                        quantity=cart_item.quantity,
-                        price=cart_item.price_sum
-                    )
-                cart.items.all().delete()
-            return redirect('showorders')
+            order = form.save(commit=False)
+            order.customer = request.user
+            if create_order_from_cart(cart, order):
+                return redirect('showorders')
+            form.add_error(None, 'Cannot create an order from an empty cart')
+        cart, created = get_cart_with_items(request.user)
+        total_price = cart.get_totals()['total_price']
         return render(request, 'market/cart.html', {'cart': cart, 'total_price': total_price, 'form': form})
 
 
 class AddToCartView(View):
     def get(self, request, pk):
-        product = get_object_or_404(Product, id=pk)
+        product = get_object_or_404(Product.objects.only('price', 'effective_price'), id=pk)
         cart, created = Cart.objects.get_or_create(user=request.user)
-        cart_item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-        cart_item.quantity += int(request.GET['quantity'])
-        cart_item.save()
+        add_to_cart(cart, product, int(request.GET['quantity']))
         return redirect('cart')
 
 
@@ -81,16 +158,11 @@ class UpdateCartItemView(View):
         item_id = data.get('item_id')
         new_quantity = data.get('quantity')
         try:
-            cart_item = CartItem.objects.get(id=item_id)
+            cart_item = CartItem.objects.select_related('product', 'cart').get(id=item_id)
             cart_item.quantity = new_quantity
-            cart_item.price_sum = cart_item.quantity * cart_item.product.price
-            cart_item.save()
-            cart = cart_item.cart
-            for item in cart.items.all():
-                item.price_sum = item.product.price * item.quantity
-                item.save()
-            total_price = sum([item.price_sum for item in cart.items.all()])
-            return JsonResponse({'success': True, 'total_price': total_price})
+            cart_item.save(update_fields=['quantity', 'price_sum'])
+            totals = cart_item.cart.get_totals()
+            return JsonResponse({'success': True, **totals})
         except CartItem.DoesNotExist:
             return JsonResponse({'success': False, 'error': 'Cart item not found'})
         except Exception as e:
@@ -104,14 +176,49 @@ class RemoveFromCartView(View):
         return redirect('cart')
 
 
+def get_product_page_data(pk):
+    # The URL captures pk as a string; normalise it so "012" and "12" share
+    # one cache entry and invalidation reaches both.
+    try:
+        pk = int(pk)
+    except ValueError:
+        raise Http404('Product not found')
+
+    def build():
+        product = get_object_or_404(
+            Product.objects.select_related('category').prefetch_related('product_info', 'p_images'),
+            id=pk,
+        )
+        # Only the first page of reviews is rendered with the page; the rest
+        # is loaded on scroll from ProductReviewsView.
+        reviews, reviews_cursor = get_review_page(product.pk)
+        return {'product': product, 'reviews': reviews, 'reviews_next': review_page_url(pk, reviews_cursor)}
+
+    return get_cached_product(pk, 'page', build)
+
+
+def review_page_url(pk, cursor):
+    if cursor is None:
+        return None
+    return f"{reverse('product-reviews', args=[pk])}?{urlencode({'cursor': cursor})}"
+
+
+class ProductReviewsView(View):
+    # Infinite scroll: the next page of reviews as an HTML fragment
+    def get(self, request, pk):
+        try:
+            reviews, cursor = get_review_page(pk, request.GET.get('cursor'))
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        html = render_to_string('market/review_list.html', {'reviews': reviews}, request=request)
+        return JsonResponse({'html': html, 'next': review_page_url(pk, cursor)})
+
+
 class ProductView(View):
     def get(self, request, pk):
-        product = get_object_or_404(Product, id=pk)
-        reviews = ProductReview.objects.filter(product=product)
         form = ReviewCreatForm()
         context = {
-            'product': product,
-            'reviews': reviews,
+            **get_product_page_data(pk),
             'form': form
         }
         return render(request, 'market/product_page.html', context)
@@ -124,10 +231,8 @@ class ProductView(View):
             review.product = product
             review.user = request.user
             review.save()
-        reviews = ProductReview.objects.filter(product=product)
         context = {
-            'product': product,
-            'reviews': reviews,
+            **get_product_page_data(pk),
             'form': form
         }
         return render(request, 'market/product_page.html', context)
@@ -250,22 +355,13 @@ class ChangeOrderStatusView(LoginRequiredMixin, View):
 
 # Class based view to generate a payment HTML file. It also uses the LoginRequiredMixin.
 class GeneratePaymentHtmlView(LoginRequiredMixin, View):
-    # Function to handle HTTP GET requests. It generates a payment HTML file and redirects to the orders page.
+    # Function to handle HTTP GET requests. It queues generation of the payment HTML file and redirects to the orders page.
     def get(self, request, pk):
-        # Fetch the OrderItem with the provided primary key (pk)
-        order_item = Order.objects.get(id=pk)
-
-        # The filename for the payment HTML file
-        file_name = "payment.html"
-
-        # Define context variables that are passed to the template.
-        context = {"order_item": order_item}
-
-        # Render the payment template as a string
-        html_content = render_to_string("market/payment_template.html", context)
+        # Make sure the order exists before queueing the job
+        order_item = get_object_or_404(Order, id=pk)
 
-        # Save the generated HTML content as a file in the order item
-        order_item.file.save(file_name, ContentFile(html_content), save=True)
+        # Render the bill in the worker pool; an unchanged order keeps its existing file
+        submit_bill_job(order_item.id)
 
         # Redirect to the 'showorders' page.
         return redirect("showorders")
@@ -275,22 +371,12 @@ class GeneratePaymentHtmlView(LoginRequiredMixin, View):
 class DownloadFileView(LoginRequiredMixin, View):
     # Function to handle HTTP GET requests. It returns the requested file for download.
     def get(self, request, pk):
-        # Fetch the OrderItem with the provided primary key (pk)
-        order_item = Order.objects.get(id=pk)
-
-        # Get the file extension of the order item's file
-        file_extension = order_item.file.name.split(".")[-1]
-
-        # Guess the content type of the file based on its extension
-        content_type, _ = mimetypes.guess_type(file_extension)
-
-        # Create a HttpResponse with the order item's file and the guessed content type
-        response = HttpResponse(order_item.file, content_type=content_type)
+        # Fetch the OrderItem with the provided primary key (pk) or return 404 if it doesn't exist
+        order_item = get_object_or_404(Order, id=pk)
 
-        # Set the 'Content-Disposition' header to suggest a filename to the browser
-        response[
-            "Content-Disposition"
-        ] = f'attachment; filename="{order_item.file.name}"'
+        # Nothing to download until a bill has been generated
+        if not order_item.file:
+            raise Http404("No file for this order")
 
-        # Return the response
-        return response
+        # Stream the file (or hand it to the web server) instead of reading it into memory
+        return file_download_response(request, order_item.file)
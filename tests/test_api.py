@@ -1,11 +1,33 @@
 # test_api.py
 
+import json
+import tempfile
+from io import StringIO
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
 from django.urls import reverse
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import QuerySet
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APIClient
-from market.models import Product, OrderItem
+from rest_framework_simplejwt.tokens import RefreshToken
+from market.models import BillJob, Product, OrderItem, Order, Category, Cart, CartItem, ProductInfo, ProductReview
+from market.utils import add_to_cart
+from api.renderers import FastJSONRenderer
+from api.rows import RowSerializer, UnsupportedField
+from api.serializers import CategoryTreeSerializer, OrderSerializer, ProductListSerializer
+from api.utils import with_order_details
+from FitGear.instrumentation import reset as reset_request_metrics
 
 User = get_user_model()
 
@@ -21,13 +43,12 @@ class ChangeOrderStatusAPIViewTest(TestCase):
         # Create a product object
         product = Product.objects.create(name="Product", price=9.99)
 
-        # Create an order item with a valid product
-        order = OrderItem.objects.create(
-            customer=self.user, product=product, status="Undecided"
-        )
+        # Create an order with an item for a valid product
+        order = Order.objects.create(customer=self.user, status="Undecided")
+        OrderItem.objects.create(order_of_item=order, product=product, quantity=1, price=product.price)
 
     def test_change_order_status(self):
-        order_item = OrderItem.objects.first()
+        order_item = Order.objects.first()
         url = reverse("change_order_status", args=[order_item.id])
         data = {"status": "Paid"}
         response = self.client.patch(url, data)
@@ -45,13 +66,12 @@ class OrderAPIViewTest(TestCase):
         # Create a product object
         product = Product.objects.create(name="Product", price=9.99)
 
-        # Create an order item with a valid product
-        order = OrderItem.objects.create(
-            customer=self.user, product=product, status="Undecided"
-        )
+        # Create an order with an item for a valid product
+        order = Order.objects.create(customer=self.user, status="Undecided")
+        OrderItem.objects.create(order_of_item=order, product=product, quantity=1, price=product.price)
 
     def test_get_order(self):
-        order_item = OrderItem.objects.first()
+        order_item = Order.objects.first()
         url = reverse("order", args=[order_item.id])
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -69,10 +89,9 @@ class OrdersAPIViewTest(TestCase):
         # Create a product object
         product = Product.objects.create(name="Product", price=9.99)
 
-        # Create an order item with a valid product
-        order = OrderItem.objects.create(
-            customer=self.user, product=product, status="Undecided"
-        )
+        # Create an order with an item for a valid product
+        order = Order.objects.create(customer=self.user, status="Undecided")
+        OrderItem.objects.create(order_of_item=order, product=product, quantity=1, price=product.price)
 
     def test_get_orders(self):
         url = reverse("orders")
@@ -99,3 +118,662 @@ class ProductAPIViewTest(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["name"], "Product")
         self.assertEqual(response.data["price"], "9.99")
+
+
+class ProductsAPIViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name="Tools")
+        for i in range(5):
+            Product.objects.create(name=f"Product {i}", price=10 + i, category=category)
+
+    def test_get_products_unpaginated(self):
+        response = self.client.get(reverse("products"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(response.data[0]["category"], "Tools")
+
+    def test_get_products_cursor_pages(self):
+        url = reverse("products") + "?page_size=2"
+        names = []
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data["results"]), 2)
+            names += [product["name"] for product in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(names, [f"Product {i}" for i in range(5)])
+
+    def test_list_is_compact(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("products"))
+        self.assertNotIn("description", response.data[0])
+        self.assertEqual(response.data[0]["thumbnail"], "/media/default/image.jpg")
+        self.assertNotIn('"description"', queries[0]["sql"])
+
+    def test_sparse_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("products") + "?fields=id,name&page_size=2")
+        self.assertEqual(set(response.data["results"][0]), {"id", "name"})
+        self.assertNotIn("JOIN", queries[0]["sql"])
+        product = Product.objects.first()
+        response = self.client.get(reverse("product", args=[product.pk]) + "?fields=name,rating_histogram")
+        self.assertEqual(set(response.data), {"name", "rating_histogram"})
+
+    def test_unknown_sparse_field(self):
+        response = self.client.get(reverse("products") + "?fields=id,secret")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("secret", str(response.data["fields"]))
+
+    def test_matches_list_serializer(self):
+        Product.objects.create(name="No category", price=3, created=timezone.now() - timedelta(days=60))
+        products = Product.objects.select_related("category").order_by("created", "pk")
+        response = self.client.get(reverse("products"))
+        self.assertEqual(response.json(), json.loads(json.dumps(ProductListSerializer(products, many=True).data)))
+        self.assertEqual(response.json()[0]["old_price"], "3.00")
+        response = self.client.get(reverse("products") + "?fields=name,category")
+        self.assertEqual(response.json()[0], {"name": "No category", "category": None})
+
+    def test_row_serializer_rejects_computed_fields(self):
+        with self.assertRaises(UnsupportedField):
+            RowSerializer(CategoryTreeSerializer())
+
+    def test_get_products_invalid_cursor(self):
+        response = self.client.get(reverse("products") + "?cursor=garbage")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_products_sorted_by_rating(self):
+        user = User.objects.create_user(username="reviewer", password="testpassword")
+        products = list(Product.objects.order_by("pk"))
+        for product, ratings in zip(products, [[3], [5, 4], [], [1], [5]]):
+            for rating in ratings:
+                ProductReview.objects.create(user=user, product=product, review="-", rating=rating)
+
+        url = reverse("products") + "?page_size=2&ordering=-rating"
+        names = []
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        while url:
+            response = self.client.get(url)
+            names += [product["name"] for product in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(names, ["Product 4", "Product 1", "Product 0", "Product 3", "Product 2"])
+        self.assertEqual(response.data["results"][-1]["rating_count"], 0)
+
+        response = self.client.get(reverse("products") + "?ordering=-rating")
+        self.assertEqual(response.data[1]["rating_avg"], "4.50")
+        response = self.client.get(reverse("product", args=[products[1].pk]))
+        self.assertEqual(response.data["rating_histogram"], {"1": 0, "2": 0, "3": 0, "4": 1, "5": 1})
+
+    def test_get_products_sorted_by_price(self):
+        response = self.client.get(reverse("products") + "?ordering=-price&page_size=3")
+        self.assertEqual([p["price"] for p in response.data["results"]], ["14.00", "13.00", "12.00"])
+
+    def test_get_products_unknown_ordering(self):
+        response = self.client.get(reverse("products") + "?ordering=name")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class FastJSONRendererTest(TestCase):
+    def test_renders_like_drf(self):
+        data = [{"price": Decimal("1.50"), "name": "Kettlebell \u00e9", "created": timezone.now(), "image": None}]
+        expected = json.loads(JSONRenderer().render(data))
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), expected)
+        with mock.patch("api.renderers.orjson", None):
+            self.assertEqual(json.loads(FastJSONRenderer().render(data)), expected)
+        self.assertIn(b"\n  ", FastJSONRenderer().render(data, "application/json; indent=2"))
+        self.assertEqual(FastJSONRenderer().render(None), b"")
+
+
+class ProductSearchAPIViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        Product.objects.create(
+            name="Adjustable Dumbbell", price=50, description="<p>Iron plates for strength training</p>"
+        )
+        Product.objects.create(name="Yoga Mat", price=20, short_description="Non-slip mat for dumbbell workouts")
+        Product.objects.create(name="Protein Bar", price=2, description="<strong>Chocolate</strong> flavour")
+
+    def search(self, query, **params):
+        response = self.client.get(reverse("product-search"), {"q": query, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_prefix_match_ranks_name_hits_first(self):
+        response = self.search("dumb")
+        self.assertEqual([p["name"] for p in response.data["results"]], ["Adjustable Dumbbell", "Yoga Mat"])
+
+    def test_ranking_without_materialized_ctes(self):
+        # SQLite before 3.35 ranks through a LIMIT -1 subquery instead.
+        with mock.patch.object(connection.Database, "sqlite_version_info", (3, 34, 1)):
+            response = self.search("dumb")
+        self.assertEqual([p["name"] for p in response.data["results"]], ["Adjustable Dumbbell", "Yoga Mat"])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(len(self.search("iron train").data["results"]), 1)
+        self.assertEqual(len(self.search("iron yoga").data["results"]), 0)
+
+    def test_html_is_not_indexed(self):
+        self.assertEqual(len(self.search("strong").data["results"]), 0)
+        self.assertEqual(len(self.search("chocolate").data["results"]), 1)
+
+    def test_index_follows_saves_and_deletes(self):
+        bar = Product.objects.get(name="Protein Bar")
+        bar.name = "Energy Bar"
+        bar.save()
+        self.assertEqual(len(self.search("protein").data["results"]), 0)
+        self.assertEqual(len(self.search("energy").data["results"]), 1)
+        bar.delete()
+        self.assertEqual(len(self.search("energy").data["results"]), 0)
+
+    def test_limit_offset_pages(self):
+        response = self.search("dumbbell", limit=1)
+        self.assertEqual(len(response.data["results"]), 1)
+        response = self.client.get(response.data["next"])
+        self.assertEqual(response.data["results"][0]["name"], "Yoga Mat")
+        self.assertIsNone(response.data["next"])
+
+    def test_rebuild_command(self):
+        etag = self.search("pilates")["ETag"]
+        Product.objects.filter(name="Yoga Mat").update(name="Pilates Mat")
+        call_command("rebuild_search_index", stdout=StringIO())
+        response = self.client.get(reverse("product-search"), {"q": "pilates"}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 1)
+
+    def test_query_without_words(self):
+        self.assertEqual(self.search('"*)').data["results"], [])
+
+
+class MainPageSearchTest(TestCase):
+    def test_main_page_search(self):
+        Product.objects.create(name="Rated", price=10)
+        Product.objects.create(name="Kettlebell", price=30)
+        response = self.client.get(reverse("main"), {"q": "kettle"})
+        self.assertContains(response, "Kettlebell")
+        self.assertNotContains(response, "Rated")
+        response = self.client.get(reverse("main"), {"q": "treadmill"})
+        self.assertContains(response, "No products match")
+
+
+class ProductFacetsAPIViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.tools = Category.objects.create(name="Tools")
+        self.food = Category.objects.create(name="Food")
+        old = timezone.now() - timedelta(days=40)
+        self.products = {
+            "hammer": Product.objects.create(name="Hammer", price=20, category=self.tools),
+            "saw": Product.objects.create(name="Saw", price=60, category=self.tools, created=old),
+            "bar": Product.objects.create(name="Protein Bar", price=3, category=self.food),
+            "shake": Product.objects.create(name="Protein Shake", price=30, category=self.food),
+        }
+        ProductInfo.objects.create(product=self.products["bar"], parametrs="Flavour", parameter_description="Chocolate")
+        ProductInfo.objects.create(product=self.products["shake"], parametrs="Flavour", parameter_description="Chocolate")
+        ProductInfo.objects.create(product=self.products["shake"], parametrs="Weight", parameter_description="1 kg")
+        user = User.objects.create_user(username="reviewer", password="testpassword")
+        ProductReview.objects.create(user=user, product=self.products["saw"], review="-", rating=5)
+
+    def get(self, query=""):
+        return self.client.get(reverse("product-facets") + query)
+
+    def counts(self, facet, data):
+        return {entry.get("name", entry.get("value")): entry["count"] for entry in data["facets"][facet]}
+
+    def test_unfiltered_counts(self):
+        response = self.get()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 4)
+        self.assertEqual(self.counts("category", response.data), {"Tools": 2, "Food": 2})
+        self.assertEqual(self.counts("price", response.data)["0-25"], 2)
+        self.assertEqual(self.counts("price", response.data)["25-50"], 2)  # 60 on sale for 48
+        self.assertEqual(self.counts("rating", response.data)[4], 1)
+        self.assertEqual(response.data["facets"]["on_sale"], 1)
+        self.assertEqual(response.data["facets"]["info"]["Flavour"], [{"value": "Chocolate", "count": 2}])
+
+    def test_own_selection_does_not_narrow_own_counts(self):
+        response = self.get(f"?category={self.food.id}&price=25-50")
+        self.assertEqual([p["name"] for p in response.data["results"]], ["Protein Shake"])
+        # Category counts ignore the category filter but honour the price one.
+        self.assertEqual(self.counts("category", response.data), {"Tools": 1, "Food": 1})
+        self.assertEqual(self.counts("price", response.data)["0-25"], 1)
+        self.assertEqual(response.data["facets"]["info"]["Weight"], [{"value": "1 kg", "count": 1}])
+
+    def test_category_counts_cover_subcategories(self):
+        snacks = Category.objects.create(name="Snacks", parent=self.food)
+        Product.objects.create(name="Rice Cake", price=2, category=snacks)
+        response = self.get("?price=0-25")
+        # Food's count is what selecting it returns: its products and Snacks'.
+        self.assertEqual(self.counts("category", response.data), {"Food": 2, "Tools": 1, "Snacks": 1})
+        response = self.get(f"?category={self.food.id}&price=0-25")
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_info_and_rating_filters(self):
+        response = self.get("?info=Flavour:Chocolate&info=Weight:1 kg")
+        self.assertEqual([p["name"] for p in response.data["results"]], ["Protein Shake"])
+        response = self.get("?rating=4.5&on_sale=true")
+        self.assertEqual([p["name"] for p in response.data["results"]], ["Saw"])
+
+    def test_counts_use_three_queries(self):
+        with self.assertNumQueries(4):
+            self.get("?price=0-25&info=Flavour:Chocolate")
+        # Cached until the catalog changes.
+        with self.assertNumQueries(1):
+            self.get("?price=0-25&info=Flavour:Chocolate")
+
+    def test_info_changes_refresh_counts_and_etag(self):
+        etag = self.get("?info=Flavour:Chocolate")["ETag"]
+        info = ProductInfo.objects.create(
+            product=self.products["hammer"], parametrs="Flavour", parameter_description="Chocolate"
+        )
+        response = self.client.get(
+            reverse("product-facets") + "?info=Flavour:Chocolate", HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assertEqual(response.data["facets"]["info"]["Flavour"], [{"value": "Chocolate", "count": 3}])
+        info.delete()
+        response = self.get("?info=Flavour:Chocolate")
+        self.assertEqual(response.data["facets"]["info"]["Flavour"], [{"value": "Chocolate", "count": 2}])
+
+    def test_search_combines_with_facets(self):
+        response = self.get(f"?q=protein&category={self.food.id}&price=0-25")
+        self.assertEqual([p["name"] for p in response.data["results"]], ["Protein Bar"])
+        self.assertEqual(self.counts("price", response.data)["25-50"], 1)
+
+    def test_invalid_facet(self):
+        response = self.get("?price=1-2")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("price", response.data)
+
+
+class CategoryTreeAPIViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.food = Category.objects.create(name="Food")
+        self.snacks = Category.objects.create(name="Snacks", parent=self.food)
+        self.tools = Category.objects.create(name="Tools")
+        Product.objects.create(name="Protein Bar", price=3, category=self.snacks)
+        Product.objects.create(name="Protein Shake", price=30, category=self.food)
+        Product.objects.create(name="Hammer", price=20, category=self.tools)
+
+    def test_category_tree(self):
+        response = self.client.get(reverse("categories"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(c["name"], c["parent"], c["depth"], c["product_count"]) for c in response.data],
+            [("Food", None, 0, 2), ("Snacks", self.food.id, 1, 1), ("Tools", None, 0, 1)],
+        )
+
+    def test_products_of_a_subtree(self):
+        response = self.client.get(reverse("products"), {"category": self.food.id, "page_size": 10})
+        self.assertEqual(
+            sorted(p["name"] for p in response.data["results"]), ["Protein Bar", "Protein Shake"]
+        )
+        response = self.client.get(reverse("product-facets"), {"category": self.snacks.id})
+        self.assertEqual([p["name"] for p in response.data["results"]], ["Protein Bar"])
+        response = self.client.get(reverse("products"), {"category": "food"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncAPIViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        category = Category.objects.create(name="Tools")
+        self.products = [
+            Product.objects.create(name=f"Product {i}", price=10 + i, category=category) for i in range(3)
+        ]
+        order = Order.objects.create(customer=self.user, status="Undecided")
+        OrderItem.objects.create(order_of_item=order, product=self.products[0], quantity=2, price=10)
+        add_to_cart(Cart.objects.create(user=self.user), self.products[1], 1)
+
+    def assertSameResponse(self, name, async_name, args=(), query=""):
+        expected = self.client.get(reverse(name, args=args) + query)
+        response = self.client.get(reverse(async_name, args=args) + query)
+        self.assertEqual(response.status_code, expected.status_code)
+        # Only the pagination links differ, by their path.
+        content = response.content.replace(b"/api/async/", b"/api/")
+        self.assertEqual(json.loads(content), json.loads(expected.content))
+        return response
+
+    def test_same_responses_as_sync_views(self):
+        self.assertSameResponse("products", "async-products")
+        self.assertSameResponse("products", "async-products", query="?page_size=2&ordering=-price&fields=id,name")
+        self.assertSameResponse("product", "async-product", args=[self.products[0].pk])
+        self.assertSameResponse("product", "async-product", args=[0])
+        self.assertSameResponse("view-cart", "async-view-cart")
+        self.assertSameResponse("orders", "async-orders")
+        self.assertSameResponse("orders", "async-orders", query="?page_size=1")
+        self.assertSameResponse("orders", "async-orders", query="?status=Unknown")
+
+    def test_conditional_get(self):
+        response = self.client.get(reverse("async-products"))
+        response = self.client.get(reverse("async-products"), HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_served_on_the_event_loop(self):
+        token = await sync_to_async(lambda: str(RefreshToken.for_user(self.user).access_token))()
+        headers = {"Authorization": f"Bearer {token}"}
+        response = await self.async_client.get(reverse("async-orders"), headers=headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]["order_items"][0]["quantity"], 2)
+        response = await self.async_client.get(reverse("async-view-cart"), headers=headers)
+        self.assertEqual([item["product"]["name"] for item in response.json()["items"]], ["Product 1"])
+        response = await self.async_client.get(reverse("async-orders"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class OrdersListingAPIViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username="admin", password="testpassword")
+        self.admin.role = User.Role.ADMIN
+        self.admin.save()
+        self.client.force_authenticate(user=self.admin)
+        self.category = Category.objects.create(name="Tools")
+
+    def create_orders(self, count, status="Undecided"):
+        for i in range(count):
+            customer = User.objects.create_user(username=f"customer{Order.objects.count()}")
+            order = Order.objects.create(customer=customer, status=status)
+            for j in range(3):
+                product = Product.objects.create(name=f"P{i}-{j}", price=5, category=self.category)
+                OrderItem.objects.create(order_of_item=order, product=product, quantity=1, price=5)
+
+    def test_query_count_independent_of_order_count(self):
+        self.create_orders(2)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("orders"))
+        self.assertEqual(len(response.data), 2)
+
+        self.create_orders(8)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("orders"))
+        self.assertEqual(len(response.data), 10)
+        self.assertEqual(response.data[0]["order_items"][0]["product"]["category"], {"name": "Tools"})
+        # Order items nest the full product, not the listing representation.
+        self.assertIn("rating_histogram", response.data[0]["order_items"][0]["product"])
+
+    def test_matches_order_serializer(self):
+        self.create_orders(3)
+        Order.objects.create(customer=self.admin, status="Paid")
+        orders = with_order_details(Order.objects.order_by("created", "pk"))
+        response = self.client.get(reverse("orders"))
+        self.assertEqual(response.json(), json.loads(json.dumps(OrderSerializer(orders, many=True).data)))
+        self.assertEqual(response.json()[-1]["order_items"], [])
+        response = self.client.get(reverse("orders") + "?fields=id,order_items&page_size=2")
+        self.assertEqual(set(response.json()["results"][0]), {"id", "order_items"})
+
+    def test_status_filter_and_pagination(self):
+        self.create_orders(3)
+        self.create_orders(2, status="Paid")
+        response = self.client.get(reverse("orders") + "?status=Paid&page_size=1")
+        self.assertEqual(len(response.data["results"]), 1)
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 1)
+        self.assertIsNone(response.data["next"])
+
+    def test_invalid_filters(self):
+        response = self.client.get(reverse("orders") + "?status=Lost")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(reverse("orders") + "?from=2024-02-30")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductCacheTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(name="Product", price=9.99)
+        self.url = reverse("product", args=[self.product.id])
+
+    def test_detail_is_served_from_cache(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.data["name"], "Product")
+
+    def test_detail_is_invalidated_on_write(self):
+        self.client.get(self.url)
+        self.product.name = "Renamed"
+        self.product.save()
+        self.assertEqual(self.client.get(self.url).data["name"], "Renamed")
+
+        category = Category.objects.create(name="Tools")
+        self.product.category = category
+        self.product.save()
+        self.assertEqual(self.client.get(self.url).data["category"]["name"], "Tools")
+
+        category.name = "Hand tools"
+        category.save()
+        self.assertEqual(self.client.get(self.url).data["category"]["name"], "Hand tools")
+
+    def test_stats_require_admin(self):
+        response = self.client.get(reverse("product-cache-stats"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        admin = User.objects.create_user(username="staff", password="testpassword", is_staff=True)
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(reverse("product-cache-stats"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("hits", response.data)
+
+
+class CatalogConditionalGetTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.product = Product.objects.create(name="Product", price=9.99)
+
+    def test_unchanged_catalog_returns_304_without_queries(self):
+        for url in (reverse("products"), reverse("product", args=[self.product.id])):
+            response = self.client.get(url)
+            etag = response["ETag"]
+            self.assertIn("Last-Modified", response)
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_catalog_change_changes_etag(self):
+        url = reverse("products")
+        etag = self.client.get(url)["ETag"]
+        self.assertNotEqual(self.client.get(url + "?page_size=1")["ETag"], etag)
+
+        Category.objects.create(name="Tools")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class AddToCartAPIViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.product = Product.objects.create(name="Product", price=9.99)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def test_add_increments_existing_item(self):
+        url = reverse("add-to-cart", args=[self.product.id, 2])
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_204_NO_CONTENT)
+        # product lookup, cart lookup, increment
+        with self.assertNumQueries(3):
+            self.client.post(url)
+        item = CartItem.objects.get(cart=self.cart, product=self.product)
+        self.assertEqual(item.quantity, 4)
+        self.assertEqual(item.price_sum, Decimal("39.96"))
+
+    def test_add_to_cart_recovers_from_concurrent_insert(self):
+        # Simulate a request that created the row between our UPDATE and INSERT.
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        original_update = QuerySet.update
+        calls = []
+
+        def update(queryset, **kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                return 0
+            return original_update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", update):
+            add_to_cart(self.cart, self.product, 3)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(CartItem.objects.get(cart=self.cart, product=self.product).quantity, 4)
+
+
+class CreateOrderAPIViewTest(TestCase):
+    order_data = {
+        "address": "Street 1",
+        "postal_code": "00001",
+        "department_number": "7",
+        "phone": "123",
+    }
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def fill_cart(self, lines):
+        for i in range(lines):
+            product = Product.objects.create(name=f"Product {i}", price=2)
+            CartItem.objects.create(cart=self.cart, product=product, quantity=3)
+
+    def checkout_queries(self, lines):
+        self.fill_cart(lines)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse("create-order"), self.order_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return len(queries)
+
+    def test_order_created_and_cart_cleared(self):
+        self.fill_cart(3)
+        response = self.client.post(reverse("create-order"), self.order_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(customer=self.user)
+        self.assertEqual(order.total_price, Decimal("18.00"))
+        self.assertEqual(order.order_items.count(), 3)
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_query_count_independent_of_cart_size(self):
+        self.assertEqual(self.checkout_queries(1), self.checkout_queries(100))
+
+    def test_empty_cart_creates_no_order(self):
+        response = self.client.post(reverse("create-order"), self.order_data, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+
+class UpdateCartItemAPIViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.force_authenticate(user=self.user)
+        cart = Cart.objects.create(user=self.user)
+        self.items = [
+            CartItem.objects.create(cart=cart, product=Product.objects.create(name=f"P{i}", price=2), quantity=1)
+            for i in range(20)
+        ]
+
+    def test_update_is_constant_queries(self):
+        url = reverse("update-cart-item", args=[self.items[0].id, 5])
+        # item lookup, update, totals aggregate
+        with self.assertNumQueries(3):
+            response = self.client.put(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["total_price"], Decimal("48.00"))
+        self.assertEqual(response.data["item_count"], 20)
+        self.items[0].refresh_from_db()
+        self.assertEqual(self.items[0].price_sum, Decimal("10.00"))
+
+    def test_cart_view_does_not_query_per_item(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse("view-cart"))
+        self.assertEqual(len(response.data["items"]), 20)
+
+
+@override_settings(BILL_WORKERS=0, MEDIA_ROOT=tempfile.mkdtemp())
+class OrderGenBillAPIViewTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username="staff", password="testpassword", is_staff=True)
+        self.client.force_authenticate(user=self.admin)
+        self.order = Order.objects.create(customer=self.admin, address="Street 1")
+        product = Product.objects.create(name="Product", price=3)
+        OrderItem.objects.create(order_of_item=self.order, product=product, quantity=2, price=6)
+
+    def generate(self):
+        response = self.client.post(reverse("order_gen_bill", args=[self.order.id]))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        return self.client.get(response.data["status_url"]).data
+
+    def test_bill_is_generated_once_per_content(self):
+        job = self.generate()
+        self.assertEqual(job["status"], "done")
+        self.assertTrue(job["changed"])
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.file.name, job["file"])
+
+        job = self.generate()
+        self.assertFalse(job["changed"])
+        self.assertEqual(self.order.file.name, job["file"])
+
+        Order.objects.filter(id=self.order.id).update(address="Street 2")
+        job = self.generate()
+        self.assertTrue(job["changed"])
+        self.assertNotEqual(self.order.file.name, job["file"])
+
+    def test_job_state_shared_between_processes(self):
+        job_id = BillJob.objects.create(id="queued", order=self.order).id
+        url = reverse("bill_job", args=[job_id])
+        self.assertEqual(self.client.get(url).data["status"], "pending")
+        # A worker in another process finishes the job.
+        BillJob.objects.filter(id=job_id).update(status="done", file="bill.html", changed=True)
+        self.assertEqual(self.client.get(url).data["status"], "done")
+
+        job = self.generate()
+        cache.clear()
+        self.assertEqual(self.client.get(reverse("bill_job", args=[job["job_id"]])).data, job)
+
+    def test_unknown_order_and_job(self):
+        response = self.client.post(reverse("order_gen_bill", args=[self.order.id + 1]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get(reverse("bill_job", args=["missing"]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_FLUSH_INTERVAL=0)
+class RequestMetricsMiddlewareTest(TestCase):
+    def setUp(self):
+        reset_request_metrics()
+        self.client = APIClient()
+        Product.objects.create(name="Product", price=9.99)
+
+    def tearDown(self):
+        reset_request_metrics()
+
+    def test_server_timing_and_aggregates(self):
+        response = self.client.get(reverse("products"))
+        timing = response["Server-Timing"]
+        self.assertIn('desc="1 queries"', timing)
+        self.assertIn("serializer;dur=", timing)
+
+        out = StringIO()
+        call_command("request_metrics", "--json", stdout=out)
+        rows = {row["view"]: row for row in json.loads(out.getvalue())}
+        row = rows["products (api/products/)"]
+        self.assertEqual(row["count"], 1)
+        self.assertEqual(row["max_queries"], 1)
+        self.assertEqual(sum(row["latency_histogram"].values()), 1)
+
+    def test_metrics_endpoint_requires_admin(self):
+        response = self.client.get(reverse("request-metrics"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        admin = User.objects.create_user(username="staff", password="testpassword", is_staff=True)
+        self.client.force_authenticate(user=admin)
+        response = self.client.get(reverse("request-metrics"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # The rejected request above has been recorded.
+        self.assertEqual([row["count"] for row in response.data], [1])
@@ -1,10 +1,33 @@
-from django.test import TestCase, Client
+import json
+import re
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
+from django.db.models import F
+from django.utils import timezone
 from users.models import User
-from market.models import Product, OrderItem
+from market.models import Product, OrderItem, ProductReview, Cart, CartItem, Category, Order
 from django.core.management import call_command
+from market.cache import bump_catalog_version, get_catalog_version
+from market.benchmark import ROUTES, compare, run_benchmark, seed, uncovered_routes
+from market.loadtest import run_loadtest
+from market.catalog import CatalogError, iter_json_array
+from market.categories import CategoryTreeError, category_tree, in_categories, recount_categories
+from market.pricing import annotate_sale_prices, sale_price
+from market.search import search_products
+from market.utils import create_order_from_cart
 
 
+@override_settings(BILL_WORKERS=0, MEDIA_ROOT=tempfile.mkdtemp())
 class MarketTests(TestCase):
     fixtures = ["products.json"]
 
@@ -13,9 +36,8 @@ class MarketTests(TestCase):
         self.client = Client()
         self.user = User.objects.create_user(username="testuser", password="testpass")
         self.product = Product.objects.create(name="Test Product", price=10)
-        self.order_item = OrderItem.objects.create(
-            product=self.product, customer=self.user
-        )
+        self.order_item = Order.objects.create(customer=self.user)
+        OrderItem.objects.create(order_of_item=self.order_item, product=self.product, quantity=1)
 
     def test_main_page_view(self):
         response = self.client.get(reverse("main"))
@@ -49,3 +71,561 @@ class MarketTests(TestCase):
         self.client.login(username="testuser", password="testpass")
         response = self.client.get(reverse("genpayment", args=[self.order_item.pk]))
         self.assertEqual(response.status_code, 302)  # Redirects to showorders
+
+
+class ProductPageCacheTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.product = Product.objects.create(name="Test Product", price=10)
+
+    def test_product_page_cached_until_review_added(self):
+        url = reverse("product-view", args=[self.product.pk])
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(len(response.context["reviews"]), 0)
+
+        ProductReview.objects.create(user=self.user, product=self.product, review="Great", rating=5)
+        response = self.client.get(url)
+        self.assertEqual(len(response.context["reviews"]), 1)
+        self.assertContains(response, "testuser")
+
+
+@override_settings(REVIEWS_PAGE_SIZE=3)
+class ProductReviewPagesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.product = Product.objects.create(name="Popular", price=10)
+        ProductReview.objects.bulk_create(
+            ProductReview(user=self.user, product=self.product, review=f"Review {i}", rating=5)
+            for i in range(7)
+        )
+
+    def test_product_page_renders_first_page(self):
+        response = self.client.get(reverse("product-view", args=[self.product.pk]))
+        self.assertEqual([r.review for r in response.context["reviews"]], ["Review 6", "Review 5", "Review 4"])
+        self.assertContains(response, 'id="more-reviews"')
+
+    def test_fragment_pages_cover_every_review_once(self):
+        url = reverse("product-reviews", args=[self.product.pk])
+        seen = []
+        while url:
+            # Page, authors and the next cursor in one query.
+            with self.assertNumQueries(1):
+                data = self.client.get(url).json()
+            seen += re.findall(r"Review \d", data["html"])
+            url = data["next"]
+        self.assertEqual(seen, [f"Review {i}" for i in range(6, -1, -1)])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("product-reviews", args=[self.product.pk]) + "?cursor=bad")
+        self.assertEqual(response.status_code, 400)
+
+
+class CartCheckoutTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.login(username="testuser", password="testpass")
+        cart = Cart.objects.create(user=self.user)
+        for i in range(3):
+            product = Product.objects.create(name=f"Product {i}", price=5)
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+    def test_cart_page_totals(self):
+        response = self.client.get(reverse("cart"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["total_price"], 30)
+
+    def test_checkout_moves_cart_into_order(self):
+        data = {"phone": "1", "address": "A", "postal_code": "2", "department_number": "3"}
+        response = self.client.post(reverse("cart"), data)
+        self.assertRedirects(response, reverse("showorders"), fetch_redirect_response=False)
+        order = Order.objects.get(customer=self.user)
+        self.assertEqual(order.total_price, 30)
+        self.assertEqual(order.order_items.count(), 3)
+        self.assertFalse(CartItem.objects.exists())
+
+
+    def test_checkout_keeps_lines_added_meanwhile(self):
+        cart = Cart.objects.get(user=self.user)
+        late = Product.objects.create(name="Late", price=7)
+        bulk_create = OrderItem.objects.bulk_create
+
+        def add_line_then_insert(items):
+            # A line committed after the cart was read, before it is emptied.
+            CartItem.objects.create(cart=cart, product=late, quantity=1)
+            return bulk_create(items)
+
+        order = Order(customer=self.user, phone="1", address="A", postal_code="2", department_number="3")
+        with mock.patch.object(OrderItem.objects, "bulk_create", side_effect=add_line_then_insert):
+            create_order_from_cart(cart, order)
+        self.assertEqual(order.order_items.count(), 3)
+        self.assertEqual(list(cart.items.values_list("product__name", flat=True)), ["Late"])
+
+@override_settings(PRODUCT_SALE_RULES=[(30, "0.8"), (90, "0.5")])
+class SalePricingTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.new = Product.objects.create(name="New", price=10, created=now)
+        self.old = Product.objects.create(name="Old", price=10, created=now - timedelta(days=40))
+        self.older = Product.objects.create(name="Older", price="9.99", created=now - timedelta(days=100))
+
+    def test_save_does_not_compound_discount(self):
+        for _ in range(3):
+            self.old.save()
+        self.old.refresh_from_db()
+        self.assertEqual(self.old.price, Decimal("10"))
+        self.assertEqual(self.old.effective_price, Decimal("8.00"))
+        self.assertEqual(self.old.old_price, Decimal("10"))
+
+    def test_oldest_matching_rule_applies(self):
+        self.assertEqual(self.new.effective_price, Decimal("10"))
+        self.assertIsNone(self.new.old_price)
+        self.assertEqual(self.older.effective_price, Decimal("5.00"))
+
+    def test_annotation_matches_python(self):
+        for product in annotate_sale_prices(Product.objects.all()):
+            self.assertEqual(
+                (product.sale_price, product.sale_old_price), sale_price(product.price, product.created)
+            )
+
+    def test_reprice_command_updates_stale_rows(self):
+        # Simulate products that aged past a threshold since their last save.
+        Product.objects.update(effective_price=F("price"), old_price=None)
+        out = StringIO()
+        call_command("reprice_products", "--dry-run", "--chunk-size", "2", stdout=out)
+        self.assertIn("would change 2", out.getvalue())
+        self.assertIn("going on sale: 2", out.getvalue())
+        self.assertFalse(Product.objects.filter(old_price__isnull=False).exists())
+
+        out = StringIO()
+        call_command("reprice_products", "--chunk-size", "2", stdout=out)
+        self.assertIn("in 2 chunks, changed 2", out.getvalue())
+        self.old.refresh_from_db()
+        self.assertEqual((self.old.effective_price, self.old.old_price), (Decimal("8.00"), Decimal("10")))
+
+        out = StringIO()
+        call_command("reprice_products", stdout=out)
+        self.assertIn("changed 0", out.getvalue())
+
+    def test_cart_charges_effective_price(self):
+        user = User.objects.create_user(username="buyer", password="pass")
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.old, quantity=2)
+        self.assertEqual(cart.get_totals()["total_price"], Decimal("16.00"))
+
+
+class ProductRatingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.product = Product.objects.create(name="Rated", price=10)
+
+    def review(self, rating):
+        return ProductReview.objects.create(user=self.user, product=self.product, review="-", rating=rating)
+
+    def assertRating(self, count, avg, histogram):
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, count)
+        self.assertEqual(self.product.rating_avg, avg)
+        self.assertEqual(list(self.product.rating_histogram.values()), histogram)
+
+    def test_reviews_update_aggregates_incrementally(self):
+        first = self.review(5)
+        second = self.review(2)
+        self.review(None)
+        self.assertRating(2, Decimal("3.50"), [0, 1, 0, 0, 1])
+
+        second.rating = 4
+        second.save()
+        self.assertRating(2, Decimal("4.50"), [0, 0, 0, 1, 1])
+
+        first.delete()
+        ProductReview.objects.get(pk=second.pk).delete()
+        self.assertRating(0, None, [0, 0, 0, 0, 0])
+
+    def test_product_save_keeps_ratings(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        self.review(3)
+        stale.name = "Renamed"
+        stale.save()
+        self.assertRating(1, Decimal("3.00"), [0, 0, 1, 0, 0])
+
+    def test_recompute_command(self):
+        ProductReview.objects.bulk_create(
+            ProductReview(user=self.user, product=self.product, review="-", rating=rating)
+            for rating in (1, 2, 2)
+        )
+        self.assertRating(0, None, [0, 0, 0, 0, 0])
+        out = StringIO()
+        call_command("recompute_ratings", "--chunk-size", "1", stdout=out)
+        self.assertIn("Recomputed ratings of 1 products", out.getvalue())
+        self.assertRating(3, Decimal("1.67"), [1, 2, 0, 0, 0])
+
+    def test_main_page_shows_and_sorts_by_rating(self):
+        self.review(4)
+        response = self.client.get(reverse("main") + "?sort=-rating")
+        self.assertContains(response, "4.00&#9733; (1)")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class DownloadFileViewTests(TestCase):
+    content = b"0123456789" * 100
+
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.client.login(username="testuser", password="testpass")
+        self.order = Order.objects.create(customer=self.user)
+        self.order.file.save("bill.html", ContentFile(self.content))
+        self.url = reverse("view_html", args=[self.order.pk])
+
+    def test_full_download_is_streamed(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response["Content-Type"], "text/html")
+        self.assertEqual(response["Content-Length"], str(len(self.content)))
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+
+    def test_range_request(self):
+        response = self.client.get(self.url, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.content)}")
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(b"".join(response.streaming_content), self.content[-5:])
+
+        response = self.client.get(self.url, HTTP_RANGE="bytes=5000-")
+        self.assertEqual(response.status_code, 416)
+
+    def test_suffix_range_of_empty_file(self):
+        self.order.file.save("empty.html", ContentFile(b""))
+        response = self.client.get(self.url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */0")
+
+    @override_settings(SENDFILE_BACKEND="x-accel-redirect")
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response["X-Accel-Redirect"], "/protected-media/" + self.order.file.name)
+        self.assertEqual(response.content, b"")
+
+
+class CatalogImportExportTests(TestCase):
+    def run_command(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command(*args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_fixture_and_round_trip(self):
+        out, _ = self.run_command("import_products", "products.json", "--batch-size", "2")
+        self.assertIn("5 created, 0 updated, 0 skipped", out)
+        wrench = Product.objects.get(pk=10)
+        self.assertEqual(wrench.price, Decimal("19.99"))
+        # Sale prices are derived as on save; these products are old.
+        self.assertEqual((wrench.effective_price, wrench.old_price), (Decimal("15.99"), Decimal("19.99")))
+        self.assertEqual(list(search_products(Product.objects.all(), "wrench").values_list("pk", flat=True)), [11, 10])
+
+        Product.objects.filter(pk=10).update(category=Category.objects.create(name="Tools"))
+        for extension in ("json", "jsonl", "csv"):
+            path = f"{tempfile.mkdtemp()}/catalog.{extension}"
+            out, _ = self.run_command("export_products", path, "--chunk-size", "2")
+            self.assertIn("Exported 5 products", out)
+            Product.objects.filter(pk=10).update(name="Renamed", category=None)
+            out, _ = self.run_command("import_products", path)
+            self.assertIn("0 created, 5 updated", out)
+            wrench = Product.objects.get(pk=10)
+            self.assertEqual((wrench.name, wrench.category.name), ("Wrench Set", "Tools"))
+        self.assertEqual(Category.objects.filter(name="Tools").count(), 1)
+
+    def test_partial_records_keep_other_fields(self):
+        old = timezone.now() - timedelta(days=60)
+        gym = Category.objects.create(name="Gym")
+        bench = Product.objects.create(
+            name="Bench", price=100, category=gym, description="Flat bench", created=old
+        )
+        path = f"{tempfile.mkdtemp()}/catalog.csv"
+        with open(path, "w") as f:
+            f.write(f"id,name,price\n{bench.pk},Incline Bench,50.00\n")
+        out, _ = self.run_command("import_products", path)
+        self.assertIn("0 created, 1 updated", out)
+        bench.refresh_from_db()
+        self.assertEqual((bench.name, bench.price, bench.category, bench.created), ("Incline Bench", 50, gym, old))
+        self.assertEqual((bench.description, bench.old_price), ("Flat bench", Decimal("50.00")))
+        self.assertEqual(list(search_products(Product.objects.all(), "flat incline").values_list("pk", flat=True)), [bench.pk])
+
+    def test_invalid_records_are_skipped(self):
+        path = f"{tempfile.mkdtemp()}/catalog.jsonl"
+        with open(path, "w") as f:
+            f.write('{"name": "Bench", "price": "12.50", "category": "Gym"}\n')
+            f.write('{"name": "Rack", "price": "cheap"}\n')
+            f.write('{"name": "Plate", "category": 999}\n')
+            f.write('{"name": "Bar", "colour": "red"}\n')
+        out, err = self.run_command("import_products", path)
+        self.assertIn("1 created, 0 updated, 3 skipped", out)
+        self.assertIn("record 2: price:", err)
+        self.assertIn("record 3: category: unknown category 999", err)
+        self.assertIn("record 4: Unknown field(s): colour", err)
+        self.assertEqual(Product.objects.get().category.name, "Gym")
+
+    def test_json_array_is_read_incrementally(self):
+        records = [{"pk": i, "price": Decimal("1.25") * i, "name": "x" * i} for i in range(1, 40)]
+        text = json.dumps(records, default=str).replace('"price": "', '"price": ').replace('", "name"', ', "name"')
+        self.assertEqual(list(iter_json_array(StringIO(text), read_size=7)), records)
+        with self.assertRaises(CatalogError):
+            list(iter_json_array(StringIO('[{"pk": 1}, {"pk": 2'), read_size=4))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), IMAGE_WORKERS=0)
+class ImageVariantTests(TestCase):
+    def png(self, size=(2000, 1000), color="red"):
+        buffer = BytesIO()
+        Image.new("RGB", size, color).save(buffer, "PNG")
+        return ContentFile(buffer.getvalue(), name="photo.png")
+
+    def create_product(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Product.objects.create(name="Bench", price=10, image=self.png(**kwargs))
+
+    def test_upload_creates_webp_derivatives(self):
+        product = self.create_product()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants["source"], product.image.name)
+        with product.image.storage.open(product.image_variants["thumb"]) as f:
+            thumb = Image.open(f)
+            self.assertEqual((thumb.format, thumb.size), ("WEBP", (320, 160)))
+        self.assertTrue(product.thumbnail_url.endswith(".webp"))
+
+        response = Client().get(reverse("products"))
+        self.assertEqual(response.json()[0]["thumbnail"], product.thumbnail_url)
+        response = Client().get(reverse("product", args=[product.pk]))
+        self.assertEqual(set(response.json()["image_variants"]), {"thumb", "large"})
+
+        # Derivative names depend on the content only.
+        other = self.create_product()
+        other.refresh_from_db()
+        self.assertEqual(other.image_variants["thumb"], product.image_variants["thumb"])
+
+    def test_new_image_serves_original_until_processed(self):
+        product = self.create_product()
+        product.refresh_from_db()
+        product.image = self.png(color="blue")
+        product.save()
+        self.assertEqual(product.thumbnail_url, product.image.url)
+        call_command("generate_image_variants", stdout=StringIO())
+        product.refresh_from_db()
+        self.assertNotEqual(product.thumbnail_url, product.image.url)
+
+    def test_backfill_command(self):
+        product = self.create_product()
+        Product.objects.update(image_variants={})
+        Product.objects.create(name="No file", price=1, image="products/missing.jpg")
+        out = StringIO()
+        with self.assertLogs("market.images", "WARNING"):
+            call_command("generate_image_variants", "--chunk-size", "1", stdout=out)
+        self.assertIn("scanned 2, updated 1, 1 without a readable image", out.getvalue())
+        product.refresh_from_db()
+        self.assertIn("thumb", product.image_variants)
+        out = StringIO()
+        with self.assertLogs("market.images", "WARNING"):
+            call_command("generate_image_variants", stdout=out)
+        self.assertIn("updated 0, 1 without", out.getvalue())
+
+
+    def test_default_image_is_skipped(self):
+        with self.assertNoLogs("market.images"), self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Product.objects.create(name="Placeholder", price=1)
+        self.assertEqual(callbacks, [])
+        Product.objects.bulk_create([Product(name="Imported", price=2)])
+        out = StringIO()
+        with self.assertNoLogs("market.images"):
+            call_command("generate_image_variants", stdout=out)
+        self.assertIn("scanned 0, updated 0, 0 without a readable image", out.getvalue())
+        self.assertFalse(Product.objects.exclude(image_variants={}).exists())
+
+class MainPageCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpass")
+        self.bands = Category.objects.create(name="Bands")
+        self.mat = Product.objects.create(name="Yoga Mat", price=20)
+        self.band = Product.objects.create(name="Resistance Band", price=5, category=self.bands)
+
+    def test_anonymous_page_cached_until_catalog_changes(self):
+        url = reverse("main")
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertContains(response, "Yoga Mat")
+        self.assertNotContains(response, "buy-button")
+
+        # Category filters have their own entries.
+        response = self.client.get(url, {"category": self.bands.pk})
+        self.assertContains(response, "Resistance Band")
+        self.assertNotContains(response, "Yoga Mat")
+
+        self.mat.name = "Cork Yoga Mat"
+        self.mat.save()
+        self.assertContains(self.client.get(url), "Cork Yoga Mat")
+
+    def test_product_cards_cached_per_product_version(self):
+        self.client.login(username="testuser", password="testpass")
+        url = reverse("main")
+        self.client.get(url)
+        # Session, user, product ids; cards and the category bar are cached.
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertContains(response, "buy-button", count=2)
+
+        self.band.price = 7
+        self.band.save()
+        # Only the changed card is loaded again, and the category bar of
+        # the new catalog version.
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertContains(response, "Price: 7.00")
+
+    def catalog_cache_expired(self):
+        later = time.time() + settings.CATALOG_VERSION_TIMEOUT + 1
+        return mock.patch("django.core.cache.backends.locmem.time.time", return_value=later)
+
+    def test_catalog_version_shared_through_database(self):
+        version, _ = get_catalog_version()
+        # Another process, with a cache of its own, changes the catalog.
+        other = {"other": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "other"}}
+        with self.settings(CACHES=other, PRODUCT_CACHE_ALIAS="other"):
+            bump_catalog_version()
+            bumped, _ = get_catalog_version()
+        self.assertNotEqual(bumped, version)
+        # Seen here once the cached copy expires.
+        self.assertEqual(get_catalog_version()[0], version)
+        with self.catalog_cache_expired():
+            self.assertEqual(get_catalog_version()[0], bumped)
+
+    def test_reprice_reaches_other_processes(self):
+        self.client.login(username="testuser", password="testpass")
+        url = reverse("main")
+        self.client.get(url)
+        # The command runs in a process with a cache of its own.
+        Product.objects.filter(pk=self.mat.pk).update(price=25)
+        other = {"other": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "other"}}
+        with self.settings(CACHES=other, PRODUCT_CACHE_ALIAS="other"):
+            call_command("reprice_products", stdout=StringIO())
+        with self.catalog_cache_expired():
+            self.assertContains(self.client.get(url), "Price: 25.00")
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        self.sport = Category.objects.create(name="Sport")
+        self.fitness = Category.objects.create(name="Fitness", parent=self.sport)
+        self.weights = Category.objects.create(name="Weights", parent=self.fitness)
+        self.outdoor = Category.objects.create(name="Outdoor")
+
+    def counts(self):
+        return dict(Category.objects.values_list("name", "product_count"))
+
+    def test_paths_and_subtree_filter(self):
+        self.assertEqual(self.weights.path, f"{self.sport.cid}/{self.fitness.cid}/{self.weights.cid}/")
+        self.assertEqual(self.weights.depth, 2)
+        Product.objects.create(name="Kettlebell", price=30, category=self.weights)
+        Product.objects.create(name="Tent", price=90, category=self.outdoor)
+        with self.assertNumQueries(1):
+            names = list(Product.objects.filter(in_categories([self.sport.pk])).values_list("name", flat=True))
+        self.assertEqual(names, ["Kettlebell"])
+        self.assertEqual([c.tree_name for c in category_tree()], ["Outdoor", "Sport", "\u2014 Fitness", "\u2014 \u2014 Weights"])
+
+    def test_product_counts_follow_products(self):
+        bell = Product.objects.create(name="Kettlebell", price=30, category=self.weights)
+        Product.objects.create(name="Mat", price=20, category=self.fitness)
+        self.assertEqual(self.counts(), {"Sport": 2, "Fitness": 2, "Weights": 1, "Outdoor": 0})
+
+        bell.category = self.outdoor
+        bell.save()
+        self.assertEqual(self.counts(), {"Sport": 1, "Fitness": 1, "Weights": 0, "Outdoor": 1})
+
+        # Loaded without its category, then moved.
+        bell = Product.objects.only("name").get(pk=bell.pk)
+        bell.category = self.weights
+        bell.save()
+        self.assertEqual(self.counts(), {"Sport": 2, "Fitness": 2, "Weights": 1, "Outdoor": 0})
+
+        bell.delete()
+        self.assertEqual(self.counts(), {"Sport": 1, "Fitness": 1, "Weights": 0, "Outdoor": 0})
+
+    def test_moving_and_deleting_subtrees(self):
+        Product.objects.create(name="Kettlebell", price=30, category=self.weights)
+        self.fitness.parent = self.outdoor
+        self.fitness.save()
+        self.weights.refresh_from_db()
+        self.assertEqual(self.weights.path, f"{self.outdoor.cid}/{self.fitness.cid}/{self.weights.cid}/")
+        self.assertEqual(self.counts(), {"Sport": 0, "Fitness": 1, "Weights": 1, "Outdoor": 1})
+
+        self.outdoor.parent = self.weights
+        with self.assertRaises(CategoryTreeError):
+            self.outdoor.save()
+
+        self.fitness.delete()
+        self.assertEqual(self.counts(), {"Sport": 0, "Outdoor": 0})
+        self.assertEqual(Product.objects.get().category, None)
+
+    def test_recount_and_main_page_filter(self):
+        Product.objects.create(name="Kettlebell", price=30, category=self.weights)
+        Product.objects.create(name="Tent", price=90, category=self.outdoor)
+        Category.objects.update(product_count=0)
+        recount_categories()
+        self.assertEqual(self.counts(), {"Sport": 1, "Fitness": 1, "Weights": 1, "Outdoor": 1})
+
+        response = self.client.get(reverse("main"), {"category": self.sport.pk})
+        self.assertContains(response, "Kettlebell")
+        self.assertNotContains(response, "Tent")
+        self.assertContains(response, "\u2014 \u2014 Weights (1)")
+
+
+class ExplainHotQueriesTests(TestCase):
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command("explain_hot_queries", stdout=out)
+        self.assertNotIn("FULL SCAN", out.getvalue())
+
+    def test_full_scan_detection(self):
+        from market.management.commands.explain_hot_queries import find_full_scans
+
+        self.assertEqual(find_full_scans("3 0 0 SCAN market_order", "market_order"), ["3 0 0 SCAN market_order"])
+        self.assertEqual(find_full_scans("SEARCH market_order USING INDEX x (status=?)", "market_order"), [])
+        self.assertEqual(len(find_full_scans("SCAN market_order USING INDEX x", "market_order")), 1)
+        self.assertEqual(len(find_full_scans("SCAN market_order USING COVERING INDEX x", "market_order")), 1)
+        self.assertEqual(len(find_full_scans("Seq Scan on market_order  (cost=0.00..1.01)", "market_order")), 1)
+
+
+@override_settings(BILL_WORKERS=0, MEDIA_ROOT=tempfile.mkdtemp())
+class BenchmarkTests(TestCase):
+    def test_every_route_is_benchmarked(self):
+        self.assertEqual(uncovered_routes(), [])
+
+    def test_benchmark_smoke(self):
+        data = seed(scale=30)
+        results = run_benchmark(data, iterations=2)
+        self.assertEqual(len(results), len(ROUTES))
+        for key, metrics in results.items():
+            self.assertTrue(all(code < 400 for code in metrics["status"]), key)
+
+        baseline = {"routes": {key: dict(metrics) for key, metrics in results.items()}}
+        current = {"routes": {key: dict(metrics) for key, metrics in results.items()}}
+        self.assertEqual(compare(current, baseline), ([], []))
+        current["routes"]["GET api:products (anonymous)"]["queries"] += 1
+        query_regressions, latency_regressions = compare(current, baseline)
+        self.assertEqual(len(query_regressions), 1)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class LoadTestTests(TransactionTestCase):
+    # Worker threads use their own connections, which only see committed rows.
+    def test_loadtest_smoke(self):
+        data = seed(scale=30)
+        results = run_loadtest(data, requests=16, concurrency=4, wsgi_threads=2, db_latency=1)
+        for name in ("wsgi", "asgi"):
+            self.assertEqual(results[name]["requests"], 16)
+            self.assertEqual(results[name]["failures"], 0, name)